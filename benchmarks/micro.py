@@ -0,0 +1,374 @@
+"""
+毎ステップ・毎チャンク実行されるヘルパーのマイクロベンチマーク。
+
+大きな合成トランスクリプト（数百メッセージ、100KB 級のツール出力、日本語中心の本文）を作り、
+各関数の所要時間を統計付きで計測する。複数のサイズで測って対数の傾き（成長次数）を出すので、
+長いセッションで効いてくる二乗オーダーの処理を数値で確認・監視できる。
+結果は JSON で書き出し、別のコミットの結果と比較できる。
+
+使い方（リポジトリのルートで実行）:
+    python -m benchmarks.micro                          # 既定のサイズ (100, 200, 400 メッセージ) で全ケース
+    python -m benchmarks.micro -k json prompt           # 名前に json / prompt を含むケースだけ
+    python -m benchmarks.micro --json out/HEAD.json     # 結果を書き出す
+    python -m benchmarks.micro --compare out/main.json  # 以前の結果と比較（遅くなったら終了コード1）
+"""
+import argparse
+import json
+import math
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable
+
+ROOT = Path(__file__).resolve().parent.parent
+# インストールせずに実行した場合も src/ の loca を使う
+sys.path.insert(0, str(ROOT / "src"))
+
+# 合成データの素材（日本語中心 + コード・英語を混ぜる）
+_CJK_SENTENCES = [
+    "この関数は入力されたリストを走査し、条件に一致する要素だけを返します。",
+    "設定ファイルの読み込みに失敗した場合は既定値を使って処理を続行します。",
+    "ユーザーの指示に従い、既存のテストを壊さないように最小限の変更を加えました。",
+    "ログを確認したところ、タイムアウトは外部APIの応答遅延が原因でした。",
+    "型ヒントを追加し、docstring を日本語で整備しました。",
+]
+_CODE_LINES = [
+    "def handler(event, context):",
+    "    items = [x for x in event.get('items', []) if x['enabled']]",
+    "    return {'status': 200, 'count': len(items)}",
+    "for i, row in enumerate(rows):  # 行ごとに検証する",
+    "    raise ValueError(f'invalid row {i}: {row!r}')",
+]
+# ストリーミングのチャンクサイズ（文字数）
+STREAM_CHUNK_CHARS = 48
+
+
+@dataclass
+class CaseResult:
+    """1ケース・1サイズ分の計測結果（秒 / 1回あたり）"""
+    name: str
+    size: int
+    loops: int
+    min: float
+    median: float
+    mean: float
+    stdev: float
+    p95: float
+
+
+# ==========================================
+# 合成データ
+# ==========================================
+
+def synthetic_text(rng: random.Random, chars: int, cjk_ratio: float = 0.7) -> str:
+    """日本語の文とコード行を混ぜて、おおよそ chars 文字のテキストを作る。"""
+    parts: list[str] = []
+    total = 0
+    while total < chars:
+        line = rng.choice(_CJK_SENTENCES) if rng.random() < cjk_ratio else rng.choice(_CODE_LINES)
+        parts.append(line)
+        total += len(line) + 1
+    return "\n".join(parts)[:chars]
+
+
+def make_transcript(messages: int, tool_output_chars: int = 100_000, seed: int = 0) -> list[dict]:
+    """
+    実際のエージェントセッションに近い会話履歴を作る。
+    user の指示 → assistant の tool_calls → tool の結果（ときどき 100KB 級）を繰り返す。
+    """
+    from loca.core.prompts import get_agent_system_prompt
+
+    rng = random.Random(seed)
+    transcript = [get_agent_system_prompt()]
+    call_id = 0
+    while len(transcript) < messages:
+        transcript.append({"role": "user", "content": synthetic_text(rng, rng.randint(40, 400))})
+        for _ in range(rng.randint(1, 3)):
+            call_id += 1
+            args = {"thought": synthetic_text(rng, 120), "filepath": f"src/module_{call_id}.py"}
+            transcript.append({
+                "role": "assistant",
+                "content": "",
+                "tool_calls": [{
+                    "id": f"call_{call_id}",
+                    "type": "function",
+                    "function": {"name": "read_file", "arguments": json.dumps(args, ensure_ascii=False)},
+                }],
+            })
+            # 10回に1回は巨大なツール出力（ファイル全文の読み込みなど）
+            size = tool_output_chars if rng.random() < 0.1 else rng.randint(200, 4000)
+            transcript.append({
+                "role": "tool", "tool_call_id": f"call_{call_id}", "name": "read_file",
+                "content": synthetic_text(rng, size),
+            })
+    return transcript[:messages]
+
+
+def make_action_json(rng: random.Random, chars: int) -> str:
+    """write_file アクションの JSON（content がおおよそ chars 文字）を作る。"""
+    action = {
+        "thought": synthetic_text(rng, 300),
+        "action": "write_file",
+        "args": {"filepath": "app.py", "content": synthetic_text(rng, chars, cjk_ratio=0.3)},
+    }
+    return json.dumps(action, ensure_ascii=False)
+
+
+def make_action_response(rng: random.Random, chars: int) -> str:
+    """長い前置き文のあとに JSON アクションが続く、JSON モードの典型的な応答を作る。"""
+    return synthetic_text(rng, 2000) + "\n\n```json\n" + make_action_json(rng, chars) + "\n```\n"
+
+
+# ==========================================
+# ケース定義（setup(size) → 計測する引数なし関数）
+# ==========================================
+
+def _case_extract_json(size: int) -> Callable[[], object]:
+    from loca.core.llm_client import extract_json_from_text
+    text = make_action_response(random.Random(size), size * 250)
+    return lambda: extract_json_from_text(text)
+
+
+def _case_estimate_tokens(size: int) -> Callable[[], object]:
+    from loca.core.llm_client import estimate_tokens
+    transcript = make_transcript(size)
+    return lambda: estimate_tokens(transcript)
+
+
+def _case_count_messages_cold(size: int) -> Callable[[], object]:
+    from loca.core.token_counter import TokenCounter
+    transcript = make_transcript(size)
+    # 毎回新しいインスタンスで、メッセージ単位キャッシュが効かない初回のコストを測る
+    return lambda: TokenCounter().count_messages(transcript, "bench-model", "ollama")
+
+
+def _case_count_messages_warm(size: int) -> Callable[[], object]:
+    from loca.core.token_counter import TokenCounter
+    transcript = make_transcript(size)
+    counter = TokenCounter()
+    counter.count_messages(transcript, "bench-model", "ollama")
+    return lambda: counter.count_messages(transcript, "bench-model", "ollama")
+
+
+def _case_compact(size: int) -> Callable[[], object]:
+    # 旧 _trim_messages に相当する履歴整理（スタブ化 → 切り捨て）
+    from loca.core.context_compactor import ContextCompactor
+    transcript = make_transcript(size)
+    compactor = ContextCompactor("bench-model", "ollama", summarize=None)
+    compactor._context_window = 32_768
+    return lambda: compactor.compact(transcript)
+
+
+def _case_prepare_messages(size: int) -> Callable[[], object]:
+    from loca.core.llm_client import _prepare_messages
+    transcript = make_transcript(size)
+    transcript[-1]["_loca_task"] = True
+    return lambda: _prepare_messages(transcript)
+
+
+def _case_stream_thought(size: int) -> Callable[[], object]:
+    # 旧 _extract_thought に相当する、ストリーミング中の thought / content 抽出
+    from loca.core.json_stream import StreamingJSONParser
+    text = make_action_json(random.Random(size), size * 250)
+    chunks = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)]
+
+    def run():
+        parser = StreamingJSONParser()
+        thought = ""
+        for chunk in chunks:
+            for event in parser.feed(chunk):
+                if event.path == ("thought",):
+                    thought += event.delta
+        return parser.result(), thought
+
+    return run
+
+
+def _case_openai_schemas(size: int) -> Callable[[], object]:
+    from loca.core.executor import create_default_registry
+    registry = create_default_registry()
+    return registry.openai_schemas
+
+
+def _case_prompt_builders(size: int) -> Callable[[], object]:
+    from loca.core.prompts import (
+        MODE_AGENT,
+        get_agent_system_prompt,
+        get_file_editor_prompt,
+        get_planner_prompt,
+        get_reviewer_prompt,
+        get_runtime_context,
+        get_summary_prompt,
+    )
+
+    def run():
+        return (
+            get_agent_system_prompt(), get_runtime_context(MODE_AGENT),
+            get_planner_prompt(), get_file_editor_prompt(), get_reviewer_prompt(), get_summary_prompt(),
+        )
+
+    return run
+
+
+# 名前 → (setup, サイズに依存するか)
+CASES: dict[str, tuple[Callable[[int], Callable[[], object]], bool]] = {
+    "extract_json_from_text": (_case_extract_json, True),
+    "estimate_tokens": (_case_estimate_tokens, True),
+    "count_messages_cold": (_case_count_messages_cold, True),
+    "count_messages_warm": (_case_count_messages_warm, True),
+    "compact": (_case_compact, True),
+    "prepare_messages": (_case_prepare_messages, True),
+    "stream_thought": (_case_stream_thought, True),
+    "openai_schemas": (_case_openai_schemas, False),
+    "prompt_builders": (_case_prompt_builders, False),
+}
+
+
+# ==========================================
+# 計測
+# ==========================================
+
+def measure(name: str, size: int, fn: Callable[[], object], repeat: int, min_time: float) -> CaseResult:
+    """1回が min_time 以上になるようループ回数を決め、repeat 回計測した1呼び出しあたりの統計を返す。"""
+    fn()  # ウォームアップ（import・キャッシュの初期化を除外する）
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 1_000_000:
+            break
+        loops *= 10 if elapsed < min_time / 10 else 2
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        samples.append((time.perf_counter() - start) / loops)
+    samples.sort()
+    return CaseResult(
+        name=name, size=size, loops=loops,
+        min=samples[0], median=statistics.median(samples), mean=statistics.fmean(samples),
+        stdev=statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        p95=samples[min(len(samples) - 1, math.ceil(0.95 * len(samples)) - 1)],
+    )
+
+
+def growth_exponent(results: list[CaseResult]) -> float | None:
+    """サイズと中央値の log-log 回帰の傾き（1 ≈ 線形、2 ≈ 二乗）。"""
+    points = [(math.log(r.size), math.log(r.median)) for r in results if r.median > 0]
+    if len(points) < 2:
+        return None
+    mean_x = statistics.fmean(x for x, _ in points)
+    mean_y = statistics.fmean(y for _, y in points)
+    denominator = sum((x - mean_x) ** 2 for x, _ in points)
+    if denominator == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / denominator
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _format_time(seconds: float) -> str:
+    if seconds >= 1:
+        return f"{seconds:.2f}s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f}ms"
+    return f"{seconds * 1e6:.1f}µs"
+
+
+def print_report(results: list[CaseResult], previous: dict | None) -> None:
+    from rich.console import Console
+    from rich.table import Table
+
+    table = Table(title="Loca micro-benchmarks (per call)")
+    for column in ("case", "size", "median", "min", "p95", "stdev", "loops", "growth", "vs previous"):
+        table.add_column(column, justify="left" if column == "case" else "right")
+
+    previous_medians = {(r["name"], r["size"]): r["median"] for r in (previous or {}).get("results", [])}
+    by_name: dict[str, list[CaseResult]] = {}
+    for r in results:
+        by_name.setdefault(r.name, []).append(r)
+
+    for rows in by_name.values():
+        exponent = growth_exponent(rows)
+        for i, r in enumerate(rows):
+            before = previous_medians.get((r.name, r.size))
+            change = f"{(r.median - before) / before:+.0%}" if before else "-"
+            growth = f"n^{exponent:.2f}" if exponent is not None and i == len(rows) - 1 else ""
+            table.add_row(
+                r.name if i == 0 else "", str(r.size), _format_time(r.median), _format_time(r.min),
+                _format_time(r.p95), _format_time(r.stdev), str(r.loops), growth, change,
+            )
+    Console().print(table)
+
+
+def compare(results: list[CaseResult], previous: dict, tolerance: float) -> list[str]:
+    """以前の結果より中央値が tolerance 以上遅くなったケースを返す。"""
+    previous_medians = {(r["name"], r["size"]): r["median"] for r in previous.get("results", [])}
+    regressions = []
+    for r in results:
+        before = previous_medians.get((r.name, r.size))
+        if before and r.median > before * (1 + tolerance):
+            regressions.append(f"{r.name}[{r.size}]: {_format_time(before)} → {_format_time(r.median)}")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Loca micro-benchmarks for per-step helpers")
+    parser.add_argument("-k", "--keyword", nargs="*", help="名前にいずれかを含むケースだけ実行する")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 200, 400], help="トランスクリプトのメッセージ数")
+    parser.add_argument("--repeat", type=int, default=7, help="計測の繰り返し回数")
+    parser.add_argument("--min-time", type=float, default=0.05, help="1サンプルあたりの最小計測時間（秒）")
+    parser.add_argument("--json", type=Path, help="結果を JSON で書き出す")
+    parser.add_argument("--compare", type=Path, help="比較対象の JSON（--json で書き出したもの）")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="退行とみなす中央値の増加率")
+    args = parser.parse_args(argv)
+
+    selected = {
+        name: case for name, case in CASES.items()
+        if not args.keyword or any(k in name for k in args.keyword)
+    }
+    results: list[CaseResult] = []
+    for name, (setup, sized) in selected.items():
+        for size in (args.sizes if sized else args.sizes[:1]):
+            results.append(measure(name, size, setup(size), args.repeat, args.min_time))
+
+    previous = json.loads(args.compare.read_text(encoding="utf-8")) if args.compare else None
+    print_report(results, previous)
+
+    if args.json:
+        args.json.parent.mkdir(parents=True, exist_ok=True)
+        args.json.write_text(json.dumps({
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "sizes": args.sizes,
+            "results": [asdict(r) for r in results],
+        }, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    if previous is None:
+        return 0
+    regressions = compare(results, previous, args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
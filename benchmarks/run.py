@@ -0,0 +1,345 @@
+"""
+Loca のエンドツーエンドベンチマーク。
+
+スタブLLMサーバー（benchmarks/stub_server.py）に決まった応答を返させ、AgentSession・/ask・
+/pro（run_pro_mode）・/commit（auto_commit）をヘッドレスで実行する。
+モデルの生成時間（サーバー側で費やした時間）・ツール実行・lint を壁時計時間から差し引いた
+残りを Loca 自身のオーバーヘッドとして報告し、ベースラインと比較して退行を検出する。
+
+使い方（リポジトリのルートで実行）:
+    python -m benchmarks.run                          # 全シナリオを実行し、ベースラインがあれば比較
+    python -m benchmarks.run -s agent_read_edit ask   # シナリオを絞る
+    python -m benchmarks.run --latency 0.2 --tps 50   # TTFT と生成速度を変える
+    python -m benchmarks.run --save-baseline          # 結果をベースラインとして保存
+"""
+import argparse
+import asyncio
+import importlib
+import inspect
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+# インストールせずに実行した場合も src/ の loca を使う
+sys.path.insert(0, str(ROOT / "src"))
+
+from benchmarks.scenarios import (
+    MODE_AGENT,
+    MODE_COMMIT,
+    MODE_PRO,
+    Scenario,
+    get_scenarios,
+)
+from benchmarks.stub_server import StubLLMServer
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baseline.json"
+# litellm が OpenAI のモデルとして認識する名前にする（未知の名前はプロバイダー不明として送信前に拒否される）
+MODEL_NAME = "gpt-4o-mini"
+PROVIDER = "openai"
+# ベースラインと比較する指標（秒）
+COMPARED_METRICS = ("overhead", "overhead_per_step")
+# 計測ノイズとみなす絶対差（秒）。これ以下の増加は退行扱いしない
+NOISE_FLOOR_SECONDS = 0.005
+
+
+@dataclass
+class ScenarioResult:
+    """1シナリオ分の計測結果（秒）"""
+    name: str
+    wall: float = 0.0
+    requests: int = 0
+    model: float = 0.0
+    tool: float = 0.0
+    lint: float = 0.0
+    trimming: float = 0.0
+    estimation: float = 0.0
+    step_overheads: list[float] = field(default_factory=list)
+    error: str | None = None
+
+    @property
+    def overhead(self) -> float:
+        """壁時計時間からモデル生成・ツール・lint を除いた Loca 自身の時間"""
+        return max(0.0, self.wall - self.model - self.tool - self.lint)
+
+    @property
+    def overhead_per_step(self) -> float:
+        return self.overhead / max(1, self.requests)
+
+    def metrics(self) -> dict:
+        data = asdict(self)
+        data.pop("step_overheads")
+        data.update(overhead=self.overhead, overhead_per_step=self.overhead_per_step)
+        return data
+
+
+class Probe:
+    """関数を包んで所要時間を名前ごとに積算する（計測の間だけ差し替え、終わったら戻す）"""
+
+    def __init__(self):
+        self.totals: dict[str, float] = defaultdict(float)
+        self._patches: list[tuple[object, str, object]] = []
+
+    def wrap(self, owner, attr: str, name: str) -> None:
+        original = getattr(owner, attr)
+        totals = self.totals
+
+        if inspect.iscoroutinefunction(original):
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await original(*args, **kwargs)
+                finally:
+                    totals[name] += time.perf_counter() - start
+        else:
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    totals[name] += time.perf_counter() - start
+
+        setattr(owner, attr, timed)
+        self._patches.append((owner, attr, original))
+
+    def wrap_steps(self, owner, attr: str, server: StubLLMServer, result: ScenarioResult) -> None:
+        """エージェントの1ステップごとに、モデル・ツール時間を除いたオーバーヘッドを記録する。"""
+        original = getattr(owner, attr)
+        totals = self.totals
+
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            model_before, tool_before = server.model_seconds, totals["tool"]
+            try:
+                return await original(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                model = server.model_seconds - model_before
+                result.step_overheads.append(max(0.0, elapsed - model - (totals["tool"] - tool_before)))
+                # ステップを終えた時点で実行権・エンドポイントを握ったままのストリームがあれば失敗にする
+                leak = _leaked_slots()
+                if leak and result.error is None:
+                    result.error = f"step {len(result.step_overheads)}: {leak}"
+
+        setattr(owner, attr, timed)
+        self._patches.append((owner, attr, original))
+
+    def restore(self) -> None:
+        for owner, attr, original in reversed(self._patches):
+            setattr(owner, attr, original)
+        self._patches.clear()
+
+
+def _prepare_workspace(directory: Path, scenario: Scenario) -> None:
+    for relative, content in scenario.files.items():
+        path = directory / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content, encoding="utf-8")
+    if scenario.mode == MODE_COMMIT:
+        for command in (
+            ["git", "init", "-q"],
+            ["git", "config", "user.email", "bench@example.com"],
+            ["git", "config", "user.name", "bench"],
+        ):
+            subprocess.run(command, cwd=directory, check=True, capture_output=True)
+
+
+async def _drive_session(scenario: Scenario) -> None:
+    """ユーザー入力の台本で AgentSession を最後まで動かす（台本が尽きたら EOF で終了）。"""
+    import loca.core.agent_session as agent_session
+
+    inputs = iter(scenario.inputs)
+
+    async def scripted_input() -> str:
+        try:
+            return next(inputs)
+        except StopIteration:
+            raise EOFError from None
+
+    agent_session.get_user_input_async = scripted_input
+    session = agent_session.AgentSession(MODEL_NAME, PROVIDER, tool_mode="native")
+    await session.run_async()
+
+
+def run_scenario(scenario: Scenario, server: StubLLMServer) -> ScenarioResult:
+    """シナリオを1回実行して計測結果を返す。"""
+    import loca.core.agent_session as agent_session
+    import loca.core.pro_agent as pro_agent
+    from loca.core.context_compactor import ContextCompactor
+    from loca.core.token_counter import TokenCounter
+    from loca.core.tool_registry import ToolRegistry
+    from loca.tools.git_ops import auto_commit
+    from loca.ui.display import console
+
+    result = ScenarioResult(name=scenario.name)
+    probe = Probe()
+    probe.wrap(ContextCompactor, "compact", "trimming")
+    probe.wrap(TokenCounter, "count_messages", "estimation")
+    probe.wrap(ToolRegistry, "execute_batch", "tool")
+    probe.wrap(pro_agent, "_lint_files", "lint")
+    probe.wrap_steps(agent_session.AgentSession, "_run_ai_step", server, result)
+
+    original_input, original_file = agent_session.get_user_input_async, console.file
+    # 確認プロンプトはすべて既定値（Enter）で進め、画面出力は捨てる（描画コストは計測に含める）
+    console.input = lambda *args, **kwargs: ""
+    console.file = io.StringIO()
+
+    server.load(scenario.turns)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix=f"loca-bench-{scenario.name}-") as workspace:
+        _prepare_workspace(Path(workspace), scenario)
+        os.chdir(workspace)
+        start = time.perf_counter()
+        try:
+            if scenario.mode == MODE_AGENT:
+                asyncio.run(_drive_session(scenario))
+            elif scenario.mode == MODE_PRO:
+                pro_agent.run_pro_mode(scenario.task, model_name=MODEL_NAME, provider=PROVIDER, auto_mode=True)
+            elif scenario.mode == MODE_COMMIT:
+                auto_commit(model_name=MODEL_NAME, provider=PROVIDER)
+        except Exception as e:
+            result.error = f"{type(e).__name__}: {e}"
+        finally:
+            result.wall = time.perf_counter() - start
+            os.chdir(cwd)
+            probe.restore()
+            agent_session.get_user_input_async = original_input
+            del console.input
+            console.file = original_file
+
+    if server.remaining and result.error is None:
+        result.error = f"{server.remaining} scripted turns were not consumed"
+    result.requests = server.requests
+    result.model = server.model_seconds
+    for name in ("tool", "lint", "trimming", "estimation"):
+        setattr(result, name, probe.totals[name])
+    return result
+
+
+def _leaked_slots() -> str | None:
+    """スケジューラの実行権やエンドポイントの確保が残っていればエラー文を返す。"""
+    from loca.core.endpoint_pool import endpoint_pool
+    from loca.core.scheduler import request_scheduler
+
+    active = {name: s.active for name, s in request_scheduler.stats().items() if s.active}
+    leased = {e.url: e.outstanding for e in endpoint_pool.snapshot() if e.outstanding}
+    if active or leased:
+        return f"slots still held: scheduler={active} endpoints={leased}"
+    return None
+
+
+def _median_run(results: list[ScenarioResult]) -> ScenarioResult:
+    """繰り返し実行のうちオーバーヘッドが中央値の回を代表値にする。"""
+    ordered = sorted(results, key=lambda r: r.overhead)
+    return ordered[len(ordered) // 2]
+
+
+def compare_with_baseline(results: list[ScenarioResult], baseline: dict, tolerance: float) -> list[str]:
+    """ベースラインより tolerance 以上（かつノイズ幅以上）遅くなった指標を返す。"""
+    regressions = []
+    for result in results:
+        previous = baseline.get(result.name)
+        if not previous or result.error:
+            continue
+        current = result.metrics()
+        for metric in COMPARED_METRICS:
+            before, after = previous.get(metric), current[metric]
+            if before is None:
+                continue
+            if after > before * (1 + tolerance) and after - before > NOISE_FLOOR_SECONDS:
+                regressions.append(f"{result.name}.{metric}: {before * 1000:.1f}ms → {after * 1000:.1f}ms")
+    return regressions
+
+
+def print_report(results: list[ScenarioResult], baseline: dict) -> None:
+    from rich.console import Console
+    from rich.table import Table
+
+    table = Table(title="Loca end-to-end benchmark", show_lines=False)
+    for column in ("scenario", "wall", "LLM reqs", "model", "tool", "lint", "trimming", "estimation",
+                   "overhead", "per step", "max step", "vs baseline"):
+        table.add_column(column, justify="left" if column == "scenario" else "right")
+
+    def ms(seconds: float) -> str:
+        return f"{seconds * 1000:.1f}ms"
+
+    for r in results:
+        if r.error:
+            table.add_row(r.name, ms(r.wall), str(r.requests), *[""] * 8, f"[red]{r.error}[/red]")
+            continue
+        before = (baseline.get(r.name) or {}).get("overhead")
+        delta = f"{(r.overhead - before) / before:+.0%}" if before else "-"
+        table.add_row(
+            r.name, ms(r.wall), str(r.requests), ms(r.model), ms(r.tool), ms(r.lint), ms(r.trimming),
+            ms(r.estimation), ms(r.overhead), ms(r.overhead_per_step),
+            ms(max(r.step_overheads)) if r.step_overheads else "-", delta,
+        )
+    Console().print(table)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Loca end-to-end benchmark against a local stub LLM server")
+    parser.add_argument("-s", "--scenario", nargs="*", help="実行するシナリオ名（省略時は全件）")
+    parser.add_argument("--latency", type=float, default=0.05, help="スタブの応答開始までの秒数 (TTFT)")
+    parser.add_argument("--tps", type=float, default=400.0, help="スタブの生成速度 (tokens/s)")
+    parser.add_argument("--repeat", type=int, default=3, help="各シナリオの実行回数（中央値を採用）")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="退行とみなす増加率")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH, help="ベースラインの JSON ファイル")
+    parser.add_argument("--save-baseline", action="store_true", help="今回の結果をベースラインとして保存する")
+    parser.add_argument("--json", type=Path, help="結果を JSON で書き出す")
+    args = parser.parse_args(argv)
+
+    server = StubLLMServer(latency=args.latency, tokens_per_second=args.tps).start()
+    # Loca を import する前に接続先を設定する（litellm は呼び出し時に環境変数を読む）
+    os.environ["OPENAI_API_BASE"] = os.environ["OPENAI_BASE_URL"] = f"{server.url}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    os.environ["LOCA_WARMUP"] = "0"
+    # モデル料金表をネットワークから取りに行かない（オフラインでも計測がぶれないように）
+    os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+    # litellm がスタブの応答を整形するときの pydantic の警告は計測と無関係なので表示しない
+    warnings.filterwarnings("ignore", category=UserWarning, module="pydantic")
+    # Loca（と litellm）の import 時間を最初のシナリオの計測に含めない
+    importlib.import_module("loca.core.agent_session")
+
+    try:
+        results = []
+        for scenario in get_scenarios(args.scenario):
+            runs = [run_scenario(scenario, server) for _ in range(max(1, args.repeat))]
+            failed = [r for r in runs if r.error]
+            results.append(failed[0] if failed else _median_run(runs))
+    finally:
+        server.stop()
+
+    baseline = {}
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+    print_report(results, baseline)
+
+    payload = {r.name: r.metrics() for r in results}
+    if args.json:
+        args.json.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+    if args.save_baseline:
+        merged = {**baseline, **{name: m for name, m in payload.items() if m["error"] is None}}
+        args.baseline.write_text(json.dumps(merged, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        print(f"baseline saved: {args.baseline}")
+        return 0
+
+    errors = [r for r in results if r.error]
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    for r in errors:
+        print(f"ERROR {r.name}: {r.error}")
+    return 1 if regressions or errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+ベンチマークのシナリオ定義。
+
+各シナリオは「作業ディレクトリに置くファイル」「ユーザー入力」「スタブサーバーが返す応答」を
+決定的に固定する。応答の順番は Loca が実際に行うLLM呼び出しの順番と一致させる
+（使い切った後の呼び出しには StubLLMServer.default_turn が返る）。
+"""
+import json
+from dataclasses import dataclass, field
+
+from benchmarks.stub_server import Turn, text, tool, tools
+
+# 実行モード
+MODE_AGENT = "agent"    # AgentSession をユーザー入力の台本で動かす（/ask を含む）
+MODE_PRO = "pro"        # run_pro_mode を直接呼ぶ
+MODE_COMMIT = "commit"  # 一時 git リポジトリで auto_commit を呼ぶ
+
+
+@dataclass
+class Scenario:
+    name: str
+    description: str
+    mode: str
+    turns: list[Turn]
+    inputs: list[str] = field(default_factory=list)
+    files: dict[str, str] = field(default_factory=dict)
+    # MODE_PRO のタスク文
+    task: str = ""
+
+
+_MAIN_PY = '''def add(a, b):
+    return a + b
+
+
+def mul(a, b):
+    return a * b
+
+
+if __name__ == "__main__":
+    print(add(1, 2), mul(3, 4))
+'''
+
+# 履歴の整理（スタブ化・要約）を起こすための大きめのファイル
+_LARGE_TEXT = "\n".join(f"{i:05d}: ログ行 lorem ipsum dolor sit amet, consectetur adipiscing elit." for i in range(3000))
+
+_PRO_PLAN = [
+    {"filepath": "calc/__init__.py", "purpose": "パッケージ", "interface": "none"},
+    {"filepath": "calc/ops.py", "purpose": "演算", "interface": "def add(a, b)\ndef mul(a, b)"},
+    {"filepath": "calc/cli.py", "purpose": "CLI", "interface": "def main() / imports add from calc.ops"},
+]
+# ファイルごとの生成は並列に届くため、どの応答がどのファイルに割り当たっても正しいPythonになる内容にする
+_PRO_FILE_BODIES = [
+    "",
+    _MAIN_PY,
+    "import sys\n\nfrom calc.ops import add\n\n\ndef main():\n    print(add(*map(int, sys.argv[1:3])))\n",
+]
+
+
+def _json(payload: dict) -> str:
+    return json.dumps(payload, ensure_ascii=False)
+
+
+SCENARIOS: list[Scenario] = [
+    Scenario(
+        name="agent_read_edit",
+        description="読み取り → 部分編集 → 完了の3ステップ",
+        mode=MODE_AGENT,
+        inputs=["/auto", "main.py の add に docstring を付けて"],
+        files={"main.py": _MAIN_PY},
+        turns=[
+            tool("read_file", thought="まず内容を確認します。", filepath="main.py"),
+            tool(
+                "edit_file", thought="add に docstring を追加します。", filepath="main.py",
+                old_text="def add(a, b):\n", new_text='def add(a, b):\n    """a と b の和を返す。"""\n',
+            ),
+            tool("none", thought="docstring を追加しました。"),
+        ],
+    ),
+    Scenario(
+        name="agent_parallel_reads",
+        description="1ターンで読み取り専用ツール3件（並列実行）→ 完了",
+        mode=MODE_AGENT,
+        inputs=["/auto", "プロジェクトの構成を説明して"],
+        files={"main.py": _MAIN_PY, "README.md": "# demo\n", "notes.txt": "todo\n"},
+        turns=[
+            tools(
+                ("read_file", {"thought": "main.py を読む", "filepath": "main.py"}),
+                ("read_file", {"thought": "README を読む", "filepath": "README.md"}),
+                ("read_directory", {"thought": "構成を見る", "dir_path": "."}),
+            ),
+            tool("none", thought="main.py に add / mul があり、README は最小限です。"),
+        ],
+    ),
+    Scenario(
+        name="agent_long_history",
+        description="大きなファイルを繰り返し読み、履歴の計測・整理コストを測る",
+        mode=MODE_AGENT,
+        inputs=["/auto", "server.log を調べて"],
+        files={"server.log": _LARGE_TEXT},
+        turns=[tool("read_file", thought=f"{i + 1}回目の確認", filepath="server.log") for i in range(6)] + [
+            tool("none", thought="ログに異常はありませんでした。"),
+        ],
+    ),
+    Scenario(
+        name="ask",
+        description="/ask のストリーミング回答（Markdown 描画込み）",
+        mode=MODE_AGENT,
+        inputs=["/ask Python のジェネレータとは？"],
+        turns=[text(
+            "## ジェネレータ\n\n`yield` を使って値を1つずつ返す関数です。\n\n"
+            + "\n".join(f"- ポイント {i}: 遅延評価でメモリを節約できます。" for i in range(20))
+        )],
+    ),
+    Scenario(
+        name="pro",
+        description="/pro の設計 → 3ファイル並列生成 → Reviewer(approve) → 保存 → lint",
+        mode=MODE_PRO,
+        task="足し算と掛け算の CLI を作って",
+        turns=[text(_json({"thought": "ops と cli に分けます。", "files": _PRO_PLAN}))]
+        + [text(body) for body in _PRO_FILE_BODIES]
+        + [text(_json({"thought": "問題ありません。", "decision": "approve", "feedback": ""}))],
+    ),
+    Scenario(
+        name="commit",
+        description="/commit のコミットメッセージ生成",
+        mode=MODE_COMMIT,
+        files={"main.py": _MAIN_PY},
+        turns=[text("add と mul を持つ main.py を追加")],
+    ),
+]
+
+
+def get_scenarios(names: list[str] | None = None) -> list[Scenario]:
+    """名前で絞り込んだシナリオを返す（None なら全件）。"""
+    if not names:
+        return list(SCENARIOS)
+    by_name = {s.name: s for s in SCENARIOS}
+    unknown = [n for n in names if n not in by_name]
+    if unknown:
+        raise SystemExit(f"unknown scenario: {', '.join(unknown)} (available: {', '.join(by_name)})")
+    return [by_name[n] for n in names]
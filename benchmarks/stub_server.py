@@ -0,0 +1,266 @@
+"""
+StubLLMServer: ベンチマーク用の決定的なLLMサーバー（OpenAI / Ollama 互換）。
+
+シナリオで用意した応答（テキスト or tool_calls）を到着順に返す。
+応答前の待ち時間（TTFT）と生成速度（tokens/s）を設定でき、実際のGPUを使わずに
+Loca 側のオーバーヘッドだけを切り出して計測できる。サーバー側で費やした時間
+（= モデルが生成していたとみなす時間）を model_seconds として集計する。
+
+対応エンドポイント:
+    POST /v1/chat/completions   OpenAI 互換（stream / 非stream、tool_calls、usage）
+    POST /api/chat              Ollama 互換（NDJSON ストリーム）
+    POST /api/generate          Ollama のウォームアップ用（空の応答）
+    GET  /api/tags              Ollama のヘルスチェック用
+"""
+import json
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 1トークンとみなす文字数（チャンクの分割単位）
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class Turn:
+    """1リクエスト分の応答。tool_calls は [(name, args), ...]"""
+    text: str = ""
+    tool_calls: list[tuple[str, dict]] = field(default_factory=list)
+
+
+def text(content: str) -> Turn:
+    return Turn(text=content)
+
+
+def tool(name: str, thought: str = "", **args) -> Turn:
+    return Turn(tool_calls=[(name, {"thought": thought, **args})])
+
+
+def tools(*calls: tuple[str, dict]) -> Turn:
+    """複数のツール呼び出しを1ターンで返す応答"""
+    return Turn(tool_calls=list(calls))
+
+
+def _tokens(content: str) -> list[str]:
+    return [content[i:i + CHARS_PER_TOKEN] for i in range(0, len(content), CHARS_PER_TOKEN)]
+
+
+def _prompt_tokens(body: dict) -> int:
+    return sum(len(json.dumps(m.get("content") or "", ensure_ascii=False)) for m in body.get("messages", [])) // CHARS_PER_TOKEN
+
+
+class StubLLMServer:
+    """スクリプト化した応答を返すローカルHTTPサーバー（別スレッドで動く）"""
+
+    def __init__(self, latency: float = 0.05, tokens_per_second: float = 200.0, host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.default_turn = tool("none", thought="完了しました。")
+        self.requests = 0
+        self.model_seconds = 0.0
+        self._script: deque[Turn] = deque()
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubLLMServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def load(self, turns: list[Turn]) -> None:
+        """応答スクリプトを差し替え、計測値をリセットする。"""
+        with self._lock:
+            self._script = deque(turns)
+            self.requests = 0
+            self.model_seconds = 0.0
+
+    @property
+    def remaining(self) -> int:
+        return len(self._script)
+
+    def _next_turn(self, body: dict) -> Turn:
+        with self._lock:
+            self.requests += 1
+            if self._script:
+                return self._script.popleft()
+        # スクリプトを使い切った後の呼び出し（要約など）: ツール付きなら none、なければ短いテキスト
+        return self.default_turn if body.get("tools") else text("OK")
+
+    def _record(self, seconds: float) -> None:
+        with self._lock:
+            self.model_seconds += seconds
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _read_body(self) -> dict:
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    return json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    return {}
+
+            def _send_json(self, payload: dict, status: int = 200) -> None:
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _start_stream(self, content_type: str) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+            def _write_chunk(self, data: bytes) -> None:
+                self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def _end_stream(self) -> None:
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path.startswith("/api/tags"):
+                    self._send_json({"models": [{"name": "stub-model"}]})
+                else:
+                    self._send_json({"error": "not found"}, status=404)
+
+            def do_POST(self):
+                body = self._read_body()
+                start = time.perf_counter()
+                try:
+                    if self.path.endswith("/chat/completions"):
+                        self._openai_chat(body)
+                    elif self.path.startswith("/api/chat"):
+                        self._ollama_chat(body)
+                    elif self.path.startswith("/api/generate"):
+                        self._send_json({"model": body.get("model"), "response": "", "done": True})
+                    else:
+                        self._send_json({"error": "not found"}, status=404)
+                except (BrokenPipeError, ConnectionResetError):
+                    # クライアントが中断した（Ctrl-C / 打ち切り）
+                    pass
+                finally:
+                    server._record(time.perf_counter() - start)
+
+            # --------------------------------------------------------------
+            # OpenAI 互換
+            # --------------------------------------------------------------
+
+            def _openai_chat(self, body: dict) -> None:
+                turn = server._next_turn(body)
+                model = body.get("model", "stub-model")
+                time.sleep(server.latency)
+                usage = {
+                    "prompt_tokens": _prompt_tokens(body),
+                    "completion_tokens": len(_tokens(turn.text)) + sum(
+                        len(_tokens(json.dumps(args, ensure_ascii=False))) for _, args in turn.tool_calls
+                    ),
+                }
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                tool_calls = [
+                    {
+                        "id": f"call_{server.requests}_{i}",
+                        "type": "function",
+                        "function": {"name": name, "arguments": json.dumps(args, ensure_ascii=False)},
+                    }
+                    for i, (name, args) in enumerate(turn.tool_calls)
+                ]
+                finish_reason = "tool_calls" if tool_calls else "stop"
+
+                if not body.get("stream"):
+                    time.sleep(usage["completion_tokens"] / server.tokens_per_second)
+                    message = {"role": "assistant", "content": turn.text or None}
+                    if tool_calls:
+                        message["tool_calls"] = tool_calls
+                    self._send_json({
+                        "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+                        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                        "usage": usage,
+                    })
+                    return
+
+                self._start_stream("text/event-stream")
+
+                def send(delta: dict | None, finish: str | None = None, extra: dict | None = None) -> None:
+                    chunk = {
+                        "id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": model,
+                        "choices": [] if delta is None else [{"index": 0, "delta": delta, "finish_reason": finish}],
+                        **(extra or {}),
+                    }
+                    self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+                delay = 1.0 / server.tokens_per_second
+                send({"role": "assistant", "content": ""})
+                for piece in _tokens(turn.text):
+                    time.sleep(delay)
+                    send({"content": piece})
+                for index, call in enumerate(tool_calls):
+                    send({"tool_calls": [{
+                        "index": index, "id": call["id"], "type": "function",
+                        "function": {"name": call["function"]["name"], "arguments": ""},
+                    }]})
+                    for piece in _tokens(call["function"]["arguments"]):
+                        time.sleep(delay)
+                        send({"tool_calls": [{"index": index, "function": {"arguments": piece}}]})
+                send({}, finish=finish_reason)
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    send(None, extra={"usage": usage})
+                self._write_chunk(b"data: [DONE]\n\n")
+                self._end_stream()
+
+            # --------------------------------------------------------------
+            # Ollama 互換
+            # --------------------------------------------------------------
+
+            def _ollama_chat(self, body: dict) -> None:
+                turn = server._next_turn(body)
+                model = body.get("model", "stub-model")
+                time.sleep(server.latency)
+                calls = [{"function": {"name": name, "arguments": args}} for name, args in turn.tool_calls]
+                pieces = _tokens(turn.text)
+                final = {
+                    "model": model, "created_at": "1970-01-01T00:00:00Z",
+                    "message": {"role": "assistant", "content": "", **({"tool_calls": calls} if calls else {})},
+                    "done": True, "done_reason": "stop",
+                    "prompt_eval_count": _prompt_tokens(body), "eval_count": max(1, len(pieces)),
+                }
+
+                if body.get("stream") is False:
+                    time.sleep(len(pieces) / server.tokens_per_second)
+                    final["message"]["content"] = turn.text
+                    self._send_json(final)
+                    return
+
+                self._start_stream("application/x-ndjson")
+                for piece in pieces:
+                    time.sleep(1.0 / server.tokens_per_second)
+                    line = {"model": model, "message": {"role": "assistant", "content": piece}, "done": False}
+                    self._write_chunk((json.dumps(line, ensure_ascii=False) + "\n").encode("utf-8"))
+                self._write_chunk((json.dumps(final, ensure_ascii=False) + "\n").encode("utf-8"))
+                self._end_stream()
+
+        return Handler
@@ -8,9 +8,123 @@ PROJECT_ROOT = str(Path(__file__).resolve().parent.parent.parent)
 DEFAULT_MODEL = "qwen2.5-coder:32b"
 DEFAULT_PROVIDER = "ollama"
 
+# LLMレスポンスキャッシュ（オプトイン: LOCA_LLM_CACHE=1 または `loca --cache`）
+LLM_CACHE_ENABLED = os.environ.get("LOCA_LLM_CACHE", "0") == "1"
+LLM_CACHE_MAX_BYTES = 200 * 1024 * 1024      # 200MB を超えたら古いものから削除
+LLM_CACHE_MAX_AGE_SECONDS = 7 * 24 * 60 * 60  # 7日より古いエントリは削除
+
+# コンテキストウィンドウ（モデル名の前方一致で引く。無ければ litellm のモデル情報 → 既定値）
+MODEL_CONTEXT_WINDOWS = {
+    "qwen2.5-coder": 32768,
+    "qwen3": 40960,
+    "llama3.1": 131072,
+    "deepseek-coder-v2": 163840,
+}
+DEFAULT_CONTEXT_WINDOW = 32768
+# 応答生成のために空けておくトークン数
+CONTEXT_RESERVE_TOKENS = 4096
+# 履歴がウィンドウのこの割合を超えたら圧縮を開始し、TARGET まで縮める
+COMPACTION_TRIGGER_RATIO = 0.8
+COMPACTION_TARGET_RATIO = 0.6
+
+# 1ターンに複数返ったツール呼び出しのうち、読み取り専用のものを並列実行するスレッド数
+TOOL_MAX_WORKERS = 4
+
+# ruff 1回あたりのタイムアウト（秒）と、内容ハッシュで保持する lint 結果の上限件数
+LINT_TIMEOUT_SECONDS = 10
+LINT_CACHE_MAX_ENTRIES = 512
+# 未検査のファイルがこの件数以上あれば、バイトコンパイルをプロセスプールで並列化する
+VERIFY_PROCESS_MIN_FILES = 8
+# Pro モードの検証で各モジュールを別プロセスで import してみる（LOCA_IMPORT_CHECK=1 で有効化。トップレベルのコードが実行される）
+IMPORT_CHECK_ENABLED = os.environ.get("LOCA_IMPORT_CHECK", "0") == "1"
+IMPORT_CHECK_TIMEOUT_SECONDS = 10
+
+# /pro で設計後に各ファイルを並列生成する同時リクエスト数（実際の同時実行数はエンドポイントの上限にも従う）
+PRO_PARALLEL_FILES = int(os.environ.get("LOCA_PRO_PARALLEL", "4"))
+# /pro の初回生成で同じ設計から並列に作る候補数（1 で無効）。ローカル検査で絞り込み、Reviewer が1回の呼び出しで順位付けする。
+# 実際の候補数はエンドポイントの同時実行数の上限までに抑える。候補ごとに temperature を STEP ずつ上げ、seed を変える
+PRO_CANDIDATES = int(os.environ.get("LOCA_PRO_CANDIDATES", "1"))
+PRO_CANDIDATE_TEMPERATURE_STEP = 0.3
+
+# Ollama のエンドポイント（litellm と同じ OLLAMA_API_BASE を参照する）
+OLLAMA_API_BASE = os.environ.get("OLLAMA_API_BASE", "http://localhost:11434")
+# 複数の Ollama サーバーに負荷分散する場合のエンドポイント一覧（カンマ区切り。未指定なら OLLAMA_API_BASE のみ）
+OLLAMA_ENDPOINTS = [u.strip() for u in os.environ.get("LOCA_OLLAMA_ENDPOINTS", "").split(",") if u.strip()] or [OLLAMA_API_BASE]
+# モデル名の前方一致でエンドポイントを限定する（例: {"qwen2.5-coder:32b": ["http://gpu1:11434", "http://gpu2:11434"]}）
+MODEL_ENDPOINTS: dict[str, list[str]] = {}
+# ヘルスチェック（GET /api/tags）のタイムアウトと、失敗したエンドポイントを再確認するまでの待ち時間
+HEALTH_CHECK_TIMEOUT_SECONDS = 2.0
+ENDPOINT_RETRY_BASE_SECONDS = 5.0
+ENDPOINT_RETRY_MAX_SECONDS = 120.0
+# 接続エラー時に別のエンドポイントで再試行する回数と、その間の待ち時間（指数バックオフの基準）
+FAILOVER_ATTEMPTS = 3
+FAILOVER_BACKOFF_SECONDS = 0.5
+
+# /undo 用のバックアップ。<プロジェクト>/.loca/backups に内容ハッシュ（zlib 圧縮）で保存し、セッションをまたいで残す。
+# 履歴がこの件数を超えたら古いものから消し、どの履歴からも参照されなくなった内容も削除する
+BACKUP_DIR = os.path.join(".loca", "backups")
+BACKUP_MAX_ENTRIES = 200
+
+# 起動時にモデルをバックグラウンドでロードしておく（LOCA_WARMUP=0 で無効化）
+WARMUP_ENABLED = os.environ.get("LOCA_WARMUP", "1") != "0"
+# ロードしたモデルをメモリに保持する時間（Ollama の keep_alive 形式: "30m", "1h", "-1" で無期限）
+OLLAMA_KEEP_ALIVE = os.environ.get("LOCA_KEEP_ALIVE", "30m")
+WARMUP_TIMEOUT_SECONDS = 600
+
+# 生成プロファイル（Ollama の num_ctx / num_predict / keep_alive / stop）
+# num_ctx はプロンプト長＋出力上限を収めるバケットに切り上げる。値が変わるたびに Ollama はモデルを
+# 再ロードするため、セッション中は縮めず大きくする方向にだけ変える
+NUM_CTX_BUCKETS = (8192, 16384, 32768, 65536, 131072)
+# 呼び出し種別ごとの出力トークン上限（None は上限なし）。ルート未指定の呼び出し（/ask 等）は DEFAULT_NUM_PREDICT
+NUM_PREDICT_BY_CALL_TYPE = {
+    "planning": 16384,
+    "tool_step": 8192,
+    "commit_message": 128,
+    "summarization": 1024,
+    "review": 4096,
+    "repair": 16384,
+}
+DEFAULT_NUM_PREDICT = 4096
+# 呼び出し種別ごとの停止文字列
+STOP_BY_CALL_TYPE = {
+    "commit_message": ["\n\n"],
+}
+
+# ステップ単位のスパンを <キャッシュディレクトリ>/traces/*.jsonl に書き出す（LOCA_TRACE=0 で無効化。/perf は常に使える）
+TRACE_ENABLED = os.environ.get("LOCA_TRACE", "1") != "0"
+# 新しいトレースファイルを開くとき、この件数・経過時間を超えた古いファイルを削除する
+TRACE_MAX_FILES = 50
+TRACE_MAX_AGE_SECONDS = 7 * 24 * 60 * 60  # 7日より古いファイルは削除
+
+# クラウドプロバイダーへの同時リクエスト数の上限（Ollama は OLLAMA_NUM_PARALLEL に従う）
+CLOUD_MAX_CONCURRENCY = 8
+
+# 呼び出し種別ごとのモデルルーティング（値は "provider/model" または "model"）。未指定の種別はメインモデルを使う。
+# 環境変数 LOCA_ROUTE_<種別>（例: LOCA_ROUTE_COMMIT_MESSAGE=ollama/qwen2.5-coder:7b）で上書きできる
+MODEL_ROUTES: dict[str, str] = {}
+# `loca --small-model` で小型モデルに回す呼び出し種別（planning / review はメインモデルのまま）
+SMALL_MODEL_CALL_TYPES = ("tool_step", "commit_message", "summarization", "repair")
+# 小型モデルで失敗したとき、この回数の呼び出しはメインモデルに切り替えたままにする
+ROUTE_ESCALATION_HOLD = 3
+
+
 def get_rules_path() -> Path:
     """Loca.md のパスを一元管理して返す。cwdのLoca.mdを優先し、なければリポジトリルートにフォールバック。"""
     cwd_rules = Path(os.getcwd()) / "Loca.md"
     if cwd_rules.exists():
         return cwd_rules
-    return Path(PROJECT_ROOT) / "Loca.md"
\ No newline at end of file
+    return Path(PROJECT_ROOT) / "Loca.md"
+
+
+def get_cache_dir() -> Path:
+    """ユーザー単位のキャッシュディレクトリ（LOCA_CACHE_DIR で上書き可能）を返す。"""
+    return Path(os.environ.get("LOCA_CACHE_DIR") or Path.home() / ".cache" / "loca")
+
+
+def get_model_routes() -> dict[str, str]:
+    """MODEL_ROUTES に環境変数 LOCA_ROUTE_<種別> の指定を重ねたルーティング表を返す。"""
+    routes = dict(MODEL_ROUTES)
+    for key, value in os.environ.items():
+        if key.startswith("LOCA_ROUTE_") and value:
+            routes[key[len("LOCA_ROUTE_"):].lower()] = value
+    return routes
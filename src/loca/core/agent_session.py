@@ -2,40 +2,69 @@
 AgentSession: メインループとフラグ管理をカプセル化したクラス。
 以前の main.py に散在していた状態を一元管理し、テスト容易性を高める。
 """
+import asyncio
 import json
 import time
+import uuid
+from contextlib import aclosing
 
 from loca.core.llm_client import (
-    chat_with_tools,
+    GenerationStats,
+    astream_chat_with_tools,
     chat_with_llm,
-    stream_chat_with_llm,
+    achat_with_llm,
+    astream_chat_with_llm,
     extract_json_from_text,
-    estimate_tokens,
 )
-from loca.core.prompts import get_system_prompt, get_agent_system_prompt
+from loca.core.token_counter import token_counter
+from loca.core.json_stream import StreamingJSONParser
+from loca.core.prompts import (
+    get_agent_system_prompt,
+    get_runtime_context,
+    get_summary_prompt,
+    MODE_AGENT,
+    MODE_ASK,
+    MODE_JSON,
+)
+from loca.core.context_compactor import ContextCompactor, TASK_KEY
+from loca.core.capabilities import (
+    capability_store,
+    TOOL_MODE_NATIVE,
+    TOOL_MODE_JSON,
+    OUTCOME_OK,
+    OUTCOME_DROPPED,
+)
+from loca.core.model_routes import model_router, CALL_TOOL_STEP, CALL_SUMMARIZATION, CALL_REPAIR
+from loca.core.schemas import agent_action_spec
 from loca.core.memory import MemoryManager
+from loca.core.warmup import ModelWarmup
+from loca.core.endpoint_pool import current_session
+from loca.core.cancellation import GenerationCancelled, interruptible
+from loca.core.tracing import tracer
 from loca.core.router import route_command
-from loca.core.executor import create_default_registry, backup_manager
+from loca.core.executor import (
+    create_default_registry,
+    backup_manager,
+    confirm_batch,
+    handle_rejection,
+    collect_lint_feedback,
+)
 from loca.core.tool_registry import ToolRegistry
 from loca.tools.web_search import search_web
 from loca.ui.header import print_header
-from loca.ui.display import console, print_thought, print_error, get_user_input
+from loca.ui.display import (
+    console,
+    print_thought,
+    print_error,
+    get_user_input_async,
+    build_generation_panel,
+)
 from rich.live import Live
 from rich.markdown import Markdown
 
 MAX_EXCHANGES = 30
-MAX_MESSAGES = 60
-
-
-def _trim_messages(messages: list) -> list:
-    """コンテキストウィンドウのオーバーフローを防ぐ安全装置。"""
-    if len(messages) <= MAX_MESSAGES:
-        return messages
-    trimmed = [messages[0]] + messages[-(MAX_MESSAGES - 1):]
-    console.print(
-        f"[dim]📎 コンテキスト整理: 古いメッセージを切り捨てました ({len(messages)} → {len(trimmed)})[/dim]"
-    )
-    return trimmed
+# ストリーミング表示の再描画間隔（秒）。毎チャンク描画するとレンダリングが律速になる
+STREAM_RENDER_INTERVAL = 0.1
 
 
 class AgentSession:
@@ -50,11 +79,14 @@ class AgentSession:
         exchange_count: 現セッションのLLM呼び出し回数
         needs_user_input: True のとき次のループでユーザー入力を待つ
         is_ask_mode: /ask コマンドによる会話モードか否か
+        step_stats: 各エージェントステップの生成計測（TTFT・tok/s）
+        tool_mode: "auto"（計測結果に従う）/ "native" / "partial" / "json" のいずれか
     """
 
-    def __init__(self, model_name: str, provider: str):
+    def __init__(self, model_name: str, provider: str, tool_mode: str = "auto"):
         self.model_name = model_name
         self.provider = provider
+        self.tool_mode = tool_mode
         self.memory = MemoryManager()
         self.registry: ToolRegistry = create_default_registry()
         self.messages: list = []
@@ -62,6 +94,11 @@ class AgentSession:
         self.exchange_count: int = 0
         self.needs_user_input: bool = True
         self.is_ask_mode: bool = False
+        self.step_stats: list[GenerationStats] = []
+        self.compactor = ContextCompactor(model_name, provider, summarize=self._summarize_history)
+        self.warmup = ModelWarmup(model_name, provider)
+        # 複数の Ollama サーバーがある場合、このセッションは同じサーバーに固定される（KV キャッシュの再利用）
+        self.session_id = uuid.uuid4().hex[:8]
         self._reset_messages()
 
     # ------------------------------------------------------------------
@@ -69,24 +106,36 @@ class AgentSession:
     # ------------------------------------------------------------------
 
     def run(self) -> None:
-        """メインループを開始する。"""
-        print_header(model_name=f"{self.model_name} ({self.provider.upper()})")
+        """メインループを開始する（asyncio ループを起動して run_async を実行する）。"""
+        asyncio.run(self.run_async())
+
+    async def run_async(self) -> None:
+        """
+        メインループ本体。LLM呼び出し・ツール実行・ユーザー入力はすべて await されるため、
+        推論待ちの間もイベントループ上の他の処理（UI更新など）が進む。
+        複数セッションを1プロセスで動かす場合はこのコルーチンを並べて実行する。
+        """
+        current_session.set(self.session_id)
+        tracer.start_session(self.session_id)
+        # ヘッダー表示・ユーザー入力の間にモデルのロードとシステムプロンプトの評価を済ませておく
+        self.warmup.start(prefix_messages=self.messages[:1])
+        print_header(model_name=f"{self.model_name} ({self.provider.upper()})", status=self.warmup.status_text)
 
         if "<project_guidelines>" in self.messages[0]["content"]:
             console.print("[bold cyan]🧠 Locaの記憶(Loca.md)をロードしました！[/bold cyan]\n")
 
         while True:
-            self.messages = _trim_messages(self.messages)
+            await self._compact_messages()
 
             if self.needs_user_input:
-                should_continue = self._handle_user_input()
+                should_continue = await self._handle_user_input()
                 if not should_continue:
                     break
                 if self.needs_user_input:
                     # コマンドとして処理済み → 次のユーザー入力を待つ
                     continue
 
-            self._run_ai_step()
+            await self._run_ai_step()
 
     # ------------------------------------------------------------------
     # プライベートメソッド
@@ -97,22 +146,32 @@ class AgentSession:
         self.messages = [get_agent_system_prompt()]
         self.exchange_count = 0
 
-    def _handle_user_input(self) -> bool:
+    async def _handle_user_input(self) -> bool:
         """
         ユーザー入力を受け取り、ルーティングする。
         False を返すとメインループを終了する。
         """
         try:
-            user_input = get_user_input()
+            user_input = await get_user_input_async()
         except (KeyboardInterrupt, EOFError):
             console.print("\n[dim]Shutting down agent...[/dim]")
             return False
 
-        route_result, self.auto_mode, self.exchange_count = route_command(
-            user_input, self.messages, self.memory,
-            model_name=self.model_name, provider=self.provider,
-            auto_mode=self.auto_mode, exchange_count=self.exchange_count,
-        )
+        # /pro や /commit は同期処理のため、イベントループを塞がないようスレッドで実行する
+        # （スレッドは途中で止められないので、Ctrl-C はトークン経由でストリームの合間に確認させる）
+        command = user_input.split(maxsplit=1)[0] if user_input.startswith("/") else "message"
+        try:
+            async with interruptible(cancel_task=False), tracer.aspan("router.route", command=command):
+                route_result, self.auto_mode, self.exchange_count = await asyncio.to_thread(
+                    route_command,
+                    user_input, self.messages, self.memory,
+                    model_name=self.model_name, provider=self.provider,
+                    auto_mode=self.auto_mode, exchange_count=self.exchange_count,
+                )
+        except GenerationCancelled:
+            console.print("\n[bold yellow]🛑 生成を中断しました。[/bold yellow]")
+            self.needs_user_input = True
+            return True
 
         if route_result.should_exit:
             return False
@@ -126,9 +185,48 @@ class AgentSession:
 
         self.is_ask_mode = route_result.is_ask_mode
         self.needs_user_input = False
+        # 最新のユーザータスクはコンテキスト圧縮の対象外にする
+        if self.messages and self.messages[-1].get("role") == "user":
+            self.messages[-1][TASK_KEY] = True
         return True
 
-    def _run_ai_step(self) -> None:
+    async def _compact_messages(self) -> None:
+        """トークン予算を超えていれば履歴を圧縮し、回収したトークン数を報告する。"""
+        compacted, report = await asyncio.to_thread(self.compactor.compact, self.messages)
+        if report is None:
+            return
+        self.messages = compacted
+        details = []
+        if report.stubbed:
+            details.append(f"ツール結果 {report.stubbed}件をスタブ化")
+        if report.summarized:
+            details.append(f"{report.summarized}件を要約")
+        if report.dropped:
+            details.append(f"{report.dropped}件を切り捨て")
+        console.print(
+            f"[dim]📎 コンテキスト整理: ~{report.before_tokens} → ~{report.after_tokens} tokens "
+            f"({report.reclaimed} reclaimed / {', '.join(details) or '変更なし'})[/dim]"
+        )
+
+    def _summarize_history(self, excerpt: str) -> str | None:
+        """ContextCompactor から呼ばれる要約関数。失敗時は None を返す。"""
+        messages = [get_summary_prompt(), {"role": "user", "content": excerpt}]
+        with console.status("[dim]📎 古い会話を要約中...", spinner="dots"):
+            res = chat_with_llm(
+                messages, model_name=self.model_name, provider=self.provider,
+                is_ask_mode=True, call_type=CALL_SUMMARIZATION,
+            )
+            if "error" in res and model_router.escalate(CALL_SUMMARIZATION):
+                # 小型モデルで失敗した場合はメインモデルで要約し直す
+                res = chat_with_llm(
+                    messages, model_name=self.model_name, provider=self.provider,
+                    is_ask_mode=True, call_type=CALL_SUMMARIZATION,
+                )
+        if "error" in res:
+            return None
+        return res.get("raw_response") or None
+
+    async def _run_ai_step(self) -> None:
         """AI思考フェーズを実行し、needs_user_input を更新する。"""
         self.exchange_count += 1
         if self.exchange_count > MAX_EXCHANGES:
@@ -141,19 +239,45 @@ class AgentSession:
             self.needs_user_input = True
             return
 
-        token_count = estimate_tokens(self.messages)
+        warmup_report = self.warmup.take_report()
+        if warmup_report:
+            console.print(f"[dim]{warmup_report}[/dim]")
+
+        token_count = token_counter.count_messages(self.messages, self.model_name, self.provider)
+        totals = token_counter.totals
         console.print(
-            f"[dim]📊 Tokens: ~{token_count} | Exchange: {self.exchange_count}/{MAX_EXCHANGES}[/dim]"
+            f"[dim]📊 Tokens: ~{token_count} (last prompt: {totals.last_prompt_tokens}, "
+            f"cache hit: {totals.last_cache_hit_ratio:.0%} / session {totals.cache_hit_ratio:.0%}) | "
+            f"Session: {totals.prompt_tokens} in / {totals.completion_tokens} out | "
+            f"Exchange: {self.exchange_count}/{MAX_EXCHANGES}[/dim]"
         )
 
         start_time = time.time()
+        history_length = len(self.messages)
 
-        if self.is_ask_mode:
-            self._run_ask_step(start_time)
-        else:
-            self._run_agent_step(start_time)
+        mode = MODE_ASK if self.is_ask_mode else MODE_AGENT
+        try:
+            async with tracer.aspan("agent.step", mode=mode, exchange=self.exchange_count, prompt_tokens=token_count):
+                if self.is_ask_mode:
+                    await self._run_ask_step(start_time)
+                else:
+                    await self._run_agent_step(start_time)
+        except GenerationCancelled:
+            self._cancel_step(history_length)
+
+    def _cancel_step(self, history_length: int) -> None:
+        """
+        Ctrl-C で生成を中断したステップを取り消す。
+        ステップ中に追加された途中の履歴を捨て、中断したことを assistant の発言として残して
+        （user が連続しないように）ユーザー入力に戻る。
+        """
+        del self.messages[history_length:]
+        self.messages.append({"role": "assistant", "content": "(ユーザーが生成を中断しました)"})
+        console.print("\n[bold yellow]🛑 生成を中断しました。次の指示を入力してください。[/bold yellow]")
+        self.needs_user_input = True
+        self.is_ask_mode = False
 
-    def _run_ask_step(self, start_time: float) -> None:
+    async def _run_ask_step(self, start_time: float) -> None:
         """
         /ask モード: 1回のストリーミング呼び出しで回答する。
 
@@ -161,17 +285,29 @@ class AgentSession:
         旧実装: chat_with_llm() (非ストリーミング) → search_web判定 → stream_chat_with_llm() (再度呼び出し)
         新実装: stream_chat_with_llm() で一度だけバッファに収集 → search_web判定 → 必要なら2回目
         """
-        # ask モード用プロンプトは router.py が messages[0] に設定済み
         raw_text = ""
+        # search_web の JSON は増分パーサーでチャンク到着時に判定する（全文の再スキャン不要）
+        parser = StreamingJSONParser()
+        parsed_json = None
 
         # 1回のストリーミングでバッファに収集（spinner を表示しながら）
-        with console.status("[bold cyan]AI is thinking...", spinner="dots"):
-            for chunk in stream_chat_with_llm(
-                self.messages, model_name=self.model_name, provider=self.provider
-            ):
-                raw_text += chunk
-
-        parsed_json = extract_json_from_text(raw_text)
+        async with interruptible():
+            with console.status("[bold cyan]AI is thinking...", spinner="dots"):
+                async with aclosing(astream_chat_with_llm(
+                    self._request_messages(MODE_ASK), model_name=self.model_name, provider=self.provider
+                )) as stream:
+                    async for chunk in stream:
+                        raw_text += chunk
+                        parser.feed(chunk)
+                        if parser.done:
+                            parsed_json = parser.result()
+                            if parsed_json and parsed_json.get("action") == "search_web":
+                                # 検索リクエストが揃った時点で生成を打ち切る
+                                break
+
+        if parsed_json is None and parser.error and '"search_web"' in raw_text:
+            # 本文中の別の '{' で増分パーサーが失敗した場合のみ、全文から探し直す
+            parsed_json = extract_json_from_text(raw_text)
 
         if parsed_json and parsed_json.get("action") == "search_web":
             # Web検索が必要な場合のみ2回目の呼び出しを行う
@@ -179,7 +315,7 @@ class AgentSession:
             console.print(f"\n[bold cyan]🔍 検索中:[/bold cyan] {query}")
 
             with console.status("[bold yellow]Webを検索し、回答を生成中...", spinner="dots"):
-                search_result = search_web(query)
+                search_result = await asyncio.to_thread(search_web, query)
                 self.messages.append({"role": "assistant", "content": raw_text})
                 self.messages.append({
                     "role": "user",
@@ -191,12 +327,13 @@ class AgentSession:
 
             raw_text = ""
             console.print()
-            with Live("", console=console, refresh_per_second=8) as live:
-                for chunk in stream_chat_with_llm(
-                    self.messages, model_name=self.model_name, provider=self.provider
-                ):
-                    raw_text += chunk
-                    live.update(Markdown(raw_text))
+            async with interruptible():
+                with Live("", console=console, refresh_per_second=8) as live:
+                    async for chunk in astream_chat_with_llm(
+                        self._request_messages(MODE_ASK), model_name=self.model_name, provider=self.provider
+                    ):
+                        raw_text += chunk
+                        live.update(Markdown(raw_text))
         else:
             # 通常の回答: バッファ済みテキストを Markdown でレンダリング
             console.print()
@@ -207,31 +344,42 @@ class AgentSession:
         self.messages.append({"role": "assistant", "content": raw_text})
         self.needs_user_input = True
         self.is_ask_mode = False
-        # ask モード終了後、エージェントモード用プロンプトを復元
-        self.messages[0] = get_agent_system_prompt()
 
-    def _run_agent_step(self, start_time: float) -> None:
+    async def _run_agent_step(self, start_time: float) -> None:
         """
         通常エージェントモード: Function Calling でアクションを決定・実行する。
         Function Calling 非対応モデルの場合は JSON フォールバックを使用。
         """
-        # エージェントモード用プロンプトを確実にセット
-        self.messages[0] = get_agent_system_prompt()
-
         tools = self.registry.openai_schemas()
+        stats = None
 
-        with console.status("[bold cyan]AI is thinking...", spinner="dots"):
-            response_data = chat_with_tools(
-                self.messages, tools,
-                model_name=self.model_name, provider=self.provider,
-            )
-
-        # Function Calling 非対応モデルへのフォールバック
-        if response_data.get("error") == "NO_TOOL_CALL":
-            console.print(
-                "[dim]⚠️ Function Callingが利用できません。JSONモードにフォールバックします。[/dim]"
-            )
-            response_data = self._fallback_json_call()
+        if self._resolve_tool_mode() == TOOL_MODE_JSON:
+            # FC非対応と判明しているモデルは最初から JSON 方式で呼び出す（2重推論を避ける）
+            response_data = await self._fallback_json_call()
+        else:
+            response_data, stats = await self._stream_tool_call(tools)
+
+            if response_data.get("error") == "NO_TOOL_CALL":
+                reason = response_data.get("reason", OUTCOME_DROPPED)
+                self._record_tool_outcome(reason)
+                # tool_calls が落ちただけなら、本文に書かれたJSONアクションを再送信なしで回収する
+                salvaged = self._salvage_tool_call(response_data.get("raw_response", "")) if reason == OUTCOME_DROPPED else None
+                if salvaged:
+                    response_data = salvaged
+                else:
+                    # Function Calling 非対応モデルへのフォールバック
+                    console.print(
+                        "[dim]⚠️ Function Callingが利用できません。JSONモードにフォールバックします。[/dim]"
+                    )
+                    response_data = await self._fallback_json_call()
+            elif "error" not in response_data and not (stats and stats.cached):
+                self._record_tool_outcome(OUTCOME_OK)
+
+        if "error" in response_data and model_router.escalate(CALL_TOOL_STEP):
+            # ツールステップを小型モデルに回していた場合は、メインモデルでやり直す
+            console.print(f"[dim]⤴️ ツールステップをメインモデル ({self.model_name}) にエスカレーションします。[/dim]")
+            await self._run_agent_step(start_time)
+            return
 
         if "error" in response_data:
             print_error("うまく解釈できませんでした。")
@@ -240,16 +388,46 @@ class AgentSession:
             return
 
         thought = response_data.get("thought", "")
-        action = response_data.get("action", "none")
-        args = response_data.get("args", {})
+        # FC の応答は複数のツール呼び出しを含みうる。JSON方式・本文からの回収時は1件
+        native_calls = response_data.get("tool_calls")
+        calls = native_calls or [{
+            "id": None,
+            "name": response_data.get("action", "none"),
+            "thought": thought,
+            "args": response_data.get("args", {}),
+        }]
+        # 他のツールと一緒に返った none は無視し、結果を見てから改めて完了を判断させる
+        actions = [c for c in calls if c["name"] != "none"]
         elapsed_time = time.time() - start_time
 
-        console.print(f"[dim]⏱️ Thought completed in {elapsed_time:.1f}s[/dim]")
+        if stats is not None:
+            self.step_stats.append(stats)
+            console.print(f"[dim]⏱️ Thought completed in {elapsed_time:.1f}s ({stats.summary()})[/dim]")
+        else:
+            console.print(f"[dim]⏱️ Thought completed in {elapsed_time:.1f}s[/dim]")
         print_thought(thought)
 
-        result_output, should_kill = self.registry.execute(action, args, self.auto_mode)
+        if not actions:
+            self.messages.append({
+                "role": "assistant",
+                "content": f"Thought: {thought}\n(Action: none)",
+            })
+            # 完了前に、バックグラウンドで走っている ruff の結果を待って確認させる
+            lint_feedback = await asyncio.to_thread(collect_lint_feedback, True)
+            if lint_feedback:
+                self.messages.append({
+                    "role": "user",
+                    "content": f"完了する前に、編集したファイルの lint 結果を確認してください。{lint_feedback}",
+                })
+                self.needs_user_input = False
+                return
+            console.print("[bold green]✅ タスク完了[/bold green]\n")
+            self.needs_user_input = True
+            return
+
+        results = await self._execute_tool_calls(actions)
 
-        if should_kill:
+        if results is None:
             self.messages.append({
                 "role": "user",
                 "content": (
@@ -260,8 +438,38 @@ class AgentSession:
             self.needs_user_input = True
             return
 
-        if action != "none":
-            # 会話履歴はテキスト形式で保存（FC/JSONモード両方で再利用できる）
+        # 前のステップまでに編集したファイルの ruff（バックグラウンド実行）が終わっていれば、今回の結果に添える
+        lint_feedback = collect_lint_feedback()
+        if lint_feedback:
+            results[-1] = (results[-1] or "") + lint_feedback
+
+        if native_calls:
+            # FC の場合は assistant の tool_calls と tool ロールの結果を対にして保存する
+            self.messages.append({
+                "role": "assistant",
+                "content": "",
+                "tool_calls": [
+                    {
+                        "id": call["id"],
+                        "type": "function",
+                        "function": {
+                            "name": call["name"],
+                            "arguments": json.dumps({"thought": call["thought"], **call["args"]}, ensure_ascii=False),
+                        },
+                    }
+                    for call in actions
+                ],
+            })
+            for call, result_output in zip(actions, results):
+                self.messages.append({
+                    "role": "tool",
+                    "tool_call_id": call["id"],
+                    "name": call["name"],
+                    "content": result_output or "(no output)",
+                })
+        else:
+            # JSON方式ではテキスト形式で保存（FC非対応モデルでも再利用できる）
+            action, args = actions[0]["name"], actions[0]["args"]
             self.messages.append({
                 "role": "assistant",
                 "content": f"```json\n{{\"action\": \"{action}\", \"args\": {json.dumps(args, ensure_ascii=False)}}}\n```",
@@ -269,48 +477,174 @@ class AgentSession:
             self.messages.append({
                 "role": "user",
                 "content": (
-                    f"実行結果:\n```\n{result_output}\n```\n"
+                    f"実行結果:\n```\n{results[0]}\n```\n"
                     "次のアクションを実行してください。完全に達成された場合のみ none ツールを呼び出してください。"
                 ),
             })
+
+        for call, result_output in zip(actions, results):
             if result_output:
-                console.print(f"\n[bold]Action Result:[/bold]\n[dim]{result_output}[/dim]\n")
-            self.needs_user_input = False
-        else:
-            self.messages.append({
-                "role": "assistant",
-                "content": f"Thought: {thought}\n(Action: none)",
-            })
-            console.print("[bold green]✅ タスク完了[/bold green]\n")
-            self.needs_user_input = True
+                label = f" ({call['name']})" if len(actions) > 1 else ""
+                console.print(f"\n[bold]Action Result{label}:[/bold]\n[dim]{result_output}[/dim]\n")
+        self.needs_user_input = False
+
+    async def _execute_tool_calls(self, calls: list[dict]) -> list[str] | None:
+        """
+        1ターン分のツール呼び出しを実行し、呼び出し順の結果文字列を返す。強制終了された場合は None。
 
-    def _fallback_json_call(self) -> dict:
+        読み取り専用ツール（read_file / read_directory / web_search 等）は並列に、
+        変更系ツールは順番に実行する。変更系が複数ある場合は最初にまとめて1回だけ確認する。
+        """
+        auto_mode = self.auto_mode
+        rejection = None
+        mutating = [c for c in calls if not self.registry.is_read_only(c["name"])]
+        if len(mutating) > 1 and not auto_mode:
+            confirm = await asyncio.to_thread(confirm_batch, mutating, auto_mode)
+            if confirm.lower() == "q":
+                console.print("[bold red]🛑 タスクを強制終了(Kill)しました。[/bold red]")
+                return None
+            if confirm.lower() == "y":
+                # まとめて許可済みなので各ツールの個別確認はスキップする
+                auto_mode = True
+            else:
+                rejection = handle_rejection(confirm)
+                console.print("[dim]変更系アクションをキャンセルし、AIに拒否のフィードバックを送りました。[/dim]")
+
+        runnable = [c for c in calls if rejection is None or self.registry.is_read_only(c["name"])]
+        if len(calls) > 1:
+            parallel = len(calls) - len(mutating)
+            console.print(f"[dim]🧰 {len(calls)}件のツール呼び出しを実行します（読み取り専用 {parallel}件は並列実行）[/dim]")
+
+        # ツール実行（コマンド・lint等）はスレッドで動かし、イベントループを塞がない
+        outputs = await asyncio.to_thread(self.registry.execute_batch, runnable, auto_mode)
+        if any(should_kill for _, should_kill in outputs):
+            return None
+
+        executed = iter(output for output, _ in outputs)
+        return [next(executed) if c in runnable else rejection for c in calls]
+
+    def _request_messages(self, mode: str) -> list:
+        """
+        送信用のメッセージリストを返す。履歴（安定したプレフィックス）の末尾に
+        カレントディレクトリとモードを含む実行時コンテキストを一時的に付ける。
+        """
+        return self.messages + [get_runtime_context(mode)]
+
+    def _tool_step_model(self) -> tuple[str, str]:
+        """ツールステップに実際に使われる (model_name, provider) を返す（ルーティング・エスカレーション反映済み）。"""
+        return model_router.resolve(CALL_TOOL_STEP, self.model_name, self.provider)
+
+    def _resolve_tool_mode(self) -> str:
+        """CLI指定があればそれを、なければ記録済みの対応状況を返す（未計測なら native で試す）。"""
+        if self.tool_mode != "auto":
+            return self.tool_mode
+        model_name, provider = self._tool_step_model()
+        return capability_store.get_tool_mode(provider, model_name) or TOOL_MODE_NATIVE
+
+    def _record_tool_outcome(self, outcome: str) -> None:
+        """FC呼び出しの結果を記録する。方式が JSON に切り替わったら一度だけ通知する。"""
+        if self.tool_mode != "auto":
+            return
+        model_name, provider = self._tool_step_model()
+        previous = capability_store.get_tool_mode(provider, model_name)
+        mode = capability_store.record(provider, model_name, outcome)
+        if mode != previous and mode == TOOL_MODE_JSON:
+            console.print(
+                f"[dim]🧭 {provider}/{model_name} はFunction Calling非対応として記録しました。"
+                "次回から JSON モードで直接呼び出します。(--tool-mode で上書き可能)[/dim]"
+            )
+
+    def _salvage_tool_call(self, raw_text: str) -> dict | None:
+        """tool_calls の代わりに本文へ書かれたJSONアクションを取り出す。取り出せなければ None。"""
+        parsed = extract_json_from_text(raw_text) if raw_text else None
+        if not parsed or not self.registry.get(parsed.get("action", "")):
+            return None
+        return {
+            "thought": parsed.get("thought", ""),
+            "action": parsed["action"],
+            "args": parsed.get("args") or {},
+        }
+
+    async def _stream_tool_call(self, tools: list[dict]) -> tuple[dict, GenerationStats | None]:
+        """
+        Function Calling をストリーミングで実行し、thought と生成途中のファイル内容をライブ表示する。
+        (chat_with_tools と同じ形式の dict, 計測結果) を返す。
+        """
+        response_data: dict = {"error": "NO_TOOL_CALL", "raw_response": ""}
+        stats = None
+        action = ""
+        # arguments の差分を呼び出しごとの増分パーサーに流し、生成中の呼び出しの thought と本文を積み上げる
+        parsers: dict[int, StreamingJSONParser] = {}
+        current_index = 0
+        thought = ""
+        body = ""
+        args_chars = 0
+        last_render = 0.0
+
+        # Ctrl-C はこの生成だけを中断する（ツール実行中は従来どおり）
+        async with interruptible():
+            with Live(build_generation_panel("", "", ""), console=console, refresh_per_second=10, transient=True) as live:
+                # done で抜けたときもジェネレータを閉じ、スロットとエンドポイントの確保をその場で返す
+                async with aclosing(astream_chat_with_tools(
+                    self._request_messages(MODE_AGENT), tools,
+                    model_name=self.model_name, provider=self.provider, call_type=CALL_TOOL_STEP,
+                )) as stream:
+                    async for event in stream:
+                        if event["type"] == "tool_call":
+                            index = event["index"]
+                            if index != current_index:
+                                # 次の呼び出しの生成が始まったら表示を切り替える
+                                current_index, thought, body = index, "", ""
+                            action = event["name"] if index == 0 else f"{event['name']} (#{index + 1})"
+                            args_chars += len(event["delta"])
+                            parser = parsers.setdefault(index, StreamingJSONParser())
+                            for json_event in parser.feed(event["delta"]):
+                                if json_event.path == ("thought",):
+                                    thought += json_event.delta
+                                elif json_event.path in (("content",), ("new_text",)):
+                                    body += json_event.delta
+                        elif event["type"] == "done":
+                            response_data = event["result"]
+                            stats = event["stats"]
+                            break
+
+                        now = time.monotonic()
+                        if args_chars and now - last_render >= STREAM_RENDER_INTERVAL:
+                            last_render = now
+                            live.update(build_generation_panel(action, thought, body, status=f"{args_chars} chars"))
+
+        return response_data, stats
+
+    async def _fallback_json_call(self) -> dict:
         """
         Function Calling 非対応モデル用の JSON フォールバック。
         旧来の chat_with_llm() を使用し、JSONパースを試みる。
         """
-        # JSON モード用プロンプトに一時的に切り替え
-        fc_prompt = self.messages[0]
-        self.messages[0] = get_system_prompt()
-
-        with console.status("[bold cyan]AI is retrying (JSON mode)...", spinner="dots"):
-            response_data = chat_with_llm(
-                self.messages, model_name=self.model_name, provider=self.provider, is_ask_mode=False
-            )
+        # JSON モードの出力形式は末尾の実行時コンテキストで指示する（messages[0] は書き換えない）
+        # 対応プロバイダーではアクションのスキーマで出力を制約し、パース失敗のリトライを避ける
+        action_schema = agent_action_spec([tool.name for tool in self.registry.all()])
+        async with interruptible():
+            with console.status("[bold cyan]AI is retrying (JSON mode)...", spinner="dots"):
+                response_data = await achat_with_llm(
+                    self._request_messages(MODE_JSON), model_name=self.model_name, provider=self.provider,
+                    is_ask_mode=False, call_type=CALL_TOOL_STEP, response_schema=action_schema,
+                )
 
         # JSONパース失敗時はもう1回リトライ
         if response_data.get("error") == "JSON_PARSE_ERROR":
             console.print("[dim]🔄 JSONパースに失敗しました。自動リトライ中...[/dim]")
+            # 出力形式を守れなかった＝確信度が低いとみなし、以降のステップはメインモデルを使う
+            model_router.escalate(CALL_TOOL_STEP)
             self.messages.append({"role": "assistant", "content": response_data.get("raw_response", "")})
             self.messages.append({
                 "role": "user",
                 "content": "あなたの前の応答はJSONとしてパースできませんでした。指定されたJSONフォーマットで再度出力してください。",
             })
-            with console.status("[bold cyan]AI is retrying...", spinner="dots"):
-                response_data = chat_with_llm(
-                    self.messages, model_name=self.model_name, provider=self.provider, is_ask_mode=False
-                )
+            async with interruptible():
+                with console.status("[bold cyan]AI is retrying...", spinner="dots"):
+                    response_data = await achat_with_llm(
+                        self._request_messages(MODE_JSON), model_name=self.model_name, provider=self.provider,
+                        is_ask_mode=False, call_type=CALL_REPAIR, response_schema=action_schema,
+                    )
 
-        # FC プロンプトを復元
-        self.messages[0] = fc_prompt
         return response_data
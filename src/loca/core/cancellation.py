@@ -0,0 +1,91 @@
+"""
+CancelToken: 実行中の生成をユーザーの Ctrl-C で協調的に中断する仕組み。
+
+Ctrl-C の既定の動作（KeyboardInterrupt / メインタスクのキャンセル）ではセッションごと終了し、
+サーバー側ではモデルが生成を続けてしまう。生成中だけ SIGINT ハンドラーを差し替えて
+トークンをキャンセル状態にし、
+  - asyncio の呼び出し（エージェントステップ・/ask）は実行中のタスクをキャンセルする
+  - スレッドで動く同期呼び出し（/pro・/commit）はチャンクの合間にトークンを確認する
+どちらの場合も llm_client がストリームの HTTP 接続を閉じ、サーバー側の生成を止める。
+"""
+import asyncio
+import contextvars
+import signal
+import threading
+from contextlib import asynccontextmanager
+
+# 現在の呼び出しに紐づくトークン（asyncio.to_thread にも引き継がれる）
+current_cancel_token: contextvars.ContextVar["CancelToken | None"] = contextvars.ContextVar(
+    "loca_cancel_token", default=None
+)
+
+
+class GenerationCancelled(Exception):
+    """ユーザーの中断により生成を打ち切った"""
+
+
+class CancelToken:
+    """1回の中断可能な処理に対応するキャンセル状態（スレッドセーフ）"""
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def cancel(self) -> None:
+        self.event.set()
+
+    def raise_if_cancelled(self) -> None:
+        if self.event.is_set():
+            raise GenerationCancelled()
+
+
+def raise_if_cancelled() -> None:
+    """現在のコンテキストのトークンがキャンセル済みなら GenerationCancelled を送出する。"""
+    token = current_cancel_token.get()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+@asynccontextmanager
+async def interruptible(cancel_task: bool = True):
+    """
+    ブロック内の Ctrl-C をセッション終了ではなく生成の中断として扱う。
+
+    cancel_task=True: 現在のタスクをキャンセルし、ブロックの外へ GenerationCancelled を送出する。
+    cancel_task=False: トークンだけをキャンセルする（スレッドで動く同期処理が自分で確認して抜ける）。
+    シグナルハンドラーを登録できない環境（Windows 等）では従来どおりの動作になる。
+    """
+    token = CancelToken()
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+
+    def on_interrupt() -> None:
+        token.cancel()
+        if cancel_task and task is not None:
+            task.cancel()
+
+    previous_handler = signal.getsignal(signal.SIGINT)
+    try:
+        loop.add_signal_handler(signal.SIGINT, on_interrupt)
+        installed = True
+    except (NotImplementedError, RuntimeError, ValueError):
+        installed = False
+
+    reset = current_cancel_token.set(token)
+    try:
+        yield token
+    except asyncio.CancelledError:
+        if not token.cancelled or task is None:
+            raise
+        # 自分で発行したキャンセルなので、タスクのキャンセル要求を取り消してから通常の例外にする
+        task.uncancel()
+        raise GenerationCancelled() from None
+    finally:
+        current_cancel_token.reset(reset)
+        if installed:
+            loop.remove_signal_handler(signal.SIGINT)
+            # asyncio.run が登録していたハンドラー（メインタスクのキャンセル）に戻す
+            signal.signal(signal.SIGINT, previous_handler)
@@ -0,0 +1,108 @@
+"""
+CapabilityStore: モデルごとの Function Calling 対応状況を記録・永続化する。
+
+毎ステップ「FCで送信 → NO_TOOL_CALL → JSONで再送信」と推論を2重に払わないよう、
+一度判明した対応状況を provider/model 単位で保存し、次回以降は最初から正しい方式で呼び出す。
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import loca.config as config
+
+# ツール呼び出し方式
+TOOL_MODE_NATIVE = "native"    # Function Calling が安定して使える
+TOOL_MODE_PARTIAL = "partial"  # FCは受け付けるが tool_calls が落ちることがある（本文のJSONを回収する）
+TOOL_MODE_JSON = "json"        # FC非対応。最初から JSON テキスト方式で呼び出す
+TOOL_MODES = (TOOL_MODE_NATIVE, TOOL_MODE_PARTIAL, TOOL_MODE_JSON)
+
+# 観測結果
+OUTCOME_OK = "ok"                    # tool_calls が正しく返ってきた
+OUTCOME_DROPPED = "dropped"          # リクエストは成功したが tool_calls が無かった
+OUTCOME_UNSUPPORTED = "unsupported"  # tools パラメータ自体がエラーになった
+
+# tool_calls が一度も返らないまま、この回数 dropped が続いたら JSON 方式に切り替える
+DROPPED_LIMIT = 2
+
+
+class CapabilityStore:
+    """provider/model ごとの Function Calling 対応状況を JSON ファイルに保存するクラス"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._data: dict[str, dict] | None = None
+
+    @staticmethod
+    def _key(provider: str, model_name: str) -> str:
+        return f"{provider}/{model_name}"
+
+    def _load(self) -> dict[str, dict]:
+        if self._data is None:
+            try:
+                self._data = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                self._data = {}
+        return self._data
+
+    def _save(self) -> None:
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_text(json.dumps(self._data, ensure_ascii=False, indent=2), encoding="utf-8")
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+    def get_tool_mode(self, provider: str, model_name: str) -> str | None:
+        """記録済みのツール呼び出し方式を返す。未計測なら None。"""
+        with self._lock:
+            entry = self._load().get(self._key(provider, model_name))
+        return entry.get("tool_mode") if entry else None
+
+    def record(self, provider: str, model_name: str, outcome: str) -> str:
+        """
+        1回分の観測結果を記録し、更新後のツール呼び出し方式を返す。
+
+        - unsupported: 即座に json
+        - ok のみ: native
+        - ok と dropped が混在: partial（FCで送り、落ちたときは本文のJSONを回収する）
+        - dropped のみ DROPPED_LIMIT 回: json
+        """
+        with self._lock:
+            data = self._load()
+            entry = data.setdefault(self._key(provider, model_name), {
+                OUTCOME_OK: 0, OUTCOME_DROPPED: 0, OUTCOME_UNSUPPORTED: 0, "tool_mode": None,
+            })
+            entry[outcome] = entry.get(outcome, 0) + 1
+
+            if entry[OUTCOME_UNSUPPORTED]:
+                mode = TOOL_MODE_JSON
+            elif entry[OUTCOME_OK] and entry[OUTCOME_DROPPED]:
+                mode = TOOL_MODE_PARTIAL
+            elif entry[OUTCOME_OK]:
+                mode = TOOL_MODE_NATIVE
+            elif entry[OUTCOME_DROPPED] >= DROPPED_LIMIT:
+                mode = TOOL_MODE_JSON
+            else:
+                mode = TOOL_MODE_PARTIAL
+
+            changed = entry.get("tool_mode") != mode
+            entry["tool_mode"] = mode
+            entry["updated_at"] = time.time()
+            if changed or outcome != OUTCOME_OK:
+                # ok が続くだけの場合は毎ステップ書き込まない
+                self._save()
+            return mode
+
+    def reset(self, provider: str, model_name: str) -> None:
+        """記録を消して次回から再計測させる。"""
+        with self._lock:
+            if self._load().pop(self._key(provider, model_name), None) is not None:
+                self._save()
+
+
+# グローバルなインスタンス（AgentSession から使用）
+capability_store = CapabilityStore(config.get_cache_dir() / "capabilities.json")
@@ -0,0 +1,272 @@
+"""
+ContextCompactor: モデルのコンテキストウィンドウに基づいて会話履歴を圧縮する。
+
+メッセージ数ではなくトークン数で判断し、次の順で古い履歴を縮める。
+  1. 古いツール実行結果（read_file の全文など）や、assistant の tool_calls に含まれる
+     大きな引数（write_file の本文など）を短いスタブに置き換える
+  2. それでも収まらなければ、古いやり取りを軽量なLLM呼び出しで要約し、
+     1件のローリング要約メッセージにまとめる
+システムプロンプト・最新のユーザータスク・ピン留めされたメッセージ（_loca_pinned）は変更しない。
+"""
+import json
+from dataclasses import dataclass
+from typing import Callable
+
+import loca.config as config
+from loca.core.token_counter import token_counter
+
+# 直近この件数のメッセージはスタブ化・要約の対象外
+KEEP_RECENT_MESSAGES = 6
+# これより長い古いメッセージをスタブ化する（文字数）
+STUB_THRESHOLD_CHARS = 1500
+# スタブに残す先頭部分の文字数
+STUB_PREVIEW_CHARS = 200
+# tool_calls の引数のうちスタブ化するファイル本文のフィールド
+STUB_ARGUMENT_FIELDS = ("content", "old_text", "new_text")
+# 要約入力に含める1メッセージあたりの最大文字数
+SUMMARY_INPUT_CHARS_PER_MESSAGE = 2000
+
+SUMMARY_TAG = "conversation_summary"
+
+# 内部フラグ（llm_client が送信前に取り除く）
+PINNED_KEY = "_loca_pinned"
+TASK_KEY = "_loca_task"
+SUMMARY_KEY = "_loca_summary"
+STUB_KEY = "_loca_stub"
+
+
+@dataclass
+class CompactionReport:
+    """1回の圧縮パスの結果"""
+    before_tokens: int
+    after_tokens: int
+    stubbed: int = 0
+    summarized: int = 0
+    dropped: int = 0
+
+    @property
+    def reclaimed(self) -> int:
+        return self.before_tokens - self.after_tokens
+
+
+def lookup_context_window(model_name: str, provider: str) -> int:
+    """モデルのコンテキストウィンドウを config → litellm のモデル情報 → 既定値の順で引く。"""
+    for prefix, window in config.MODEL_CONTEXT_WINDOWS.items():
+        if model_name.startswith(prefix):
+            return window
+    try:
+        import litellm
+        model = model_name if provider == "openai" else f"{provider}/{model_name}"
+        window = litellm.get_model_info(model).get("max_input_tokens")
+        if window:
+            return int(window)
+    except Exception:
+        pass
+    return config.DEFAULT_CONTEXT_WINDOW
+
+
+def is_tool_result(message: dict) -> bool:
+    """ツール実行結果のメッセージか（FCの tool ロール、またはテキスト形式の「実行結果:」）"""
+    if message.get("role") == "tool":
+        return True
+    content = message.get("content")
+    return message.get("role") == "user" and isinstance(content, str) and content.startswith("実行結果:")
+
+
+class ContextCompactor:
+    """トークン予算に従って会話履歴を圧縮するクラス"""
+
+    def __init__(self, model_name: str, provider: str, summarize: Callable[[str], str | None] | None = None):
+        """
+        summarize: 会話の抜粋テキストを受け取り要約文を返す関数（失敗時は None）。
+                   None の場合、要約段階は古いメッセージの切り捨てで代替する。
+        """
+        self.model_name = model_name
+        self.provider = provider
+        self.summarize = summarize
+        self._context_window: int | None = None
+
+    # ------------------------------------------------------------------
+    # 予算
+    # ------------------------------------------------------------------
+
+    @property
+    def context_window(self) -> int:
+        """モデルのコンテキストウィンドウ（トークン数）を返す。"""
+        if self._context_window is None:
+            self._context_window = self._lookup_context_window()
+        return self._context_window
+
+    def _lookup_context_window(self) -> int:
+        return lookup_context_window(self.model_name, self.provider)
+
+    @property
+    def trigger_tokens(self) -> int:
+        return int((self.context_window - config.CONTEXT_RESERVE_TOKENS) * config.COMPACTION_TRIGGER_RATIO)
+
+    @property
+    def target_tokens(self) -> int:
+        return int((self.context_window - config.CONTEXT_RESERVE_TOKENS) * config.COMPACTION_TARGET_RATIO)
+
+    def count(self, messages: list) -> int:
+        return token_counter.count_messages(messages, self.model_name, self.provider)
+
+    # ------------------------------------------------------------------
+    # 圧縮
+    # ------------------------------------------------------------------
+
+    def compact(self, messages: list) -> tuple[list, CompactionReport | None]:
+        """
+        予算を超えていれば圧縮した新しいリストとレポートを返す。
+        予算内ならそのまま (messages, None) を返す。
+        """
+        before = self.count(messages)
+        if before <= self.trigger_tokens:
+            return messages, None
+
+        report = CompactionReport(before_tokens=before, after_tokens=before)
+        compacted = list(messages)
+
+        # 1. 古いツール結果をスタブ化
+        protected = self._protected_indices(compacted)
+        recent_start = max(1, len(compacted) - KEEP_RECENT_MESSAGES)
+        for i in range(1, recent_start):
+            if i in protected:
+                continue
+            stub = self._stub(compacted[i])
+            if stub is not None:
+                compacted[i] = stub
+                report.stubbed += 1
+
+        # 2. それでも目標を超えていれば古いやり取りを要約
+        if self.count(compacted) > self.target_tokens:
+            compacted = self._summarize_old(compacted, report)
+
+        report.after_tokens = self.count(compacted)
+        return compacted, report
+
+    def _protected_indices(self, messages: list) -> set[int]:
+        """変更してはいけないメッセージの位置（システムプロンプト・最新タスク・ピン留め）"""
+        protected = {0}
+        for i, m in enumerate(messages):
+            if m.get(PINNED_KEY):
+                protected.add(i)
+        for i in range(len(messages) - 1, 0, -1):
+            if messages[i].get(TASK_KEY):
+                protected.add(i)
+                break
+        return protected
+
+    @staticmethod
+    def _stub_text(text: str) -> str:
+        return (
+            f"{text[:STUB_PREVIEW_CHARS]}\n"
+            f"...[コンテキスト節約のため省略: 元は{len(text)}文字。必要なら再度ツールで取得してください]"
+        )
+
+    @staticmethod
+    def _stub_arguments(arguments) -> str | None:
+        """
+        tool_calls の arguments（JSON文字列）のファイル本文フィールドをスタブに置き換えた JSON を返す。
+        対象外なら None。
+        """
+        if not isinstance(arguments, str) or len(arguments) <= STUB_THRESHOLD_CHARS:
+            return None
+        try:
+            args = json.loads(arguments)
+        except ValueError:
+            return None
+        if not isinstance(args, dict):
+            return None
+        changed = False
+        for field in STUB_ARGUMENT_FIELDS:
+            value = args.get(field)
+            if isinstance(value, str) and len(value) > STUB_PREVIEW_CHARS:
+                args[field] = ContextCompactor._stub_text(value)
+                changed = True
+        return json.dumps(args, ensure_ascii=False) if changed else None
+
+    @staticmethod
+    def _stub(message: dict) -> dict | None:
+        """大きな古いメッセージをスタブに置き換えたコピーを返す。対象外なら None。"""
+        if message.get(STUB_KEY) or message.get(SUMMARY_KEY):
+            return None
+        if not (is_tool_result(message) or message.get("role") == "assistant"):
+            return None
+        stub = dict(message)
+        changed = False
+
+        content = message.get("content")
+        if isinstance(content, str) and len(content) > STUB_THRESHOLD_CHARS:
+            stub["content"] = ContextCompactor._stub_text(content)
+            changed = True
+
+        # Function Calling では本文が content ではなく tool_calls の arguments に入っている
+        if message.get("tool_calls"):
+            tool_calls = []
+            for tc in message["tool_calls"]:
+                function = tc.get("function") or {}
+                arguments = ContextCompactor._stub_arguments(function.get("arguments"))
+                if arguments is not None:
+                    tc = {**tc, "function": {**function, "arguments": arguments}}
+                    changed = True
+                tool_calls.append(tc)
+            stub["tool_calls"] = tool_calls
+
+        if not changed:
+            return None
+        stub[STUB_KEY] = True
+        return stub
+
+    @staticmethod
+    def _split_point(messages: list) -> int:
+        """
+        要約対象の終端（この位置より前を要約する）を返す。
+        直近メッセージを残し、tool ロールのメッセージを呼び出し元の assistant と分断しない位置を選ぶ。
+        """
+        cut = max(1, len(messages) - KEEP_RECENT_MESSAGES)
+        while 1 < cut < len(messages) and messages[cut].get("role") == "tool":
+            cut -= 1
+        return cut
+
+    def _summarize_old(self, messages: list, report: CompactionReport) -> list:
+        protected = self._protected_indices(messages)
+        cut = self._split_point(messages)
+        # 保護対象（最新タスク・ピン留め）はそのまま残し、要約の前に並べる
+        kept_old = [messages[i] for i in range(1, cut) if i in protected]
+        old = [messages[i] for i in range(1, cut) if i not in protected]
+        if not old:
+            return messages
+
+        summary_text = None
+        if self.summarize is not None:
+            summary_text = self.summarize(self._summary_input(old))
+
+        if summary_text:
+            summary_message = {
+                "role": "user",
+                "content": f"<{SUMMARY_TAG}>\nこれまでの会話の要約:\n{summary_text.strip()}\n</{SUMMARY_TAG}>",
+                SUMMARY_KEY: True,
+            }
+            report.summarized += len(old)
+            return [messages[0]] + kept_old + [summary_message] + messages[cut:]
+
+        # 要約できなかった場合は古いものから切り捨てる（従来の安全装置と同じ挙動）
+        report.dropped += len(old)
+        return [messages[0]] + kept_old + messages[cut:]
+
+    @staticmethod
+    def _summary_input(old_messages: list) -> str:
+        """要約LLMに渡す抜粋テキストを作る。既存の要約は全文を含めてローリングで更新する。"""
+        lines = []
+        for m in old_messages:
+            content = m.get("content") or ""
+            if not isinstance(content, str):
+                content = str(content)
+            if not m.get(SUMMARY_KEY) and len(content) > SUMMARY_INPUT_CHARS_PER_MESSAGE:
+                content = content[:SUMMARY_INPUT_CHARS_PER_MESSAGE] + "..."
+            if m.get("tool_calls"):
+                names = ", ".join(tc.get("function", {}).get("name", "?") for tc in m["tool_calls"])
+                content = f"{content}\n(tool calls: {names})"
+            lines.append(f"[{m.get('role')}] {content}")
+        return "\n\n".join(lines)
@@ -0,0 +1,266 @@
+"""
+EndpointPool: 複数の Ollama サーバーへの負荷分散とフェイルオーバー。
+
+モデルごとにエンドポイント（Ollama サーバーのURL）の集合を持ち、
+  - 実行中リクエストが最も少ないエンドポイントを選ぶ（least outstanding requests）
+  - 同じセッションは同じエンドポイントに固定し、KV キャッシュの再利用を保つ（sticky）
+  - 接続に失敗したエンドポイントは一定時間外し、バックオフ後にヘルスチェック（GET /api/tags）で復帰させる
+  - リクエストが接続エラーになったら、別のエンドポイントで再試行する
+Ollama 以外のプロバイダーでは何もしない（litellm の既定の接続先を使う）。
+"""
+import asyncio
+import contextvars
+import threading
+import time
+import urllib.error
+import urllib.request
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+
+import loca.config as config
+
+# 現在のセッションID（AgentSession が設定し、asyncio.to_thread 先のスレッドにも引き継がれる）
+current_session: contextvars.ContextVar[str] = contextvars.ContextVar("loca_session", default="default")
+
+
+@dataclass
+class Endpoint:
+    """1台の Ollama サーバー"""
+    url: str
+    outstanding: int = 0
+    healthy: bool = True
+    failures: int = 0
+    retry_at: float = 0.0
+    requests: int = 0
+
+    def mark_failure(self) -> None:
+        self.healthy = False
+        self.failures += 1
+        backoff = config.ENDPOINT_RETRY_BASE_SECONDS * 2 ** (self.failures - 1)
+        self.retry_at = time.monotonic() + min(backoff, config.ENDPOINT_RETRY_MAX_SECONDS)
+
+    def mark_success(self) -> None:
+        self.healthy = True
+        self.failures = 0
+
+
+def check_health(url: str, timeout: float = config.HEALTH_CHECK_TIMEOUT_SECONDS) -> bool:
+    """GET /api/tags が応答すれば正常とみなす。"""
+    try:
+        with urllib.request.urlopen(url.rstrip("/") + "/api/tags", timeout=timeout) as response:
+            return 200 <= response.status < 300
+    except (urllib.error.URLError, OSError, ValueError):
+        return False
+
+
+class Lease:
+    """
+    1リクエストが使っているエンドポイント。接続エラー時は failover() で別のエンドポイントに切り替える。
+    接続先は EndpointPool.lease / alease が選んで設定する。
+    """
+
+    def __init__(self, pool: "EndpointPool | None", model_name: str, session: str):
+        self.pool = pool
+        self.model_name = model_name
+        self.session = session
+        self.endpoint: Endpoint | None = None
+        self._tried: set[str] = set()
+
+    @property
+    def attempts_left(self) -> bool:
+        return self.pool is not None and len(self._tried) < min(config.FAILOVER_ATTEMPTS, self.pool.size(self.model_name))
+
+    def apply(self, request: dict) -> dict:
+        """litellm の引数に接続先（api_base）を設定する。"""
+        if self.endpoint is not None:
+            request["api_base"] = self.endpoint.url
+        return request
+
+    def failover(self) -> bool:
+        """現在のエンドポイントを失敗として外し、未試行のエンドポイントに切り替える。切り替え先が無ければ False。"""
+        if not self._can_failover():
+            return False
+        return self._failover_to(self.pool.choose(self.model_name, self.session, exclude=self._tried))
+
+    async def afailover(self) -> bool:
+        """failover の asyncio 版（ヘルスチェックでイベントループを止めない）"""
+        if not self._can_failover():
+            return False
+        return self._failover_to(await self.pool.achoose(self.model_name, self.session, exclude=self._tried))
+
+    def _can_failover(self) -> bool:
+        if self.pool is None or self.endpoint is None:
+            return False
+        self.pool.report_failure(self.endpoint)
+        return self.attempts_left
+
+    def _failover_to(self, candidate: Endpoint | None) -> bool:
+        if candidate is None or candidate.url in self._tried:
+            return False
+        self._switch(candidate)
+        return True
+
+    def succeeded(self) -> None:
+        if self.pool is not None and self.endpoint is not None:
+            self.pool.report_success(self.endpoint, self.session, self.model_name)
+
+    def release(self) -> None:
+        if self.pool is not None and self.endpoint is not None:
+            self.pool.release(self.endpoint)
+            self.endpoint = None
+
+    def _switch(self, endpoint: Endpoint | None) -> None:
+        if self.endpoint is not None:
+            self.pool.release(self.endpoint)
+        self.endpoint = endpoint
+        if endpoint is not None:
+            self._tried.add(endpoint.url)
+            self.pool.acquire(endpoint)
+
+
+class EndpointPool:
+    """モデルごとのエンドポイント集合と、セッション → エンドポイントの固定割り当てを管理するクラス"""
+
+    def __init__(self, default_urls: list[str], model_urls: dict[str, list[str]] | None = None):
+        self.default_urls = list(default_urls)
+        self.model_urls = dict(model_urls or {})
+        self._endpoints: dict[str, Endpoint] = {}
+        self._sticky: dict[tuple[str, str], str] = {}
+        self._lock = threading.Lock()
+
+    def urls_for(self, model_name: str) -> list[str]:
+        for prefix, urls in self.model_urls.items():
+            if model_name.startswith(prefix):
+                return list(urls)
+        return self.default_urls
+
+    def size(self, model_name: str) -> int:
+        return len(self.urls_for(model_name))
+
+    def total_size(self) -> int:
+        """プール全体のエンドポイント数（スケジューラの同時実行数の上限計算に使う）"""
+        urls = set(self.default_urls)
+        for model_urls in self.model_urls.values():
+            urls.update(model_urls)
+        return len(urls)
+
+    def _endpoint(self, url: str) -> Endpoint:
+        endpoint = self._endpoints.get(url)
+        if endpoint is None:
+            endpoint = self._endpoints[url] = Endpoint(url)
+        return endpoint
+
+    # ------------------------------------------------------------------
+    # 選択
+    # ------------------------------------------------------------------
+
+    def choose(self, model_name: str, session: str, exclude: set[str] | None = None) -> Endpoint | None:
+        """
+        セッションに固定されたエンドポイントが正常ならそれを、無ければ実行中リクエストが最も少ない
+        正常なエンドポイントを返す。全滅している場合は最も早く復帰予定のものを返す（試すだけ試す）。
+        """
+        candidates = self._candidates(model_name, exclude)
+        if not candidates:
+            return None
+        self._probe(self._due_for_probe(candidates))
+        return self._select(candidates, model_name, session)
+
+    async def achoose(self, model_name: str, session: str, exclude: set[str] | None = None) -> Endpoint | None:
+        """choose の asyncio 版。ヘルスチェック（ブロッキングな HTTP）は別スレッドで行う。"""
+        candidates = self._candidates(model_name, exclude)
+        if not candidates:
+            return None
+        due = self._due_for_probe(candidates)
+        if due:
+            await asyncio.to_thread(self._probe, due)
+        return self._select(candidates, model_name, session)
+
+    def _candidates(self, model_name: str, exclude: set[str] | None) -> list[Endpoint]:
+        exclude = exclude or set()
+        with self._lock:
+            return [self._endpoint(url) for url in self.urls_for(model_name) if url not in exclude]
+
+    @staticmethod
+    def _due_for_probe(candidates: list[Endpoint]) -> list[Endpoint]:
+        """バックオフが明けた不調なエンドポイント（ヘルスチェックしてから候補に戻す）"""
+        now = time.monotonic()
+        return [e for e in candidates if not e.healthy and now >= e.retry_at]
+
+    @staticmethod
+    def _probe(endpoints: list[Endpoint]) -> None:
+        for endpoint in endpoints:
+            if check_health(endpoint.url):
+                endpoint.mark_success()
+            else:
+                endpoint.mark_failure()
+
+    def _select(self, candidates: list[Endpoint], model_name: str, session: str) -> Endpoint:
+        with self._lock:
+            healthy = [e for e in candidates if e.healthy]
+            sticky_url = self._sticky.get((session, model_name))
+            for endpoint in healthy:
+                if endpoint.url == sticky_url:
+                    return endpoint
+            if not healthy:
+                return min(candidates, key=lambda e: e.retry_at)
+            chosen = min(healthy, key=lambda e: (e.outstanding, e.requests))
+            self._sticky[(session, model_name)] = chosen.url
+            return chosen
+
+    def sticky_url(self, model_name: str, session: str | None = None) -> str:
+        """セッションが使う（これから使う）エンドポイントのURL"""
+        endpoint = self.choose(model_name, session or current_session.get())
+        return endpoint.url if endpoint else config.OLLAMA_API_BASE
+
+    # ------------------------------------------------------------------
+    # 状態の更新
+    # ------------------------------------------------------------------
+
+    def acquire(self, endpoint: Endpoint) -> None:
+        with self._lock:
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+
+    def release(self, endpoint: Endpoint) -> None:
+        with self._lock:
+            endpoint.outstanding -= 1
+
+    def report_failure(self, endpoint: Endpoint) -> None:
+        with self._lock:
+            endpoint.mark_failure()
+
+    def report_success(self, endpoint: Endpoint, session: str, model_name: str) -> None:
+        with self._lock:
+            endpoint.mark_success()
+            # フェイルオーバー先で成功したら、以降はそちらに固定する
+            self._sticky[(session, model_name)] = endpoint.url
+
+    @contextmanager
+    def lease(self, provider: str, model_name: str):
+        """1リクエスト分のエンドポイントを借りる。Ollama 以外は接続先を変更しない Lease を返す。"""
+        lease = Lease(self if provider == "ollama" else None, model_name, current_session.get())
+        if lease.pool is not None:
+            lease._switch(self.choose(model_name, lease.session))
+        try:
+            yield lease
+        finally:
+            lease.release()
+
+    @asynccontextmanager
+    async def alease(self, provider: str, model_name: str):
+        """lease の async with 版（エンドポイントの選択でイベントループを止めない）"""
+        lease = Lease(self if provider == "ollama" else None, model_name, current_session.get())
+        if lease.pool is not None:
+            lease._switch(await self.achoose(model_name, lease.session))
+        try:
+            yield lease
+        finally:
+            lease.release()
+
+    def snapshot(self) -> list[Endpoint]:
+        with self._lock:
+            return [Endpoint(**vars(e)) for e in self._endpoints.values()]
+
+
+# グローバルなインスタンス（llm_client / warmup / scheduler から使用）
+endpoint_pool = EndpointPool(config.OLLAMA_ENDPOINTS, config.MODEL_ENDPOINTS)
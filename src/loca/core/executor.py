@@ -1,12 +1,14 @@
-import subprocess
+import json
 
-from loca.ui.display import console, print_command
+from loca.ui.display import console, print_command, ask_input
 from loca.tools.commander import execute_command
 from loca.tools.file_ops import read_file, write_file, edit_file, read_directory
 from loca.tools.web_search import search_web
 from loca.tools.backup import BackupManager
 from loca.tools.plugin_loader import load_plugins
 from loca.core.tool_registry import Tool, ToolRegistry
+from loca.core.lint_service import lint_service
+from loca.core.tracing import tracer
 
 # グローバルなバックアップマネージャー（/undo で使用）
 backup_manager = BackupManager()
@@ -23,46 +25,64 @@ def confirm_action(auto_mode: bool) -> str:
         return "y"
 
     console.print("[dim]💡 ヒント: 'n 理由' でAIに指示を出せます。'q' でタスクを強制終了できます。[/dim]")
-    return console.input("[bold]編集を許可しますか？ [y/N/q]: [/bold]").strip()
+    return ask_input("[bold]編集を許可しますか？ [y/N/q]: [/bold]").strip()
+
+
+def confirm_batch(calls: list[dict], auto_mode: bool) -> str:
+    """
+    1ターンで複数返った変更系ツール（write_file / edit_file / run_command 等）をまとめて確認する。
+    ユーザーの入力文字列を返す（'y' なら各ツールの個別確認はスキップする）。
+    """
+    if auto_mode:
+        return "y"
+
+    console.print(f"[bold]📋 {len(calls)}件の変更系アクションを順番に実行します:[/bold]")
+    for i, call in enumerate(calls, 1):
+        args = call["args"]
+        target = args.get("filepath") or args.get("command") or json.dumps(args, ensure_ascii=False)[:80]
+        console.print(f"  [dim]{i}.[/dim] [ai_command]{call['name']}[/ai_command] {target}")
+    console.print("[dim]💡 ヒント: 'n 理由' でAIに指示を出せます。'q' でタスクを強制終了できます。[/dim]")
+    return ask_input("[bold]まとめて実行を許可しますか？ [y/N/q]: [/bold]").strip()
+
+
+def _lint_feedback(errors: list[str]) -> str:
+    """lint エラーをAIに返すメッセージにまとめる（エラーがなければ空文字）。"""
+    if not errors:
+        return ""
+    combined = "\n\n".join(errors)
+    return f"\n\n{combined}\nこれらのエラーを修正してください。特にimportの漏れや存在しないAPIの使用に注意してください。"
 
 
 def lint_python_file(filepath: str) -> str:
-    """Pythonファイルに対してruffを実行し、エラーがあればメッセージを返す。"""
+    """
+    書き込んだPythonファイルを lint する。構文チェック（プロセス内の compile）はその場で結果を返し、
+    ruff はバックグラウンドで実行する（警告は collect_lint_feedback で次のステップに渡す）。
+    """
     if not filepath.endswith('.py'):
         return ""
-    errors = []
-    try:
-        result = subprocess.run(
-            ["ruff", "check", filepath, "--output-format=concise"],
-            capture_output=True, text=True, timeout=10
-        )
-        if result.returncode != 0 and result.stdout.strip():
-            lint_errors = result.stdout.strip()
-            console.print("[bold yellow]⚠️ Lint警告が検出されました:[/bold yellow]")
-            console.print(f"[dim]{lint_errors}[/dim]")
-            errors.append(f"⚠️ Lint Errors (ruff):\n{lint_errors}")
-    except (FileNotFoundError, Exception):
-        pass
-
-    try:
-        result = subprocess.run(
-            ["python", "-c", f"import py_compile; py_compile.compile('{filepath}', doraise=True)"],
-            capture_output=True, text=True, timeout=10
-        )
-        if result.returncode != 0:
-            err_msg = result.stderr.strip().split('\n')[-1] if result.stderr.strip() else "Syntax error"
-            console.print("[bold red]❌ 構文エラーが検出されました:[/bold red]")
-            console.print(f"[dim]{err_msg}[/dim]")
-            errors.append(f"❌ Syntax Error:\n{err_msg}")
-    except Exception:
-        pass
-
-    if errors:
-        combined = "\n\n".join(errors)
-        return f"\n\n{combined}\nこれらのエラーを修正してください。特にimportの漏れや存在しないAPIの使用に注意してください。"
+    syntax_error = lint_service.check_syntax(filepath)
+    if syntax_error:
+        console.print("[bold red]❌ 構文エラーが検出されました:[/bold red]")
+        console.print(f"[dim]{syntax_error}[/dim]")
+        return _lint_feedback([f"❌ Syntax Error:\n{syntax_error}"])
+    lint_service.submit([filepath])
     return ""
 
 
+def collect_lint_feedback(wait: bool = False) -> str:
+    """
+    バックグラウンドの ruff で見つかった警告を表示し、AIに返すメッセージを返す（なければ空文字）。
+    wait=True なら実行中の ruff が終わるまで待つ。
+    """
+    results = lint_service.collect(wait_pending=wait)
+    lint_errors = "\n".join(r.ruff_output for r in results if r.ruff_output)
+    if not lint_errors:
+        return ""
+    console.print("[bold yellow]⚠️ Lint警告が検出されました:[/bold yellow]")
+    console.print(f"[dim]{lint_errors}[/dim]")
+    return _lint_feedback([f"⚠️ Lint Errors (ruff):\n{lint_errors}"])
+
+
 def handle_rejection(confirm: str) -> str:
     """拒否時のフィードバックメッセージを生成する共通関数"""
     reason = confirm[1:].strip() if confirm.lower().startswith('n') and len(confirm) > 1 else ""
@@ -180,6 +200,7 @@ def create_default_registry() -> ToolRegistry:
         args_schema={"filepath": {"type": "string", "description": "Path to the file"}},
         required_args=["filepath"],
         handler=_handle_read_file,
+        read_only=True,
     ))
     registry.register(Tool(
         name="write_file",
@@ -208,6 +229,7 @@ def create_default_registry() -> ToolRegistry:
         args_schema={"dir_path": {"type": "string", "description": "Path to directory (use '.' for current)"}},
         required_args=["dir_path"],
         handler=_handle_read_directory,
+        read_only=True,
     ))
     registry.register(Tool(
         name="web_search",
@@ -215,6 +237,7 @@ def create_default_registry() -> ToolRegistry:
         args_schema={"query": {"type": "string", "description": "The search query string"}},
         required_args=["query"],
         handler=_handle_web_search,
+        read_only=True,
     ))
     registry.register(Tool(
         name="none",
@@ -226,10 +249,11 @@ def create_default_registry() -> ToolRegistry:
 
     # プラグインを登録
     for plugin in load_plugins():
-        def _make_handler(run_fn):
+        def _make_handler(run_fn, name):
             def handler(args: dict, auto_mode: bool) -> tuple[str, bool]:
                 clean_args = {k: v for k, v in args.items() if k != "thought"}
-                result = run_fn(clean_args)
+                with tracer.span("plugin.run", plugin=name):
+                    result = run_fn(clean_args)
                 return str(result), False
             return handler
 
@@ -238,7 +262,8 @@ def create_default_registry() -> ToolRegistry:
             description=plugin["description"],
             args_schema={},
             required_args=[],
-            handler=_make_handler(plugin["run"]),
+            handler=_make_handler(plugin["run"], plugin["name"]),
+            read_only=plugin.get("read_only", False),
         ))
 
     return registry
@@ -0,0 +1,74 @@
+"""
+GenerationProfile: 呼び出し種別ごとの生成オプション（num_ctx / num_predict / keep_alive / stop）を決める。
+
+Ollama は num_ctx を指定しないと既定の小さなコンテキストで動き、長いエージェント履歴の先頭を
+黙って切り捨てたうえでプロンプトを評価し直す。実測したプロンプト長から num_ctx をバケット単位で決め、
+コミットメッセージや JSON 修復のような短い出力には num_predict の上限を付ける。
+"""
+import threading
+from dataclasses import dataclass, field
+
+import loca.config as config
+from loca.core.context_compactor import lookup_context_window
+from loca.core.token_counter import token_counter
+
+
+@dataclass
+class GenerationProfile:
+    """1回の呼び出しに使う生成オプション"""
+    num_predict: int | None = None
+    num_ctx: int | None = None          # Ollama のみ
+    keep_alive: str | None = None       # Ollama のみ
+    stop: list[str] = field(default_factory=list)
+
+    def litellm_kwargs(self) -> dict:
+        """litellm.completion に追加で渡す引数（num_predict は max_tokens として渡す）"""
+        kwargs: dict = {}
+        if self.num_predict:
+            kwargs["max_tokens"] = self.num_predict
+        if self.num_ctx:
+            kwargs["num_ctx"] = self.num_ctx
+        if self.keep_alive:
+            kwargs["keep_alive"] = self.keep_alive
+        if self.stop:
+            kwargs["stop"] = self.stop
+        return kwargs
+
+    def cache_params(self) -> dict:
+        """出力内容に影響するパラメータだけを返す（LLMキャッシュのキー用。num_ctx 等は含めない）"""
+        return {"max_tokens": self.num_predict, "stop": self.stop}
+
+
+class ProfileBuilder:
+    """呼び出しごとの GenerationProfile を組み立て、モデルごとの num_ctx を保持するクラス"""
+
+    def __init__(self):
+        # provider/model → 現在の num_ctx（縮めずに大きくする方向にだけ更新する）
+        self._num_ctx: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def num_ctx_for(self, model_name: str, provider: str, required_tokens: int = 0) -> int:
+        """required_tokens が収まるバケットを返す。モデルのコンテキストウィンドウを超えない。"""
+        window = lookup_context_window(model_name, provider)
+        bucket = next((b for b in config.NUM_CTX_BUCKETS if b >= required_tokens), config.NUM_CTX_BUCKETS[-1])
+        key = f"{provider}/{model_name}"
+        with self._lock:
+            num_ctx = min(max(bucket, self._num_ctx.get(key, 0)), window)
+            self._num_ctx[key] = num_ctx
+        return num_ctx
+
+    def build(self, call_type: str | None, messages: list, model_name: str, provider: str) -> GenerationProfile:
+        num_predict = config.NUM_PREDICT_BY_CALL_TYPE.get(call_type, config.DEFAULT_NUM_PREDICT) if call_type else config.DEFAULT_NUM_PREDICT
+        profile = GenerationProfile(num_predict=num_predict, stop=list(config.STOP_BY_CALL_TYPE.get(call_type, [])))
+        if provider == "ollama":
+            prompt_tokens = token_counter.count_messages(messages, model_name, provider)
+            profile.num_ctx = self.num_ctx_for(model_name, provider, prompt_tokens + (num_predict or config.CONTEXT_RESERVE_TOKENS))
+            if num_predict and prompt_tokens + num_predict > profile.num_ctx:
+                # ウィンドウいっぱいの場合は出力上限を残りに合わせる（コンテキストシフトで先頭が消えないように）
+                profile.num_predict = max(profile.num_ctx - prompt_tokens, config.CONTEXT_RESERVE_TOKENS // 4)
+            profile.keep_alive = config.OLLAMA_KEEP_ALIVE
+        return profile
+
+
+# グローバルなインスタンス（llm_client / warmup から使用）
+profile_builder = ProfileBuilder()
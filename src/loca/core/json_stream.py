@@ -0,0 +1,344 @@
+"""
+StreamingJSONParser: チャンク単位で入力できる再開可能なJSONトークナイザ。
+
+ストリーミング中に「累積テキスト全体を正規表現で再スキャン」すると出力サイズに対して二乗の
+コストになるため、各文字を1度だけ読んで状態を持ち越す。
+文字列フィールド（thought, files[i].content 等）は生成途中の差分をイベントとして通知し、
+ルートオブジェクトの完成と同時に最終的な dict を返す（2回目のパースは不要）。
+"""
+import json
+import re
+from dataclasses import dataclass
+from typing import Any
+
+# 文字列の中で特別扱いが必要な文字（終端の " とエスケープの \）
+_STRING_SPECIAL = re.compile(r'["\\]')
+# 数値・true/false/null を構成しうる文字
+_LITERAL_CHARS = frozenset("0123456789+-.eEtrufalsn")
+_WHITESPACE = frozenset(" \t\r\n")
+_SIMPLE_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+# パーサーの状態
+_VALUE = "value"                    # 値を待っている
+_KEY_OR_END = "key_or_end"          # オブジェクトのキーか '}' を待っている
+_COLON = "colon"                    # ':' を待っている
+_OBJ_COMMA_OR_END = "obj_comma"     # ',' か '}' を待っている
+_ARR_VALUE_OR_END = "arr_value"     # 配列の要素か ']' を待っている
+_ARR_COMMA_OR_END = "arr_comma"     # ',' か ']' を待っている
+_STRING = "string"                  # 文字列の中
+_LITERAL = "literal"                # 数値 / true / false / null の中
+_DONE = "done"                      # ルートオブジェクトが閉じた
+
+
+@dataclass
+class JSONEvent:
+    """
+    パース中に発生するイベント。
+
+    path: ルートからのパス（例: ("thought",), ("files", 0, "content")）
+    delta: 文字列値に今回追加された部分（文字列以外は ""）
+    value: complete=True のときの確定値
+    complete: 値が閉じたか
+    """
+    path: tuple
+    delta: str = ""
+    value: Any = None
+    complete: bool = False
+
+
+class StreamingJSONParser:
+    """
+    最初に現れる '{' から始まるJSONオブジェクトを逐次パースする。
+
+    使い方:
+        parser = StreamingJSONParser()
+        for chunk in stream:
+            for event in parser.feed(chunk):
+                ...
+        obj = parser.result()   # 完成していれば dict、未完成/不正なら None
+
+    json.loads(strict=False) と同様、文字列中の生の改行・制御文字を許容する。
+    """
+
+    def __init__(self):
+        self.error: str | None = None
+        self._state = _VALUE
+        self._started = False
+        self._root: Any = None
+        # スタック: [container, path, pending_key]
+        self._stack: list[list] = []
+        self._str_parts: list[str] = []
+        self._str_is_key = False
+        # 今回の feed で追加された文字列値の断片（イベントにまとめて流す）
+        self._pending_delta: list[str] = []
+        self._escape = ""           # チャンク境界をまたぐエスケープシーケンス
+        self._high_surrogate: int | None = None
+        self._literal = ""
+
+    # ------------------------------------------------------------------
+    # パブリック API
+    # ------------------------------------------------------------------
+
+    @property
+    def started(self) -> bool:
+        """ルートオブジェクトの '{' を読んだか"""
+        return self._started
+
+    @property
+    def done(self) -> bool:
+        """ルートオブジェクトが閉じたか"""
+        return self._state == _DONE
+
+    def result(self) -> dict | None:
+        """完成したルートオブジェクトを返す。未完成・エラー時は None。"""
+        if self.done and self.error is None:
+            return self._root
+        return None
+
+    def partial(self, path: tuple) -> str:
+        """現在パース中の文字列値が path のものなら、その途中までの値を返す。"""
+        if self._state == _STRING and not self._str_is_key and self._current_path() == path:
+            return "".join(self._str_parts)
+        return ""
+
+    def feed(self, chunk: str) -> list[JSONEvent]:
+        """チャンクを追加でパースし、発生したイベントを返す。"""
+        events: list[JSONEvent] = []
+        if self.error is not None or self._state == _DONE or not chunk:
+            return events
+
+        i = 0
+        n = len(chunk)
+
+        if not self._started:
+            i = chunk.find("{")
+            if i == -1:
+                return events
+
+        while i < n:
+            state = self._state
+
+            if state == _STRING:
+                i = self._scan_string(chunk, i, events)
+                continue
+
+            ch = chunk[i]
+
+            if state == _LITERAL:
+                if ch in _LITERAL_CHARS:
+                    self._literal += ch
+                    i += 1
+                    continue
+                if not self._close_literal(events):
+                    return events
+                continue  # 区切り文字は次の状態で処理する
+
+            if ch in _WHITESPACE:
+                i += 1
+                continue
+
+            if state in (_VALUE, _ARR_VALUE_OR_END):
+                if state == _ARR_VALUE_OR_END and ch == "]":
+                    self._close_container(events)
+                elif ch == "{":
+                    self._open_container({}, events)
+                elif ch == "[":
+                    self._open_container([], events)
+                elif ch == '"':
+                    self._start_string(is_key=False)
+                elif ch in _LITERAL_CHARS:
+                    self._literal = ch
+                    self._state = _LITERAL
+                else:
+                    return self._fail(f"unexpected {ch!r} while expecting a value", events)
+
+            elif state == _KEY_OR_END:
+                if ch == "}":
+                    self._close_container(events)
+                elif ch == '"':
+                    self._start_string(is_key=True)
+                else:
+                    return self._fail(f"unexpected {ch!r} while expecting a key", events)
+
+            elif state == _COLON:
+                if ch != ":":
+                    return self._fail(f"expected ':' but got {ch!r}", events)
+                self._state = _VALUE
+
+            elif state == _OBJ_COMMA_OR_END:
+                if ch == ",":
+                    self._state = _KEY_OR_END
+                elif ch == "}":
+                    self._close_container(events)
+                else:
+                    return self._fail(f"expected ',' or '}}' but got {ch!r}", events)
+
+            elif state == _ARR_COMMA_OR_END:
+                if ch == ",":
+                    self._state = _VALUE
+                elif ch == "]":
+                    self._close_container(events)
+                else:
+                    return self._fail(f"expected ',' or ']' but got {ch!r}", events)
+
+            elif state == _DONE:
+                break
+
+            i += 1
+
+        # 今回のチャンクで伸びた文字列値の差分をまとめて1イベントにする
+        if self._state == _STRING and not self._str_is_key and self._pending_delta:
+            events.append(JSONEvent(self._current_path(), delta="".join(self._pending_delta)))
+        self._pending_delta = []
+        return events
+
+    # ------------------------------------------------------------------
+    # 内部処理
+    # ------------------------------------------------------------------
+
+    def _fail(self, message: str, events: list[JSONEvent]) -> list[JSONEvent]:
+        self.error = message
+        return events
+
+    def _current_path(self) -> tuple:
+        if not self._stack:
+            return ()
+        container, path, pending_key = self._stack[-1]
+        if isinstance(container, dict):
+            return path + (pending_key,)
+        return path + (len(container),)
+
+    def _open_container(self, container, events: list[JSONEvent]) -> None:
+        if not self._started:
+            if not isinstance(container, dict):
+                # ルートは必ずオブジェクト（'{' を探してから開始しているので通常は起きない）
+                self._fail("root must be an object", events)
+                return
+            self._started = True
+            self._root = container
+            self._stack.append([container, (), None])
+        else:
+            path = self._current_path()
+            self._stack.append([container, path, None])
+        self._state = _KEY_OR_END if isinstance(container, dict) else _ARR_VALUE_OR_END
+
+    def _close_container(self, events: list[JSONEvent]) -> None:
+        container, path, _ = self._stack.pop()
+        if not self._stack:
+            self._state = _DONE
+            events.append(JSONEvent(path, value=container, complete=True))
+            return
+        self._store_value(container, events, path=path)
+
+    def _store_value(self, value, events: list[JSONEvent], path: tuple | None = None) -> None:
+        """値をカレントのコンテナに格納し、次の状態へ進める。"""
+        container, _, pending_key = self._stack[-1]
+        if path is None:
+            path = self._current_path()
+        if isinstance(container, dict):
+            container[pending_key] = value
+            self._stack[-1][2] = None
+            self._state = _OBJ_COMMA_OR_END
+        else:
+            container.append(value)
+            self._state = _ARR_COMMA_OR_END
+        events.append(JSONEvent(path, value=value, complete=True))
+
+    def _start_string(self, is_key: bool) -> None:
+        self._state = _STRING
+        self._str_is_key = is_key
+        self._str_parts = []
+        self._pending_delta = []
+
+    def _scan_string(self, chunk: str, i: int, events: list[JSONEvent]) -> int:
+        """文字列の中身を読み進め、次に処理すべき位置を返す。"""
+        if self._escape:
+            return self._continue_escape(chunk, i)
+
+        match = _STRING_SPECIAL.search(chunk, i)
+        if match is None:
+            self._append_text(chunk[i:])
+            return len(chunk)
+
+        j = match.start()
+        if j > i:
+            self._append_text(chunk[i:j])
+
+        if chunk[j] == '"':
+            self._finish_string(events)
+            return j + 1
+
+        # バックスラッシュ: エスケープシーケンス開始
+        self._escape = "\\"
+        return self._continue_escape(chunk, j + 1)
+
+    def _continue_escape(self, chunk: str, i: int) -> int:
+        """エスケープシーケンスを（チャンクをまたいでも）組み立てる。"""
+        n = len(chunk)
+        while i < n and self._escape:
+            self._escape += chunk[i]
+            i += 1
+            kind = self._escape[1]
+            if kind == "u":
+                if len(self._escape) < 6:
+                    continue
+                hex_digits = self._escape[2:6]
+                if not _is_hex(hex_digits):
+                    self.error = f"invalid unicode escape {self._escape!r}"
+                    return n
+                code = int(hex_digits, 16)
+                if 0xDC00 <= code <= 0xDFFF and self._high_surrogate is not None:
+                    # サロゲートペア (\uD83D\uDE00 等) を1文字に結合する
+                    high, self._high_surrogate = self._high_surrogate, None
+                    self._append_text(chr(0x10000 + ((high - 0xD800) << 10) + (code - 0xDC00)))
+                elif 0xD800 <= code <= 0xDBFF:
+                    self._flush_surrogate()
+                    self._high_surrogate = code
+                else:
+                    self._append_text(chr(code))
+            else:
+                # 不正なエスケープは文字そのものとして扱う（strict=False 相当の寛容さ）
+                self._append_text(_SIMPLE_ESCAPES.get(kind, kind))
+            self._escape = ""
+        return i
+
+    def _flush_surrogate(self) -> None:
+        """対になる後半が来なかった前半サロゲートをそのまま出力する（json.loads と同じ扱い）。"""
+        if self._high_surrogate is not None:
+            high, self._high_surrogate = self._high_surrogate, None
+            self._append_text(chr(high))
+
+    def _append_text(self, text: str) -> None:
+        self._flush_surrogate()
+        self._str_parts.append(text)
+        if not self._str_is_key:
+            self._pending_delta.append(text)
+
+    def _finish_string(self, events: list[JSONEvent]) -> None:
+        self._flush_surrogate()
+        value = "".join(self._str_parts)
+        self._str_parts = []
+        if self._str_is_key:
+            self._stack[-1][2] = value
+            self._state = _COLON
+            self._pending_delta = []
+            return
+        path = self._current_path()
+        if self._pending_delta:
+            events.append(JSONEvent(path, delta="".join(self._pending_delta)))
+            self._pending_delta = []
+        self._store_value(value, events, path=path)
+
+    def _close_literal(self, events: list[JSONEvent]) -> bool:
+        literal, self._literal = self._literal, ""
+        try:
+            value = json.loads(literal)
+        except json.JSONDecodeError:
+            self.error = f"invalid literal {literal!r}"
+            return False
+        self._store_value(value, events)
+        return True
+
+
+def _is_hex(text: str) -> bool:
+    return len(text) == 4 and all(c in "0123456789abcdefABCDEF" for c in text)
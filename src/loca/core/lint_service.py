@@ -0,0 +1,343 @@
+"""
+LintService: 書き込んだPythonファイルの構文チェックと ruff をまとめて扱うサービス。
+
+- 構文チェックはサブプロセスを起動せず、プロセス内の compile() で行う
+- ruff は対象ファイルをまとめて1回の起動で検査する
+- 結果はファイル内容のハッシュでキャッシュし、変わっていないファイルは再検査しない
+- Pro モードの検証では多数のファイルをプロセスプールで並列にバイトコンパイルし、
+  必要なら各モジュールを別プロセスで import してみる（LOCA_IMPORT_CHECK=1）
+- submit() で ruff をバックグラウンドスレッドに回し、次のLLM呼び出しと並行して走らせる
+  （終わった結果は collect() で取り出し、次のステップでAIに渡す）
+"""
+import atexit
+import contextvars
+import hashlib
+import multiprocessing
+import os
+import re
+import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, replace
+
+import loca.config as config
+from loca.core.tracing import tracer
+
+# ruff --output-format=concise の指摘行（path:row:col: CODE message）。"Found N errors." 等の集計行は含まない
+_RUFF_LINE = re.compile(r"^(?P<path>.+?):\d+:\d+: ")
+
+
+@dataclass
+class LintResult:
+    """1ファイル分の lint 結果"""
+    filepath: str
+    digest: str
+    syntax_error: str = ""
+    ruff_output: str = ""
+    import_error: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return not self.syntax_error and not self.ruff_output and not self.import_error
+
+
+def _read(filepath: str) -> bytes | None:
+    try:
+        with open(filepath, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _digest(source: bytes) -> str:
+    return hashlib.sha1(source).hexdigest()
+
+
+def _module_name(filepath: str, root: str | None = None) -> str | None:
+    """root（既定はカレントディレクトリ）からの相対パスをモジュール名にする（root の外・不正な名前は None）。"""
+    relpath = os.path.relpath(os.path.abspath(filepath), root)
+    if relpath.startswith(".."):
+        return None
+    parts = relpath[:-len(".py")].split(os.sep)
+    if parts[-1] == "__init__":
+        parts = parts[:-1]
+    if not parts or not all(part.isidentifier() for part in parts):
+        return None
+    return ".".join(parts)
+
+
+def _import_error(module: str, root: str | None = None) -> str:
+    """モジュールを root で起動した別プロセスで import し、失敗したら最後のエラー行を返す（タイムアウトは判定しない）。"""
+    try:
+        proc = subprocess.run(
+            ["python", "-c", "import importlib, sys; importlib.import_module(sys.argv[1])", module],
+            capture_output=True, text=True, timeout=config.IMPORT_CHECK_TIMEOUT_SECONDS, cwd=root,
+            env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        # 入力待ち・無限ループ等で終わらないモジュールもあるため、エラー扱いにはしない
+        return ""
+    if proc.returncode == 0:
+        return ""
+    lines = [line for line in proc.stderr.strip().splitlines() if line.strip()]
+    return lines[-1] if lines else f"exit code {proc.returncode}"
+
+
+def compile_source(source: bytes, filepath: str) -> str:
+    """プロセス内で compile() し、構文エラーがあればメッセージを返す（py_compile と同じ判定）。"""
+    try:
+        compile(source, filepath, "exec", dont_inherit=True)
+    except (SyntaxError, ValueError) as e:
+        return f"{type(e).__name__}: {e}"
+    return ""
+
+
+class LintService:
+    """内容ハッシュでキャッシュしながら、構文チェックと ruff を実行するクラス"""
+
+    def __init__(self, max_entries: int = config.LINT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.ruff_available = True
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict[tuple[str, str], LintResult] = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+        self._process_pool: ProcessPoolExecutor | None = None
+        # import チェックの結果（絶対パス → (ファイル群のハッシュ, エラー)）
+        self._imports: dict[str, tuple[str, str]] = {}
+        self._queued: dict[str, None] = {}
+        self._futures: list[Future] = []
+        self._ready: dict[str, LintResult] = {}
+
+    # ------------------------------------------------------------------
+    # 同期チェック
+    # ------------------------------------------------------------------
+
+    def check_syntax(self, filepath: str) -> str:
+        """構文だけをその場でチェックする（書き込み直後の即時フィードバック用）。"""
+        source = _read(filepath)
+        if source is None:
+            return ""
+        cached = self._cached(filepath, _digest(source))
+        if cached is not None:
+            return cached.syntax_error
+        with tracer.span("lint.compile", filepath=filepath):
+            return compile_source(source, filepath)
+
+    def lint(self, filepaths: list[str], import_check: bool = False, root: str | None = None) -> list[LintResult]:
+        """
+        .py ファイルを構文チェックし、まとめて1回 ruff にかける（内容が変わっていないファイルはキャッシュを返す）。
+        ruff・バイトコンパイル・import チェックは並行に走らせる。未検査のファイルが多いときは
+        バイトコンパイルをプロセスプールで並列化する。
+        import_check=True なら構文が通ったモジュールを1つずつ別プロセスで import して確かめる
+        （いずれかのファイルが変わったときだけ全モジュールをやり直す。依存先の変更で結果が変わるため）。
+        root はモジュール名の基準と import を実行するディレクトリ（既定はカレントディレクトリ）。
+        存在しないファイルと .py 以外は結果に含めない。
+        """
+        results: dict[str, LintResult] = {}
+        sources: dict[str, tuple[str, bytes]] = {}
+        for filepath in dict.fromkeys(filepaths):
+            if not filepath.endswith(".py"):
+                continue
+            source = _read(filepath)
+            if source is None:
+                continue
+            digest = _digest(source)
+            cached = self._cached(filepath, digest)
+            if cached is not None:
+                results[filepath] = cached
+            else:
+                sources[filepath] = (digest, source)
+
+        if sources:
+            with ThreadPoolExecutor(max_workers=1) as stage:
+                # ruff（別プロセス）を走らせている間にバイトコンパイルする
+                ruff_future = stage.submit(contextvars.copy_context().run, self._run_ruff, list(sources))
+                syntax_errors = self._compile_all(sources)
+                outputs = ruff_future.result()
+            for filepath, (digest, _) in sources.items():
+                result = LintResult(filepath, digest, syntax_error=syntax_errors[filepath])
+                results[filepath] = result
+                if outputs is None and not result.syntax_error:
+                    # タイムアウト等: 結果が不確かなのでキャッシュしない
+                    continue
+                if not result.syntax_error:
+                    # 構文エラーのファイルは ruff の指摘を捨てる（まず構文を直させる）
+                    result.ruff_output = outputs.get(filepath, "")
+                self._store(result)
+
+        ordered = list(results.values())
+        if import_check:
+            ordered = self._check_imports(ordered, root)
+        return ordered
+
+    def _compile_all(self, sources: dict[str, tuple[str, bytes]]) -> dict[str, str]:
+        """ファイルごとの構文エラー（なければ空文字）。件数が多いときはプロセスプールで並列に compile する。"""
+        with tracer.span("lint.compile", files=len(sources)) as span:
+            if len(sources) < config.VERIFY_PROCESS_MIN_FILES:
+                return {filepath: compile_source(source, filepath) for filepath, (_, source) in sources.items()}
+            span.set(processes=True)
+            # 並列の検証が同時に来ても、プールは1つだけ作る
+            with self._lock:
+                if self._process_pool is None:
+                    self._process_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=_process_context())
+                pool = self._process_pool
+            paths = list(sources)
+            try:
+                errors = list(pool.map(compile_source, [sources[p][1] for p in paths], paths, chunksize=4))
+            except BrokenProcessPool:
+                # ワーカーが起動できなかった・落ちた場合はプールを捨て、このプロセス内で compile する
+                with self._lock:
+                    if self._process_pool is pool:
+                        self._process_pool = None
+                pool.shutdown(wait=False, cancel_futures=True)
+                span.set(processes=False)
+                errors = [compile_source(sources[p][1], p) for p in paths]
+            return dict(zip(paths, errors))
+
+    def _check_imports(self, results: list[LintResult], root: str | None = None) -> list[LintResult]:
+        """構文が通ったモジュールを並列に import し、失敗したものに import_error を付けた結果を返す。"""
+        batch = _digest("\n".join(sorted(f"{os.path.abspath(r.filepath)}:{r.digest}" for r in results)).encode())
+        targets = [r for r in results if not r.syntax_error and _module_name(r.filepath, root)]
+        stale = [r for r in targets if self._imports.get(os.path.abspath(r.filepath), ("", ""))[0] != batch]
+        if stale:
+            with tracer.span("lint.import", files=len(stale)), \
+                    ThreadPoolExecutor(max_workers=min(len(stale), os.cpu_count() or 1)) as pool:
+                errors = pool.map(lambda r: _import_error(_module_name(r.filepath, root), root), stale)
+                for result, error in zip(stale, errors):
+                    self._imports[os.path.abspath(result.filepath)] = (batch, error)
+        target_paths = {os.path.abspath(r.filepath) for r in targets}
+        checked = []
+        for result in results:
+            path = os.path.abspath(result.filepath)
+            error = self._imports[path][1] if path in target_paths else ""
+            checked.append(replace(result, import_error=error) if error else result)
+        return checked
+
+    def _run_ruff(self, filepaths: list[str]) -> dict[str, str] | None:
+        """ruff を1回だけ起動し、ファイルごとの指摘行を返す。実行できなかった場合は None。"""
+        if not self.ruff_available:
+            return {}
+        try:
+            with tracer.span("lint.ruff", files=len(filepaths)):
+                proc = subprocess.run(
+                    ["ruff", "check", "--output-format=concise", "--", *filepaths],
+                    capture_output=True, text=True, timeout=config.LINT_TIMEOUT_SECONDS,
+                )
+        except FileNotFoundError:
+            # ruff 未インストール: 以降は起動を試みない
+            self.ruff_available = False
+            return {}
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+
+        by_path = {os.path.abspath(f): f for f in filepaths}
+        lines: dict[str, list[str]] = {}
+        for line in proc.stdout.splitlines():
+            match = _RUFF_LINE.match(line)
+            filepath = by_path.get(os.path.abspath(match.group("path"))) if match else None
+            if filepath is not None:
+                lines.setdefault(filepath, []).append(line)
+        return {filepath: "\n".join(found) for filepath, found in lines.items()}
+
+    # ------------------------------------------------------------------
+    # キャッシュ
+    # ------------------------------------------------------------------
+
+    def _cached(self, filepath: str, digest: str) -> LintResult | None:
+        key = (os.path.abspath(filepath), digest)
+        with self._lock:
+            result = self._cache.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def _store(self, result: LintResult) -> None:
+        key = (os.path.abspath(result.filepath), result.digest)
+        with self._lock:
+            self._cache[key] = result
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    # ------------------------------------------------------------------
+    # バックグラウンド実行
+    # ------------------------------------------------------------------
+
+    def submit(self, filepaths: list[str]) -> Future:
+        """
+        lint をバックグラウンドで実行する。実行待ちのファイルは次のジョブでまとめて検査されるため、
+        1ターンで複数のファイルを書いても ruff の起動は1回で済む。
+        """
+        with self._lock:
+            self._queued.update(dict.fromkeys(filepaths))
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="loca-lint")
+            future = self._executor.submit(self._run_queued)
+            self._futures.append(future)
+        return future
+
+    def _run_queued(self) -> None:
+        with self._lock:
+            filepaths = list(self._queued)
+            self._queued.clear()
+        if not filepaths:
+            # 先に走ったジョブがまとめて検査済み
+            return
+        with tracer.span("lint.background", files=len(filepaths)):
+            results = self.lint(filepaths)
+        with self._lock:
+            for result in results:
+                self._ready[result.filepath] = result
+
+    @property
+    def pending(self) -> bool:
+        """実行中・実行待ちのバックグラウンド lint があるか"""
+        with self._lock:
+            return any(not f.done() for f in self._futures)
+
+    def collect(self, wait_pending: bool = False) -> list[LintResult]:
+        """
+        バックグラウンドで終わった lint 結果のうち、問題があったものを取り出す（取り出した結果は消える）。
+        wait_pending=True なら未完了のジョブも待つ。検査後にファイルが書き換わった結果は捨てる。
+        """
+        with self._lock:
+            futures = list(self._futures)
+        if wait_pending and futures:
+            wait(futures, timeout=config.LINT_TIMEOUT_SECONDS)
+        with self._lock:
+            self._futures = [f for f in self._futures if not f.done()]
+            ready, self._ready = self._ready, {}
+        fresh = []
+        for result in ready.values():
+            source = _read(result.filepath)
+            if not result.ok and source is not None and _digest(source) == result.digest:
+                fresh.append(result)
+        return fresh
+
+    def close(self) -> None:
+        """バイトコンパイル用のプロセスプールを止める（終了時に atexit から呼ばれる）。"""
+        with self._lock:
+            pool, self._process_pool = self._process_pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _process_context():
+    """
+    プロセスプールの起動方式。litellm / httpx のスレッドが動いているプロセスを fork すると
+    ロックを握ったまま複製されてデッドロックしうるため、fork は使わない。
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+# グローバルなインスタンス（executor / pro_agent から使用）
+lint_service = LintService()
+atexit.register(lint_service.close)
@@ -0,0 +1,173 @@
+"""
+LLMCache: LLMレスポンスのディスクキャッシュ。
+
+プロバイダー・モデル・正規化したメッセージ・ツールスキーマ・生成パラメータから
+SHA-256 のキーを作り、同じ会話プレフィックスの再実行（CIの再実行や /pro のリトライ）で
+ローカル推論を丸ごとスキップする。
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import loca.config as config
+
+# ストリーミング再生時に1チャンクあたりに流す文字数
+REPLAY_CHUNK_SIZE = 48
+
+
+def _normalize_message(message: dict) -> dict:
+    """キャッシュキー用にメッセージを正規化する。先頭が '_' の内部キーは除外する。"""
+    normalized = {}
+    for key, value in message.items():
+        if key.startswith("_"):
+            continue
+        if key == "content" and value is None:
+            value = ""
+        normalized[key] = value
+    return normalized
+
+
+class LLMCache:
+    """
+    content-addressed なLLMレスポンスキャッシュ。
+
+    1エントリ = 1 JSON ファイル（<cache_dir>/<key[:2]>/<key>.json）。
+    ヒット時に mtime を更新し、容量・経過時間を超えたら mtime の古い順に削除する（LRU）。
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int, max_age_seconds: float, enabled: bool = False):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # キー生成
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def make_key(kind: str, provider: str, model_name: str, messages: list, tools: list | None = None, **params) -> str:
+        """呼び出し種別・プロバイダー・モデル・メッセージ・ツール・パラメータから安定したキーを作る。"""
+        payload = {
+            "kind": kind,
+            "provider": provider,
+            "model": model_name,
+            "messages": [_normalize_message(m) for m in messages],
+            "tools": tools or [],
+            "params": params,
+        }
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    # ------------------------------------------------------------------
+    # 読み書き
+    # ------------------------------------------------------------------
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> dict | None:
+        """キャッシュを引く。無効時・ミス時・期限切れ時は None を返す。"""
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            stat = path.stat()
+            if time.time() - stat.st_mtime > self.max_age_seconds:
+                path.unlink(missing_ok=True)
+                raise FileNotFoundError(path)
+            value = json.loads(path.read_text(encoding="utf-8"))
+            os.utime(path)  # LRU: 最終利用時刻を更新
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: dict) -> None:
+        """レスポンスを保存し、必要なら古いエントリを削除する。書き込み失敗は無視する。"""
+        if not self.enabled:
+            return
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp_path.write_text(json.dumps(value, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        self._evict()
+
+    def replay_stream(self, text: str):
+        """キャッシュ済みテキストをストリーミングと同じ形でチャンクに分けて yield する。"""
+        for i in range(0, len(text), REPLAY_CHUNK_SIZE):
+            yield text[i:i + REPLAY_CHUNK_SIZE]
+
+    # ------------------------------------------------------------------
+    # 削除・統計
+    # ------------------------------------------------------------------
+
+    def _evict(self) -> None:
+        """期限切れエントリを削除し、容量上限を超えていれば mtime の古い順に削除する。"""
+        entries = []
+        now = time.time()
+        with self._lock:
+            for path in self.cache_dir.glob("*/*.json"):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                if now - stat.st_mtime > self.max_age_seconds:
+                    path.unlink(missing_ok=True)
+                    self.evictions += 1
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            if total <= self.max_bytes:
+                return
+            for _, size, path in sorted(entries):
+                path.unlink(missing_ok=True)
+                self.evictions += 1
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def clear(self) -> int:
+        """全エントリを削除し、削除件数を返す。"""
+        removed = 0
+        with self._lock:
+            for path in self.cache_dir.glob("*/*.json"):
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+    def stats(self) -> dict:
+        """ヒット/ミス数などの統計を返す。"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "cache_dir": str(self.cache_dir),
+        }
+
+
+# グローバルなキャッシュインスタンス（llm_client から使用）
+llm_cache = LLMCache(
+    cache_dir=config.get_cache_dir() / "llm",
+    max_bytes=config.LLM_CACHE_MAX_BYTES,
+    max_age_seconds=config.LLM_CACHE_MAX_AGE_SECONDS,
+    enabled=config.LLM_CACHE_ENABLED,
+)
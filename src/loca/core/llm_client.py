@@ -1,10 +1,117 @@
+import asyncio
+import inspect
 import json
 import re
 import ast
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
 import litellm
 
+import loca.config as config
+from loca.core.llm_cache import llm_cache
+from loca.core.model_routes import model_router
+from loca.core.scheduler import request_scheduler, RequestCancelled
+from loca.core.cancellation import GenerationCancelled, current_cancel_token, raise_if_cancelled
+from loca.core.endpoint_pool import Lease, endpoint_pool
+from loca.core.generation_profiles import GenerationProfile, profile_builder
+from loca.core.schemas import SchemaSpec, structured_output
+from loca.core.token_counter import token_counter, heuristic_tokens
+from loca.core.tracing import Span, tracer
+
 litellm.suppress_debug_info = True
 
+# 別のエンドポイントで再試行する接続系のエラー
+_CONNECTION_ERRORS = (ConnectionError, TimeoutError) + tuple(
+    getattr(litellm, name) for name in ("APIConnectionError", "Timeout", "ServiceUnavailableError", "InternalServerError")
+    if hasattr(litellm, name)
+)
+# response_format の拒否として扱うエラー（400 / パラメータ未対応のみ。コンテキスト長超過は除く）
+_BAD_REQUEST_ERRORS = tuple(
+    getattr(litellm, name) for name in ("BadRequestError", "UnsupportedParamsError") if hasattr(litellm, name)
+)
+_CONTEXT_WINDOW_ERRORS = tuple(
+    getattr(litellm, name) for name in ("ContextWindowExceededError",) if hasattr(litellm, name)
+)
+
+TEMPERATURE = 0.1
+# ストリーミング中の例外を本文の末尾に流すときの前置き（呼び出し側で生成失敗を見分けるのに使う）
+STREAM_ERROR_PREFIX = "\n\nストリーミング中にエラーが発生しました: "
+
+
+def _litellm_model(model_name: str, provider: str) -> str:
+    """LiteLLM に渡すモデル文字列を返す。"""
+    return f"{provider}/{model_name}" if provider != "openai" else model_name
+
+
+def _prepare_messages(messages: list) -> list:
+    """
+    送信用にメッセージを整形する。先頭が '_' のキー（_loca_pinned 等の内部フラグ）は
+    プロバイダーに送らないよう取り除く。該当キーが無ければ元の dict をそのまま使う。
+    """
+    return [
+        {k: v for k, v in m.items() if not k.startswith("_")} if any(k.startswith("_") for k in m) else m
+        for m in messages
+    ]
+
+
+def _with_cache_breakpoints(messages: list) -> list:
+    """
+    Anthropic 用に、安定したプレフィックスの末尾へ cache_control を付ける。
+    システムプロンプトと、毎回変わる末尾（_loca_volatile）の直前のメッセージに区切りを置く。
+    OpenAI / Gemini はプレフィックスを自動でキャッシュするため指定は不要。
+    """
+    breakpoints = set()
+    if messages and messages[0].get("role") == "system":
+        breakpoints.add(0)
+    for i in range(len(messages) - 1, -1, -1):
+        if not messages[i].get("_loca_volatile"):
+            breakpoints.add(i)
+            break
+
+    marked = list(messages)
+    for i in breakpoints:
+        content = marked[i].get("content")
+        if isinstance(content, str) and content:
+            marked[i] = dict(marked[i])
+            marked[i]["content"] = [{"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}]
+    return marked
+
+
+def _request_kwargs(messages: list, model_name: str, provider: str, profile: GenerationProfile | None = None) -> dict:
+    """litellm.completion / acompletion に共通で渡す引数（生成プロファイルを含む）を組み立てる。"""
+    if provider == "anthropic":
+        messages = _with_cache_breakpoints(messages)
+    return {
+        "model": _litellm_model(model_name, provider),
+        "messages": _prepare_messages(messages),
+        **(profile.litellm_kwargs() if profile else {}),
+    }
+
+
+@dataclass
+class GenerationStats:
+    """1回の生成の計測結果（TTFT・生成時間・トークン数）"""
+    ttft: float | None         # 最初のトークンが届くまでの秒数
+    elapsed: float             # リクエスト開始から生成完了までの秒数
+    completion_tokens: int     # 生成トークン数（usage が無い場合はチャンク数で近似）
+    cached: bool = False       # LLMキャッシュから再生したか
+
+    @property
+    def tokens_per_second(self) -> float:
+        """TTFT 以降のデコード速度（tok/s）"""
+        decode_time = self.elapsed - (self.ttft or 0.0)
+        if decode_time <= 0 or not self.completion_tokens:
+            return 0.0
+        return self.completion_tokens / decode_time
+
+    def summary(self) -> str:
+        if self.cached:
+            return "cached"
+        ttft = f"{self.ttft:.1f}s" if self.ttft is not None else "-"
+        return f"TTFT {ttft}, {self.tokens_per_second:.1f} tok/s, {self.completion_tokens} tokens"
+
 
 def extract_json_from_text(text: str) -> dict | None:
     """AIが複数JSONを出力しても、最初の1つだけを確実に取り出す真のパーサー"""
@@ -37,133 +144,615 @@ def extract_json_from_text(text: str) -> dict | None:
             return None
 
 
-def chat_with_llm(messages: list, model_name: str, provider: str = "ollama", is_ask_mode: bool = False) -> dict:
+def _record_usage(usage, messages: list, model_name: str, provider: str,
+                  call_type: str | None = None, start: float | None = None, span: Span | None = None) -> None:
     """
-    LiteLLMを使用して、あらゆるプロバイダーと統一フォーマットで通信するFacade関数。
-    JSON テキストパース方式（フォールバック用）。
+    litellm が返した実際の usage をトークン集計に、所要時間を呼び出し種別ごとの集計に記録する。
+    span を渡すとトークン数と生成時間をスパンの属性にも残す。
     """
-    try:
-        litellm_model = f"{provider}/{model_name}" if provider != "openai" else model_name
-
-        response = litellm.completion(
-            model=litellm_model,
-            messages=messages,
-            temperature=0.1
+    token_counter.record_usage(usage, messages, model_name, provider)
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    if start is not None:
+        model_router.record(call_type, model_name, provider, time.perf_counter() - start, completion_tokens)
+    if span is not None:
+        span.set(
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            completion_tokens=completion_tokens,
+            generation_seconds=time.perf_counter() - start if start is not None else None,
         )
 
-        raw_content = response.choices[0].message.content
 
-        if is_ask_mode:
-            return {"raw_response": raw_content}
+def _llm_span(kind: str, model_name: str, provider: str, call_type: str | None, stream: bool = False,
+              asynchronous: bool = False):
+    """LLM呼び出し1回分のスパン（ストリームのジェネレータ内でも使えるよう親にはしない）"""
+    make_span = tracer.aspan if asynchronous else tracer.span
+    return make_span(
+        "llm.call", activate=False, kind=kind, model=model_name, provider=provider,
+        call_type=call_type or "default", stream=stream,
+    )
 
-        parsed_data = extract_json_from_text(raw_content)
 
-        if parsed_data:
-            return parsed_data
-        else:
-            return {
-                "error": "JSON_PARSE_ERROR",
-                "raw_response": raw_content
-            }
+def _connection_error(model_name: str, provider: str, e: Exception) -> dict:
+    return {
+        "error": "LLM_CONNECTION_ERROR",
+        "raw_response": f"LLMとの通信に失敗しました。\nモデル: {provider}/{model_name}\n詳細: {str(e)}"
+    }
 
-    except Exception as e:
+
+def _chat_result(raw_content: str, is_ask_mode: bool) -> dict:
+    """テキスト応答を chat_with_llm の戻り値形式に変換する。"""
+    if is_ask_mode:
+        return {"raw_response": raw_content}
+
+    parsed_data = extract_json_from_text(raw_content)
+
+    if parsed_data:
+        return parsed_data
+    else:
         return {
-            "error": "LLM_CONNECTION_ERROR",
-            "raw_response": f"LLMとの通信に失敗しました。\nモデル: {provider}/{model_name}\n詳細: {str(e)}"
+            "error": "JSON_PARSE_ERROR",
+            "raw_response": raw_content
         }
 
 
+def _tool_result(message) -> dict:
+    """Function Calling の応答メッセージを {"thought", "action", "args"} に変換する。"""
+    calls = [
+        {"id": getattr(tc, "id", None), "name": tc.function.name, "arguments": tc.function.arguments}
+        for tc in (message.tool_calls or [])
+    ]
+    return _tool_result_from_parts(message.content or "", calls)
+
+
+def _tool_result_from_parts(content: str, calls: list[dict]) -> dict:
+    """
+    本文テキストと tool_calls（id / name / arguments 文字列）から戻り値を組み立てる。
+    先頭の呼び出しを thought / action / args に、全呼び出しを tool_calls に入れる。
+    """
+    if not calls:
+        # リクエストは通ったが tool_calls が落ちた（本文にJSONで書かれていることがある）
+        return {"error": "NO_TOOL_CALL", "reason": "dropped", "raw_response": content}
+
+    tool_calls = []
+    for i, call in enumerate(calls):
+        try:
+            args = json.loads(call["arguments"] or "{}")
+        except json.JSONDecodeError:
+            args = {}
+        if not isinstance(args, dict):
+            args = {}
+        tool_calls.append({
+            "id": call.get("id") or f"call_{i}",
+            "name": call["name"],
+            # スキーマ定義した thought をargsから取り出す
+            "thought": args.pop("thought", ""),
+            "args": args,
+        })
+
+    # テキスト部分は thought として使う（tool_calls の thought があればそちらを優先）
+    first = tool_calls[0]
+    return {
+        "thought": first["thought"] or content,
+        "action": first["name"],
+        "args": first["args"],
+        "tool_calls": tool_calls,
+    }
+
+
+def _tools_error(model_name: str, provider: str, e: Exception) -> dict:
+    error_str = str(e)
+    # Function Calling 非対応エラーを検出してフォールバックを促す
+    if any(kw in error_str.lower() for kw in ("tool", "function", "unsupported", "not support")):
+        return {"error": "NO_TOOL_CALL", "reason": "unsupported", "raw_response": error_str}
+    return _connection_error(model_name, provider, e)
+
+
+def _drop_response_format(request: dict, spec: SchemaSpec | None, model_name: str, provider: str, e: Exception) -> bool:
+    """response_format が原因のエラーなら未対応として記録し、request から外して True を返す。"""
+    if spec is None or "response_format" not in request or not _is_bad_request(e):
+        return False
+    if not structured_output.is_unsupported_error(e):
+        return False
+    structured_output.mark_unsupported(provider, model_name)
+    structured_output.record_fallback(spec.name)
+    del request["response_format"]
+    return True
+
+
+def _is_bad_request(e: Exception) -> bool:
+    """リクエスト内容が拒否されたエラー（400 / UnsupportedParamsError）か"""
+    if isinstance(e, _CONTEXT_WINDOW_ERRORS):
+        return False
+    return isinstance(e, _BAD_REQUEST_ERRORS) or getattr(e, "status_code", None) == 400
+
+
+def _is_connection_error(e: Exception) -> bool:
+    """別のエンドポイントで再試行すべき接続系のエラーか"""
+    return isinstance(e, _CONNECTION_ERRORS)
+
+
+def _completion(request: dict, spec: SchemaSpec | None, model_name: str, provider: str, lease: Lease | None = None):
+    """
+    litellm.completion を呼ぶ。
+    構造化出力が未対応なら制約を外して1度だけ送り直し、接続エラーならバックオフ後に別のエンドポイントで再試行する。
+    """
+    attempt = 0
+    while True:
+        if lease is not None:
+            lease.apply(request)
+        try:
+            response = litellm.completion(**request)
+        except Exception as e:
+            if _drop_response_format(request, spec, model_name, provider, e):
+                continue
+            if lease is None or not _is_connection_error(e) or not lease.failover():
+                raise
+            attempt += 1
+            time.sleep(config.FAILOVER_BACKOFF_SECONDS * 2 ** (attempt - 1))
+            continue
+        if lease is not None:
+            lease.succeeded()
+        return response
+
+
+async def _acompletion(request: dict, spec: SchemaSpec | None, model_name: str, provider: str, lease: Lease | None = None):
+    """_completion の asyncio 版"""
+    attempt = 0
+    while True:
+        if lease is not None:
+            lease.apply(request)
+        try:
+            response = await litellm.acompletion(**request)
+        except Exception as e:
+            if _drop_response_format(request, spec, model_name, provider, e):
+                continue
+            if lease is None or not _is_connection_error(e) or not await lease.afailover():
+                raise
+            attempt += 1
+            await asyncio.sleep(config.FAILOVER_BACKOFF_SECONDS * 2 ** (attempt - 1))
+            continue
+        if lease is not None:
+            lease.succeeded()
+        return response
+
+
+@contextmanager
+def _slot(provider: str, call_type: str | None):
+    """
+    同期版のスロット獲得。現在のキャンセルトークン（/pro・/commit の Ctrl-C）がセットされたら
+    待機をやめ、GenerationCancelled として送出する。
+    """
+    token = current_cancel_token.get()
+    try:
+        with request_scheduler.slot(provider, call_type, token.event if token else None) as ticket:
+            yield ticket
+    except RequestCancelled:
+        raise GenerationCancelled() from None
+
+
+def _close_stream(response) -> None:
+    """
+    ストリームの HTTP 接続を閉じる。途中で打ち切った場合にサーバー側（Ollama 等）の生成を止めるため。
+    litellm のラッパーと内側のストリームの両方を試す（バージョンやプロバイダーで実装が異なる）。
+    """
+    for target in (getattr(response, "completion_stream", None), response):
+        close = getattr(target, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception:
+                pass
+
+
+async def _aclose_stream(response) -> None:
+    """_close_stream の asyncio 版"""
+    for target in (getattr(response, "completion_stream", None), response):
+        close = getattr(target, "aclose", None) or getattr(target, "close", None)
+        if callable(close):
+            try:
+                result = close()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                pass
+
+
+def _schema_param(spec: SchemaSpec | None) -> dict:
+    """キャッシュキーに含めるスキーマ名（同じメッセージでもスキーマが違えば別の応答として扱う）"""
+    return {"schema": spec.name} if spec is not None else {}
+
+
+def _schema_checked(result: dict, spec: SchemaSpec | None) -> dict:
+    """スキーマ付きの呼び出しがJSONとして読めなかった場合に記録する。"""
+    if spec is not None and result.get("error") == "JSON_PARSE_ERROR":
+        structured_output.record_parse_failure(spec.name)
+    return result
+
+
+def chat_with_llm(messages: list, model_name: str, provider: str = "ollama", is_ask_mode: bool = False,
+                  call_type: str | None = None, response_schema: SchemaSpec | None = None) -> dict:
+    """
+    LiteLLMを使用して、あらゆるプロバイダーと統一フォーマットで通信するFacade関数。
+    JSON テキストパース方式（フォールバック用）。
+    response_schema を渡すと、対応プロバイダーでは出力をそのスキーマのJSONに制約する。
+    """
+    model_name, provider = model_router.resolve(call_type, model_name, provider)
+    profile = profile_builder.build(call_type, messages, model_name, provider)
+    try:
+        cache_key = llm_cache.make_key("chat", provider, model_name, messages, temperature=TEMPERATURE,
+                                       **_schema_param(response_schema), **profile.cache_params())
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return _chat_result(cached["content"], is_ask_mode)
+
+        with _llm_span("chat", model_name, provider, call_type, stream=False) as span, \
+                _slot(provider, call_type) as ticket, endpoint_pool.lease(provider, model_name) as lease:
+            # 計測はスロット獲得後から（キュー待ちは scheduler 側で計測する）
+            start = time.perf_counter()
+            span.set(queue_wait_seconds=ticket.wait_time)
+            request = {
+                **_request_kwargs(messages, model_name, provider, profile),
+                **structured_output.request_kwargs(response_schema, provider, model_name),
+                "temperature": TEMPERATURE,
+            }
+            response = _completion(request, response_schema, model_name, provider, lease)
+            _record_usage(getattr(response, "usage", None), messages, model_name, provider, call_type, start, span)
+            raw_content = response.choices[0].message.content or ""
+            result = _chat_result(raw_content, is_ask_mode)
+            # JSON として読めなかった応答は保存しない（リトライで同じ失敗を再生しないように）
+            if result.get("error") != "JSON_PARSE_ERROR":
+                llm_cache.put(cache_key, {"content": raw_content})
+            return _schema_checked(result, response_schema)
+
+    except GenerationCancelled:
+        raise
+    except Exception as e:
+        return _connection_error(model_name, provider, e)
+
+
 def chat_with_tools(
     messages: list,
     tools: list[dict],
     model_name: str,
     provider: str = "ollama",
+    call_type: str | None = None,
 ) -> dict:
     """
     Function Calling API を使用してLLMと通信する。JSONパースエラーを根絶する。
 
     戻り値:
-        成功時: {"thought": str, "action": str, "args": dict}
+        成功時: {"thought": str, "action": str, "args": dict, "tool_calls": list[dict]}
+                tool_calls は返ってきた全呼び出し（{"id", "name", "thought", "args"}）。
+                action / args は先頭の呼び出しと同じ。
         エラー時: {"error": str, "raw_response": str}
 
     "NO_TOOL_CALL" エラーは Function Calling 非対応モデルのフォールバックサイン。
     """
+    model_name, provider = model_router.resolve(call_type, model_name, provider)
+    profile = profile_builder.build(call_type, messages, model_name, provider)
     try:
-        litellm_model = f"{provider}/{model_name}" if provider != "openai" else model_name
-
-        response = litellm.completion(
-            model=litellm_model,
-            messages=messages,
-            tools=tools,
-            tool_choice="required",
-            temperature=0.1,
-        )
+        cache_key = llm_cache.make_key("tools", provider, model_name, messages, tools, temperature=TEMPERATURE, **profile.cache_params())
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        with _llm_span("tools", model_name, provider, call_type, stream=False) as span, \
+                _slot(provider, call_type) as ticket, endpoint_pool.lease(provider, model_name) as lease:
+            # 計測はスロット獲得後から（キュー待ちは scheduler 側で計測する）
+            start = time.perf_counter()
+            span.set(queue_wait_seconds=ticket.wait_time)
+            response = _completion(dict(
+                **_request_kwargs(messages, model_name, provider, profile),
+                tools=tools,
+                tool_choice="required",
+                temperature=TEMPERATURE,
+            ), None, model_name, provider, lease)
+            _record_usage(getattr(response, "usage", None), messages, model_name, provider, call_type, start, span)
+            result = _tool_result(response.choices[0].message)
+            if "error" not in result:
+                llm_cache.put(cache_key, result)
+            return result
+
+    except GenerationCancelled:
+        raise
+    except Exception as e:
+        return _tools_error(model_name, provider, e)
 
-        message = response.choices[0].message
-        # テキスト部分は thought として使う（tool_calls と共存する場合も）
-        thought = message.content or ""
 
-        if not message.tool_calls:
-            return {"error": "NO_TOOL_CALL", "raw_response": thought}
+def stream_chat_with_llm(messages: list, model_name: str, provider: str = "ollama", call_type: str | None = None,
+                         response_schema: SchemaSpec | None = None, temperature: float | None = None,
+                         seed: int | None = None):
+    """
+    LLMのレスポンスをストリーミングで返すジェネレータ関数（/ask・/pro で使用）。
+    各チャンクのテキストを逐次 yield する。
+    キャッシュヒット時は保存済みの回答をチャンクに分けて再生する。
+    response_schema を渡すと、対応プロバイダーでは出力をそのスキーマのJSONに制約する
+    （パース失敗の記録は呼び出し側で structured_output.record_parse_failure を呼ぶ）。
+    temperature / seed を渡すと既定の TEMPERATURE の代わりに使う（/pro の複数候補の生成で出力をばらつかせる）。
+    """
+    model_name, provider = model_router.resolve(call_type, model_name, provider)
+    profile = profile_builder.build(call_type, messages, model_name, provider)
+    temperature = TEMPERATURE if temperature is None else temperature
+    sampling = {"temperature": temperature, **({"seed": seed} if seed is not None else {})}
+    try:
+        cache_key = llm_cache.make_key("chat", provider, model_name, messages, **sampling,
+                                       **_schema_param(response_schema), **profile.cache_params())
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            yield from llm_cache.replay_stream(cached["content"])
+            return
+
+        with _llm_span("chat", model_name, provider, call_type, stream=True) as span, \
+                _slot(provider, call_type) as ticket, endpoint_pool.lease(provider, model_name) as lease:
+            # 計測はスロット獲得後から（キュー待ちは scheduler 側で計測する）
+            start = time.perf_counter()
+            span.set(queue_wait_seconds=ticket.wait_time)
+            request = {
+                **_request_kwargs(messages, model_name, provider, profile),
+                **structured_output.request_kwargs(response_schema, provider, model_name),
+                **sampling,
+                "stream": True,
+                "stream_options": {"include_usage": True},
+            }
+            response = _completion(request, response_schema, model_name, provider, lease)
+
+            full_text = ""
+            usage = None
+            try:
+                for chunk in response:
+                    # スレッドで動く同期ストリームはチャンクの合間に中断を確認する
+                    raise_if_cancelled()
+                    usage = getattr(chunk, "usage", None) or usage
+                    if not chunk.choices:
+                        continue
+                    content = chunk.choices[0].delta.content
+                    if content:
+                        if not full_text:
+                            span.set(ttft_seconds=time.perf_counter() - start)
+                        full_text += content
+                        yield content
+            finally:
+                # 中断・呼び出し側の break で抜けた場合も接続を閉じてサーバー側の生成を止める
+                _close_stream(response)
+            _record_usage(usage, messages, model_name, provider, call_type, start, span)
+            # 最後まで受信できた場合のみ保存する（途中エラーの断片や、スキーマ付きで JSON として読めない応答はキャッシュしない）
+            if response_schema is None or extract_json_from_text(full_text) is not None:
+                llm_cache.put(cache_key, {"content": full_text})
+
+    except GenerationCancelled:
+        raise
+    except Exception as e:
+        yield f"{STREAM_ERROR_PREFIX}{e}"
 
-        tool_call = message.tool_calls[0]
-        action = tool_call.function.name
 
-        try:
-            args = json.loads(tool_call.function.arguments)
-        except json.JSONDecodeError:
-            args = {}
+# ==========================================
+# asyncio 版（litellm.acompletion を使用）
+# ==========================================
 
-        # スキーマ定義した thought をargsから取り出す
-        if "thought" in args:
-            thought = args.pop("thought")
+async def achat_with_llm(messages: list, model_name: str, provider: str = "ollama", is_ask_mode: bool = False,
+                        call_type: str | None = None, response_schema: SchemaSpec | None = None) -> dict:
+    """chat_with_llm の asyncio 版。推論待ちの間もイベントループを止めない。"""
+    model_name, provider = model_router.resolve(call_type, model_name, provider)
+    profile = profile_builder.build(call_type, messages, model_name, provider)
+    try:
+        cache_key = llm_cache.make_key("chat", provider, model_name, messages, temperature=TEMPERATURE,
+                                       **_schema_param(response_schema), **profile.cache_params())
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return _chat_result(cached["content"], is_ask_mode)
+
+        async with _llm_span("chat", model_name, provider, call_type, stream=False, asynchronous=True) as span, \
+                request_scheduler.aslot(provider, call_type) as ticket, endpoint_pool.alease(provider, model_name) as lease:
+            # 計測はスロット獲得後から（キュー待ちは scheduler 側で計測する）
+            start = time.perf_counter()
+            span.set(queue_wait_seconds=ticket.wait_time)
+            request = {
+                **_request_kwargs(messages, model_name, provider, profile),
+                **structured_output.request_kwargs(response_schema, provider, model_name),
+                "temperature": TEMPERATURE,
+            }
+            response = await _acompletion(request, response_schema, model_name, provider, lease)
+            _record_usage(getattr(response, "usage", None), messages, model_name, provider, call_type, start, span)
+            raw_content = response.choices[0].message.content or ""
+            result = _chat_result(raw_content, is_ask_mode)
+            # JSON として読めなかった応答は保存しない（リトライで同じ失敗を再生しないように）
+            if result.get("error") != "JSON_PARSE_ERROR":
+                llm_cache.put(cache_key, {"content": raw_content})
+            return _schema_checked(result, response_schema)
+
+    except GenerationCancelled:
+        raise
+    except Exception as e:
+        return _connection_error(model_name, provider, e)
 
-        return {"thought": thought, "action": action, "args": args}
 
+async def achat_with_tools(
+    messages: list,
+    tools: list[dict],
+    model_name: str,
+    provider: str = "ollama",
+    call_type: str | None = None,
+) -> dict:
+    """chat_with_tools の asyncio 版。戻り値の形式は同じ。"""
+    model_name, provider = model_router.resolve(call_type, model_name, provider)
+    profile = profile_builder.build(call_type, messages, model_name, provider)
+    try:
+        cache_key = llm_cache.make_key("tools", provider, model_name, messages, tools, temperature=TEMPERATURE, **profile.cache_params())
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        async with _llm_span("tools", model_name, provider, call_type, stream=False, asynchronous=True) as span, \
+                request_scheduler.aslot(provider, call_type) as ticket, endpoint_pool.alease(provider, model_name) as lease:
+            # 計測はスロット獲得後から（キュー待ちは scheduler 側で計測する）
+            start = time.perf_counter()
+            span.set(queue_wait_seconds=ticket.wait_time)
+            response = await _acompletion(dict(
+                **_request_kwargs(messages, model_name, provider, profile),
+                tools=tools,
+                tool_choice="required",
+                temperature=TEMPERATURE,
+            ), None, model_name, provider, lease)
+            _record_usage(getattr(response, "usage", None), messages, model_name, provider, call_type, start, span)
+            result = _tool_result(response.choices[0].message)
+            if "error" not in result:
+                llm_cache.put(cache_key, result)
+            return result
+
+    except GenerationCancelled:
+        raise
     except Exception as e:
-        error_str = str(e)
-        # Function Calling 非対応エラーを検出してフォールバックを促す
-        if any(kw in error_str.lower() for kw in ("tool", "function", "unsupported", "not support")):
-            return {"error": "NO_TOOL_CALL", "raw_response": error_str}
-        return {
-            "error": "LLM_CONNECTION_ERROR",
-            "raw_response": f"LLMとの通信に失敗しました。\nモデル: {provider}/{model_name}\n詳細: {error_str}"
-        }
+        return _tools_error(model_name, provider, e)
 
 
-def stream_chat_with_llm(messages: list, model_name: str, provider: str = "ollama"):
+async def astream_chat_with_tools(
+    messages: list,
+    tools: list[dict],
+    model_name: str,
+    provider: str = "ollama",
+    call_type: str | None = None,
+):
     """
-    /askモード専用: LLMのレスポンスをストリーミングで返すジェネレータ関数。
-    各チャンクのテキストを逐次 yield する。
+    Function Calling をストリーミングで実行する async ジェネレータ。
+    tool_call の arguments を差分で受け取り、生成途中の状態をイベントとして yield する。
+
+    イベント:
+        {"type": "content", "text": 累積本文}
+        {"type": "tool_call", "index": int, "name": str, "delta": 今回のarguments差分, "arguments": 累積arguments文字列}
+        {"type": "done", "result": chat_with_tools と同じ形式の dict, "stats": GenerationStats | None}
     """
+    model_name, provider = model_router.resolve(call_type, model_name, provider)
+    profile = profile_builder.build(call_type, messages, model_name, provider)
     try:
-        litellm_model = f"{provider}/{model_name}" if provider != "openai" else model_name
-
-        response = litellm.completion(
-            model=litellm_model,
-            messages=messages,
-            temperature=0.1,
-            stream=True
-        )
+        cache_key = llm_cache.make_key("tools", provider, model_name, messages, tools, temperature=TEMPERATURE, **profile.cache_params())
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            yield {"type": "done", "result": cached, "stats": GenerationStats(0.0, 0.0, 0, cached=True)}
+            return
+
+        async with _llm_span("tools", model_name, provider, call_type, stream=True, asynchronous=True) as span, \
+                request_scheduler.aslot(provider, call_type) as ticket, endpoint_pool.alease(provider, model_name) as lease:
+            # 計測はスロット獲得後から（キュー待ちは scheduler 側で計測する）
+            start = time.perf_counter()
+            span.set(queue_wait_seconds=ticket.wait_time)
+            response = await _acompletion(dict(
+                **_request_kwargs(messages, model_name, provider, profile),
+                tools=tools,
+                tool_choice="required",
+                temperature=TEMPERATURE,
+                stream=True,
+                stream_options={"include_usage": True},
+            ), None, model_name, provider, lease)
+
+            content = ""
+            calls: dict[int, dict] = {}
+            ttft = None
+            chunk_count = 0
+            usage = None
+            try:
+                async for chunk in response:
+                    usage = getattr(chunk, "usage", None) or usage
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+                    if ttft is None and (delta.content or delta.tool_calls):
+                        ttft = time.perf_counter() - start
+                    if delta.content:
+                        chunk_count += 1
+                        content += delta.content
+                        yield {"type": "content", "text": content}
+                    for tc in delta.tool_calls or []:
+                        chunk_count += 1
+                        index = getattr(tc, "index", None) or 0
+                        entry = calls.setdefault(index, {"id": None, "name": "", "arguments": ""})
+                        delta_args = ""
+                        if getattr(tc, "id", None):
+                            entry["id"] = tc.id
+                        if tc.function is not None:
+                            if tc.function.name:
+                                entry["name"] = tc.function.name
+                            if tc.function.arguments:
+                                delta_args = tc.function.arguments
+                                entry["arguments"] += delta_args
+                        yield {
+                            "type": "tool_call", "index": index, "name": entry["name"],
+                            "delta": delta_args, "arguments": entry["arguments"],
+                        }
+            finally:
+                # タスクのキャンセル（Ctrl-C）で抜けた場合も接続を閉じてサーバー側の生成を止める
+                await _aclose_stream(response)
+
+            span.set(ttft_seconds=ttft)
+            stats = GenerationStats(
+                ttft=ttft,
+                elapsed=time.perf_counter() - start,
+                completion_tokens=(getattr(usage, "completion_tokens", 0) or 0) or chunk_count,
+            )
+            _record_usage(usage, messages, model_name, provider, call_type, start, span)
+            result = _tool_result_from_parts(content, [calls[i] for i in sorted(calls)])
+            if "error" not in result:
+                llm_cache.put(cache_key, result)
+            yield {"type": "done", "result": result, "stats": stats}
+
+    except GenerationCancelled:
+        raise
+    except Exception as e:
+        yield {"type": "done", "result": _tools_error(model_name, provider, e), "stats": None}
 
-        for chunk in response:
-            content = chunk.choices[0].delta.content
-            if content:
-                yield content
 
+async def astream_chat_with_llm(messages: list, model_name: str, provider: str = "ollama", call_type: str | None = None):
+    """stream_chat_with_llm の asyncio 版（async ジェネレータ）。"""
+    model_name, provider = model_router.resolve(call_type, model_name, provider)
+    profile = profile_builder.build(call_type, messages, model_name, provider)
+    try:
+        cache_key = llm_cache.make_key("chat", provider, model_name, messages, temperature=TEMPERATURE, **profile.cache_params())
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            for piece in llm_cache.replay_stream(cached["content"]):
+                yield piece
+            return
+
+        async with _llm_span("chat", model_name, provider, call_type, stream=True, asynchronous=True) as span, \
+                request_scheduler.aslot(provider, call_type) as ticket, endpoint_pool.alease(provider, model_name) as lease:
+            # 計測はスロット獲得後から（キュー待ちは scheduler 側で計測する）
+            start = time.perf_counter()
+            span.set(queue_wait_seconds=ticket.wait_time)
+            response = await _acompletion(dict(
+                **_request_kwargs(messages, model_name, provider, profile),
+                temperature=TEMPERATURE,
+                stream=True,
+                stream_options={"include_usage": True},
+            ), None, model_name, provider, lease)
+
+            full_text = ""
+            usage = None
+            try:
+                async for chunk in response:
+                    usage = getattr(chunk, "usage", None) or usage
+                    if not chunk.choices:
+                        continue
+                    content = chunk.choices[0].delta.content
+                    if content:
+                        if not full_text:
+                            span.set(ttft_seconds=time.perf_counter() - start)
+                        full_text += content
+                        yield content
+            finally:
+                # タスクのキャンセルや呼び出し側の打ち切りで抜けた場合も接続を閉じる
+                await _aclose_stream(response)
+            _record_usage(usage, messages, model_name, provider, call_type, start, span)
+            llm_cache.put(cache_key, {"content": full_text})
+
+    except GenerationCancelled:
+        raise
     except Exception as e:
-        yield f"\n\nストリーミング中にエラーが発生しました: {e}"
+        yield f"{STREAM_ERROR_PREFIX}{e}"
 
 
 def estimate_tokens(messages: list) -> int:
     """
-    メッセージリストの概算トークン数を返す。
+    メッセージリストの概算トークン数を返す（補正なしの簡易推定）。
     日本語は1文字≈1.5トークン、英語は4文字≈1トークンの簡易推定。
+    実トークナイザー・実測補正・キャッシュ付きの計測は token_counter.count_messages を使う。
     """
-    total_tokens = 0
-    for m in messages:
-        content = m.get("content", "") or ""
-        ja_chars = len(re.findall(r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FFF]', content))
-        en_chars = len(content) - ja_chars
-        total_tokens += int(ja_chars * 1.5) + int(en_chars / 4)
-    return total_tokens
+    return sum(heuristic_tokens(m.get("content", "") or "") for m in messages)
@@ -0,0 +1,144 @@
+"""
+ModelRouter: 呼び出し種別（計画・ツールステップ・コミットメッセージ・要約・レビュー・修復）ごとに
+使うモデルを切り替えるルーティング層。
+
+コミットメッセージや要約、JSONの修復といった軽い呼び出しを小型モデルに回し、
+大きなモデルの推論時間を本当に難しい処理だけに使う。
+小型モデルで失敗した場合はメインモデルへ昇格（エスカレーション）し、しばらくその種別はメインモデルを使う。
+種別ごとの呼び出し回数・所要時間・メインモデルと比べて節約できた推定時間を集計する。
+"""
+import threading
+from dataclasses import dataclass
+
+import loca.config as config
+
+# 呼び出し種別
+CALL_PLANNING = "planning"              # /pro の設計・コード生成
+CALL_TOOL_STEP = "tool_step"            # エージェントの1ステップ（次に実行するツールの決定）
+CALL_COMMIT_MESSAGE = "commit_message"  # /commit のメッセージ生成
+CALL_SUMMARIZATION = "summarization"    # コンテキスト圧縮の要約
+CALL_REVIEW = "review"                  # /pro のレビュー
+CALL_REPAIR = "repair"                  # JSONパース失敗・lintエラーの修正
+CALL_TYPES = (CALL_PLANNING, CALL_TOOL_STEP, CALL_COMMIT_MESSAGE, CALL_SUMMARIZATION, CALL_REVIEW, CALL_REPAIR)
+
+_PROVIDERS = ("ollama", "openai", "anthropic", "gemini")
+
+
+@dataclass
+class RouteStats:
+    """呼び出し種別ごとの集計"""
+    calls: int = 0
+    routed_calls: int = 0        # メインモデル以外に回した回数
+    escalations: int = 0
+    elapsed: float = 0.0
+    routed_elapsed: float = 0.0
+    routed_tokens: int = 0
+
+    @property
+    def average_latency(self) -> float:
+        return self.elapsed / self.calls if self.calls else 0.0
+
+
+def parse_route(value: str, default_provider: str) -> tuple[str, str]:
+    """"provider/model" 形式を (model_name, provider) に分解する。プロバイダー省略時は default_provider。"""
+    head, sep, rest = value.partition("/")
+    if sep and head in _PROVIDERS:
+        return rest, head
+    return value, default_provider
+
+
+class ModelRouter:
+    """呼び出し種別 → モデルの対応表とエスカレーション状態・計測結果を保持するクラス"""
+
+    def __init__(self, routes: dict[str, str] | None = None, escalation_hold: int = config.ROUTE_ESCALATION_HOLD):
+        self.routes: dict[str, str] = dict(routes or {})
+        self.escalation_hold = escalation_hold
+        self.stats: dict[str, RouteStats] = {}
+        self._escalated: dict[str, int] = {}
+        # provider/model → (合計秒数, 合計生成トークン)。メインモデルの速度推定に使う
+        self._model_rates: dict[str, tuple[float, int]] = {}
+        self._main_key: str | None = None
+        self._lock = threading.Lock()
+
+    def set_small_model(self, model: str, call_types=config.SMALL_MODEL_CALL_TYPES) -> None:
+        """指定した種別をまとめて小型モデルに回す（個別に設定済みの種別は上書きしない）。"""
+        for call_type in call_types:
+            self.routes.setdefault(call_type, model)
+
+    # ------------------------------------------------------------------
+    # ルーティング
+    # ------------------------------------------------------------------
+
+    def resolve(self, call_type: str | None, model_name: str, provider: str) -> tuple[str, str]:
+        """
+        呼び出し種別に対応する (model_name, provider) を返す。
+        ルートが無い種別・エスカレーション中の種別は渡されたメインモデルをそのまま返す。
+        """
+        with self._lock:
+            self._main_key = f"{provider}/{model_name}"
+            route = self.routes.get(call_type) if call_type else None
+            if not route or self._escalated.get(call_type, 0) > 0:
+                return model_name, provider
+        return parse_route(route, provider)
+
+    def escalate(self, call_type: str) -> bool:
+        """
+        小型モデルでの失敗を記録し、以降 escalation_hold 回はメインモデルを使わせる。
+        昇格先が無い（ルート未設定・すでに昇格中）場合は False を返す。
+        """
+        with self._lock:
+            if not self.routes.get(call_type) or self._escalated.get(call_type, 0) > 0:
+                return False
+            self._escalated[call_type] = self.escalation_hold
+            self.stats.setdefault(call_type, RouteStats()).escalations += 1
+            return True
+
+    # ------------------------------------------------------------------
+    # 計測
+    # ------------------------------------------------------------------
+
+    def record(self, call_type: str | None, model_name: str, provider: str, elapsed: float, completion_tokens: int) -> None:
+        """1回分の呼び出し結果を記録する（llm_client から呼ばれる）。"""
+        key = f"{provider}/{model_name}"
+        with self._lock:
+            total_elapsed, total_tokens = self._model_rates.get(key, (0.0, 0))
+            self._model_rates[key] = (total_elapsed + elapsed, total_tokens + completion_tokens)
+            if not call_type:
+                return
+            stats = self.stats.setdefault(call_type, RouteStats())
+            stats.calls += 1
+            stats.elapsed += elapsed
+            if key != self._main_key:
+                stats.routed_calls += 1
+                stats.routed_elapsed += elapsed
+                stats.routed_tokens += completion_tokens
+            elif self._escalated.get(call_type, 0) > 0:
+                self._escalated[call_type] -= 1
+
+    def latency_saved(self, call_type: str) -> float | None:
+        """
+        小型モデルに回したことで節約できた推定秒数を返す。
+        同じトークン数をメインモデルで生成した場合の時間（実測した秒/トークン）との差。未計測なら None。
+        """
+        with self._lock:
+            stats = self.stats.get(call_type)
+            main = self._model_rates.get(self._main_key) if self._main_key else None
+            if not stats or not stats.routed_calls or not main or not main[1]:
+                return None
+            seconds_per_token = main[0] / main[1]
+            return stats.routed_tokens * seconds_per_token - stats.routed_elapsed
+
+    def report_rows(self, model_name: str, provider: str) -> list[tuple[str, str, RouteStats, float | None]]:
+        """/routes 表示用に (種別, モデル, 集計, 節約秒数) の一覧を返す。"""
+        rows = []
+        for call_type in CALL_TYPES:
+            routed_model, routed_provider = self.resolve(call_type, model_name, provider)
+            label = f"{routed_provider}/{routed_model}"
+            if self._escalated.get(call_type, 0) > 0:
+                label += " (escalated)"
+            rows.append((call_type, label, self.stats.get(call_type, RouteStats()), self.latency_saved(call_type)))
+        return rows
+
+
+# グローバルなインスタンス（llm_client / AgentSession / pro_agent / git_ops から使用）
+model_router = ModelRouter(config.get_model_routes())
@@ -1,172 +1,540 @@
 import os
 import re
-import json
-import subprocess
+import time
+import difflib
+import tempfile
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from functools import partial
+from typing import Callable
 from rich.panel import Panel
 from rich.syntax import Syntax
 from rich.live import Live
 from rich.text import Text as RichText
-from loca.ui.display import console, print_error
-from loca.core.llm_client import chat_with_llm, stream_chat_with_llm, extract_json_from_text
-from loca.core.prompts import get_editor_prompt, get_reviewer_prompt
+from loca.ui.display import console, print_error, ask_input
+from loca.core.llm_client import stream_chat_with_llm, extract_json_from_text, STREAM_ERROR_PREFIX, TEMPERATURE
+from loca.core.json_stream import StreamingJSONParser
+from loca.core.model_routes import model_router, CALL_PLANNING, CALL_REVIEW, CALL_REPAIR
+from loca.core.scheduler import endpoint_for, endpoint_limit
+from loca.core.schemas import structured_output, PRO_PLAN, REVIEWER_DECISION, REVIEWER_RANKING
+from loca.core.cancellation import GenerationCancelled
+from loca.core.tracing import tracer
+from loca.core.lint_service import lint_service
+from loca.core.prompts import get_planner_prompt, get_file_editor_prompt, get_reviewer_prompt
 from loca.tools.file_ops import write_file
 import loca.config as config
 
 
-def _extract_thought(partial_text: str) -> str:
-    """ストリーミング途中のJSONからthoughtフィールドを取り出す"""
-    match = re.search(r'"thought"\s*:\s*"((?:[^"\\]|\\.)*)', partial_text, re.DOTALL)
-    if match:
-        raw = match.group(1)
-        return raw.replace('\\n', '\n').replace('\\"', '"').replace('\\\\', '\\')
-    return ""
-
-
-def _stream_with_thought(messages, model_name, provider, title, border_style="cyan"):
-    """ストリーミングしながらthoughtをリアルタイム表示し、完成したdictを返す"""
-    full_text = ""
+def _stream_with_thought(messages, model_name, provider, title, border_style="cyan", call_type=None, response_schema=None):
+    """
+    ストリーミングしながらthoughtと生成中のファイル名をリアルタイム表示し、完成したdictを返す。
+    StreamingJSONParser で各チャンクを1度だけ読むため、出力が大きくても再スキャンが発生しない。
+    """
+    parser = StreamingJSONParser()
+    chunks: list[str] = []
+    thought = ""
+    filepaths: list[str] = []
     with Live(
         Panel("[dim]考え中...[/dim]", title=title, border_style=border_style),
         refresh_per_second=10,
         console=console,
     ) as live:
-        for chunk in stream_chat_with_llm(messages, model_name=model_name, provider=provider):
-            full_text += chunk
-            thought = _extract_thought(full_text)
-            if thought:
-                live.update(Panel(
-                    RichText(thought, style="italic dim"),
-                    title=title,
-                    border_style=border_style,
-                ))
+        for chunk in stream_chat_with_llm(
+            messages, model_name=model_name, provider=provider, call_type=call_type, response_schema=response_schema
+        ):
+            chunks.append(chunk)
+            updated = False
+            for event in parser.feed(chunk):
+                if event.path == ("thought",) and event.delta:
+                    thought += event.delta
+                    updated = True
+                elif event.complete and len(event.path) == 3 and event.path[0] == "files" and event.path[2] == "filepath":
+                    filepaths.append(str(event.value))
+                    updated = True
+            if updated:
+                body = RichText(thought, style="italic dim")
+                if filepaths:
+                    body.append("\n\n✍️  " + ", ".join(filepaths), style="bold cyan")
+                live.update(Panel(body, title=title, border_style=border_style))
+
+    parsed = parser.result()
+    if parsed is not None:
+        return parsed
+    # 増分パーサーで読めない出力（シングルクォート等）のみ従来の寛容なパーサーで再挑戦する
+    full_text = "".join(chunks)
     parsed = extract_json_from_text(full_text)
     if parsed:
         return parsed
+    if response_schema is not None:
+        structured_output.record_parse_failure(response_schema.name)
     return {"error": "JSON_PARSE_ERROR", "raw_response": full_text}
 
 
-def _lint_files(files: list[dict]) -> str:
-    """生成されたPythonファイルに対してruff + 構文チェックを実行し、エラーをまとめて返す。"""
-    all_errors = []
-    for f in files:
-        filepath = f.get("filepath", "")
-        if not filepath.endswith('.py'):
-            continue
-        if not os.path.exists(filepath):
-            continue
-        # 1. ruff 静的チェック
-        try:
-            result = subprocess.run(
-                ["ruff", "check", filepath, "--output-format=concise"],
-                capture_output=True, text=True, timeout=10
-            )
-            if result.returncode != 0 and result.stdout.strip():
-                all_errors.append(result.stdout.strip())
-        except Exception:
-            pass
-        # 2. Python 構文チェック（py_compile）
-        try:
-            result = subprocess.run(
-                ["python", "-c", f"import py_compile; py_compile.compile('{filepath}', doraise=True)"],
-                capture_output=True, text=True, timeout=10
+@dataclass
+class _FileProgress:
+    """並列生成中の1ファイルの状態（Live 表示用）"""
+    status: str = "⏳"
+    chars: int = 0
+    # 修正の反映方法（"patch": SEARCH/REPLACE を適用 / "full": ファイル全体を生成）
+    mode: str = "full"
+
+
+# 指示に反してコードブロックで囲まれた出力（```python ... ```）
+_CODE_FENCE = re.compile(r"^```[\w.+-]*\n(.*?)\n?```$", re.DOTALL)
+
+
+# 修正フェーズの SEARCH/REPLACE ブロック
+_PATCH_BLOCK = re.compile(r"<<<<<<< SEARCH\n(.*?)\n?=======\n(.*?)\n?>>>>>>> REPLACE", re.DOTALL)
+
+
+def _strip_code_fence(text: str) -> str:
+    match = _CODE_FENCE.match(text.strip())
+    return match.group(1) + "\n" if match else text
+
+
+def _apply_patch(current: str, text: str) -> str | None:
+    """
+    SEARCH/REPLACE ブロックを current に順番に適用した結果を返す。
+    ブロックが1つもない（「変更不要」などの文章や空の応答）か、SEARCH が一意に見つからないブロックがあれば None。
+    """
+    blocks = _PATCH_BLOCK.findall(text)
+    if not blocks:
+        return None
+    patched = current
+    for search, replacement in blocks:
+        if not search or patched.count(search) != 1:
+            return None
+        if not replacement and search + "\n" in patched:
+            # 行を削除するブロックでは、SEARCH の行末の改行も一緒に消して空行を残さない
+            search += "\n"
+        patched = patched.replace(search, replacement, 1)
+    return patched
+
+
+def _snapshot_diff(before: dict[str, str], after: dict[str, str]) -> str:
+    """前回レビュー時点からの変更を unified diff で返す。"""
+    diffs = []
+    for filepath in after:
+        old, new = before.get(filepath, ""), after[filepath]
+        if old != new:
+            diffs.extend(difflib.unified_diff(
+                old.splitlines(keepends=True), new.splitlines(keepends=True),
+                fromfile=f"a/{filepath}", tofile=f"b/{filepath}",
+            ))
+    return "".join(diffs)
+
+
+def _lint_files(files: list[dict]) -> dict[str, str]:
+    """
+    生成されたPythonファイルをまとめて検証し、ファイルパス → エラー（複数行）を返す（エラーのないファイルは含まない）。
+    ruff は全ファイルで1回、バイトコンパイルは並列に実行し、LOCA_IMPORT_CHECK=1 なら各モジュールを
+    別プロセスで import してみる。内容が前回の検証から変わっていないファイルは再検査しない。
+    """
+    errors: dict[str, str] = {}
+    results = lint_service.lint([f.get("filepath", "") for f in files], import_check=config.IMPORT_CHECK_ENABLED)
+    for result in results:
+        found = []
+        if result.ruff_output:
+            found.append(result.ruff_output)
+        if result.syntax_error:
+            found.append(f"Syntax/Import Error in {result.filepath}: {result.syntax_error}")
+        if result.import_error:
+            found.append(f"Syntax/Import Error in {result.filepath}: {result.import_error}")
+        if found:
+            errors[result.filepath] = "\n".join(found)
+    return errors
+
+
+def _stream_json(messages, model_name, provider, title, border_style, call_type, response_schema, label, retry_message) -> dict:
+    """
+    _stream_with_thought でJSONを生成する。JSONパースエラー時は最大2回まで出力し直させる
+    （やり直しのやり取りは messages に追記される）。
+    """
+    res = None
+    for json_retry in range(3):
+        res = _stream_with_thought(
+            messages, model_name, provider,
+            title=title,
+            border_style=border_style,
+            # JSON不正による再出力は修復として扱う
+            call_type=call_type if json_retry == 0 else CALL_REPAIR,
+            response_schema=response_schema,
+        )
+
+        if "error" not in res:
+            break  # 正常にパース成功
+
+        if res.get("error") == "JSON_PARSE_ERROR":
+            console.print(f"[bold yellow]⚠️ {label}のJSON出力が不正です。リトライ中... ({json_retry + 1}/3)[/bold yellow]")
+            if json_retry > 0:
+                model_router.escalate(CALL_REPAIR)
+            messages.append({"role": "assistant", "content": res.get("raw_response", "")})
+            messages.append({"role": "user", "content": retry_message})
+        else:
+            # 接続エラー等 → リトライしても無意味
+            break
+    return res
+
+
+def _format_plan(plan: dict) -> str:
+    """各ファイルの生成リクエストに添える設計（全ファイルの役割とインターフェース）"""
+    lines = [f"Design notes: {plan.get('thought', '')}", ""]
+    for f in plan.get("files", []):
+        lines += [
+            f"### {f.get('filepath')}",
+            f"Purpose: {f.get('purpose', '')}",
+            f"Interface:\n{f.get('interface') or 'none'}",
+            "",
+        ]
+    return "\n".join(lines).strip()
+
+
+def _files_in_feedback(feedback: str, filepaths: list[str]) -> list[str]:
+    """Reviewer のフィードバックで名前が挙がったファイル（挙がっていなければ空リスト）"""
+    named = []
+    for filepath in filepaths:
+        basename = re.escape(os.path.basename(filepath))
+        if filepath in feedback or re.search(rf"(?<![\w.-]){basename}(?!\w)", feedback):
+            named.append(filepath)
+    return named
+
+
+def _stream_file(messages: list, model_name: str, provider: str, call_type: str, progress: _FileProgress,
+                 sampling: dict) -> str | None:
+    """1ファイル分の出力をストリーミングで受け取る。通信エラーの場合は None。"""
+    chunks: list[str] = []
+    for chunk in stream_chat_with_llm(messages, model_name=model_name, provider=provider, call_type=call_type, **sampling):
+        chunks.append(chunk)
+        progress.status = "✍️"
+        progress.chars += len(chunk)
+    text = "".join(chunks)
+    return None if STREAM_ERROR_PREFIX in text else text
+
+
+def _generate_file(task: str, plan_text: str, filepath: str, model_name: str, provider: str, call_type: str,
+                   progress: _FileProgress, current: str | None = None, feedback: str | None = None,
+                   sampling: dict | None = None) -> str | None:
+    """
+    設計で固定したインターフェースに従って1ファイルを生成する。生成に失敗した場合は None。
+    既存の内容とフィードバックがある修正では SEARCH/REPLACE のパッチだけを出力させてローカルで適用し、
+    適用できなかった場合のみファイル全体を生成し直す。sampling は候補ごとの temperature / seed。
+    """
+    sampling = sampling or {}
+    prompt = f"Original Task: {task}\n\nProject plan (the interfaces are FIXED):\n{plan_text}"
+    if current is not None:
+        prompt += f"\n\nCurrent content of {filepath}:\n```\n{current}\n```"
+    if feedback:
+        prompt += f"\n\n{feedback}\nRevise {filepath} so that every problem concerning this file is fixed. Keep the planned interface."
+    request = {"role": "user", "content": prompt + f"\n\nWrite the complete file: {filepath}"}
+
+    with tracer.span("pro.file", filepath=filepath) as span:
+        if current is not None and feedback:
+            progress.mode = "patch"
+            patch_request = {"role": "user", "content": prompt + f"\n\nOutput the SEARCH/REPLACE blocks for {filepath}."}
+            text = _stream_file([get_file_editor_prompt(patch=True), patch_request], model_name, provider, call_type, progress, sampling)
+            content = _apply_patch(current, text) if text is not None else None
+            if content is not None:
+                progress.status = "✔"
+                span.set(mode="patch", chars=len(text))
+                return content
+            # パッチが当たらなかった: このファイルだけ全体を生成し直す
+            progress.mode = "full"
+            span.set(patch_failed=True)
+
+        text = _stream_file([get_file_editor_prompt(), request], model_name, provider, call_type, progress, sampling)
+        if text is None:
+            progress.status = "❌"
+            span.error = "LLM stream error"
+            return None
+        progress.status = "✔"
+        span.set(mode="full", chars=len(text))
+        return _strip_code_fence(text)
+
+
+def _progress_panel(progress: dict[str, _FileProgress], title: str) -> Panel:
+    body = RichText()
+    for filepath, p in progress.items():
+        label = f"{p.status} {filepath}" + (" (patch)" if p.mode == "patch" else "")
+        body.append(label, style="bold cyan" if p.status == "✍️" else "")
+        body.append(f"  {p.chars} chars\n" if p.chars else "\n", style="dim")
+    return Panel(body, title=title, border_style="cyan")
+
+
+def _run_file_jobs(jobs: dict[str, Callable[[_FileProgress], str | None]], title: str, workers: int) -> dict[str, str | None]:
+    """ラベル → 生成関数のジョブをスレッドプールで並列に実行し、進捗を Live 表示しながらラベル → 結果を返す。"""
+    progress = {label: _FileProgress() for label in jobs}
+    results: dict[str, str | None] = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(len(jobs), workers)), thread_name_prefix="loca-pro") as pool, \
+            Live(_progress_panel(progress, title), refresh_per_second=10, console=console) as live:
+        # Ctrl-C のキャンセルトークンとスパンの親子関係を各スレッドに引き継ぐ
+        futures = {
+            pool.submit(contextvars.copy_context().run, job, progress[label]): label
+            for label, job in jobs.items()
+        }
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=0.1)
+            for future in done:
+                # 中断（GenerationCancelled）はここで送出され、残りのスレッドもトークンを見て止まる
+                results[futures[future]] = future.result()
+            live.update(_progress_panel(progress, title))
+    return {label: results[label] for label in jobs}
+
+
+def _generate_files(task: str, plan: dict, targets: list[str], model_name: str, provider: str, title: str,
+                    call_type: str, current: dict[str, str] | None = None,
+                    feedback: dict[str, str] | None = None) -> dict[str, str | None]:
+    """
+    targets の各ファイルを別々のリクエストとして並列に生成し、ファイルパス → 内容（失敗は None）を返す。
+    同時リクエスト数は PRO_PARALLEL_FILES で抑え、全体の所要時間が最も大きいファイルで決まるようにする。
+    """
+    current = current or {}
+    feedback = feedback or {}
+    plan_text = _format_plan(plan)
+    jobs = {
+        filepath: partial(
+            _generate_file, task, plan_text, filepath, model_name, provider, call_type,
+            current=current.get(filepath), feedback=feedback.get(filepath),
+        )
+        for filepath in targets
+    }
+    return _run_file_jobs(jobs, title, config.PRO_PARALLEL_FILES)
+
+
+def _candidate_count(provider: str) -> int:
+    """並列に作る候補数（PRO_CANDIDATES をエンドポイントの同時実行数の上限までに抑える）"""
+    return max(1, min(config.PRO_CANDIDATES, endpoint_limit(endpoint_for(provider))))
+
+
+def _generate_candidates(task: str, plan: dict, planned: list[str], count: int, model_name: str,
+                         provider: str, title: str) -> list[dict[str, str]]:
+    """
+    同じ設計から count 個の候補プロジェクトを、候補ごとに temperature と seed を変えて並列に生成する。
+    1ファイルでも生成に失敗した候補は除く。
+    """
+    plan_text = _format_plan(plan)
+    jobs = {}
+    for index in range(count):
+        sampling = {"temperature": TEMPERATURE + index * config.PRO_CANDIDATE_TEMPERATURE_STEP, "seed": index}
+        for filepath in planned:
+            jobs[f"#{index + 1} {filepath}"] = partial(
+                _generate_file, task, plan_text, filepath, model_name, provider, CALL_PLANNING, sampling=sampling,
             )
-            if result.returncode != 0 and result.stderr.strip():
-                err_msg = result.stderr.strip().split('\n')[-1]
-                all_errors.append(f"Syntax/Import Error in {filepath}: {err_msg}")
-        except Exception:
-            pass
-    return "\n".join(all_errors)
+    results = _run_file_jobs(jobs, title, config.PRO_PARALLEL_FILES * count)
+    candidates = []
+    for index in range(count):
+        files = {filepath: results[f"#{index + 1} {filepath}"] for filepath in planned}
+        if all(content is not None for content in files.values()):
+            candidates.append(files)
+    return candidates
+
+
+def _check_candidate(files: dict[str, str]) -> tuple[int, int, str]:
+    """
+    候補を一時ディレクトリに書き出してローカル検査（構文・ruff・LOCA_IMPORT_CHECK=1 なら import）を行い、
+    (構文/import エラー数, ruff の指摘数, Reviewer に渡す要約) を返す。
+    """
+    with tempfile.TemporaryDirectory(prefix="loca-pro-") as root:
+        root = os.path.realpath(root)
+        paths = []
+        # 一時ディレクトリの外を指すパス（絶対パス・".."）は書き出さず、致命的なエラーとして数える
+        escaped = []
+        for filepath, content in files.items():
+            path = os.path.realpath(os.path.join(root, filepath))
+            if os.path.commonpath([root, path]) != root or path == root:
+                escaped.append(f"{filepath}: path is outside the project directory")
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(content)
+            paths.append(path)
+        results = lint_service.lint(paths, import_check=config.IMPORT_CHECK_ENABLED, root=root)
+        fatal = len(escaped) + sum(1 for r in results if r.syntax_error or r.import_error)
+        warnings = sum(len(r.ruff_output.splitlines()) for r in results)
+        details = escaped + [
+            f"{os.path.relpath(r.filepath, root)}: {r.syntax_error or r.import_error}"
+            for r in results if r.syntax_error or r.import_error
+        ]
+    summary = f"{fatal} syntax/import errors, {warnings} lint warnings"
+    return fatal, warnings, summary + ("\n" + "\n".join(details) if details else "")
+
+
+def _select_candidate(task: str, planned: list[str], candidates: list[dict[str, str]], model_name: str,
+                      provider: str) -> tuple[dict[str, str], dict]:
+    """
+    候補をローカル検査で絞り込み（構文/import エラーのない候補だけを残す。全滅なら最もエラーの少ない候補）、
+    残りが複数なら Reviewer の1回の呼び出しで順位付けする。(選ばれた候補, Reviewer の判定) を返す。
+    判定がない（候補が1つだけ残った）場合は空の dict。
+    """
+    checks = [_check_candidate(files) for files in candidates]
+    least_fatal = min(fatal for fatal, _, _ in checks)
+    survivors = [i for i, (fatal, _, _) in enumerate(checks) if fatal == least_fatal]
+    for i, (_, _, summary) in enumerate(checks):
+        mark = "✔" if i in survivors else "✖"
+        console.print(f"[dim]  {mark} 候補 #{i + 1}: {summary.splitlines()[0]}[/dim]")
+    if len(survivors) == 1:
+        return candidates[survivors[0]], {}
+
+    sections = []
+    for number, i in enumerate(survivors, 1):
+        code = "".join(f"\n--- {filepath} ---\n```python\n{candidates[i][filepath]}\n```\n" for filepath in planned)
+        sections.append(f"## Candidate {number}\nLocal checks: {checks[i][2]}\n{code}")
+    ranking_messages = [
+        get_reviewer_prompt(rank_candidates=True),
+        {"role": "user", "content": f"Original Task: {task}\n\n" + "\n\n".join(sections)},
+    ]
+    ranking = _stream_json(
+        ranking_messages, model_name, provider,
+        title=f"[bold yellow]💭 Pro Reviewer (Ranking {len(survivors)} candidates)[/bold yellow]",
+        border_style="yellow",
+        call_type=CALL_REVIEW,
+        response_schema=REVIEWER_RANKING,
+        label="Reviewer",
+        retry_message="Your previous response was not valid JSON. Please output ONLY a valid JSON object with 'thought', 'ranking', 'decision', and 'feedback' keys.",
+    )
+    if "error" in ranking:
+        # 順位付けに失敗した場合は検査結果の良い候補を選び、通常のレビューに回す
+        best = min(survivors, key=lambda i: checks[i][1])
+        return candidates[best], {}
+    order = [n for n in ranking.get("ranking", []) if isinstance(n, int) and 1 <= n <= len(survivors)]
+    best = survivors[order[0] - 1] if order else survivors[0]
+    console.print(f"[dim]🏆 Reviewer は候補 #{best + 1} を選びました。[/dim]")
+    return candidates[best], ranking
 
 
 def run_pro_mode(task: str, model_name: str = None, provider: str = None, auto_mode: bool = False):
     """EditorとReviewerの2つのAIエージェントを戦わせて高品質なコードを生成するモード"""
+    try:
+        with tracer.span("pro.run", model=model_name or config.DEFAULT_MODEL):
+            return _run_pro_mode(task, model_name, provider, auto_mode)
+    except GenerationCancelled:
+        # Ctrl-C で生成を中断した場合はセッションを終了せず、プロンプトに戻る
+        console.print("\n[bold yellow]🛑 Pro モードを中断しました。[/bold yellow]")
+        return []
+
+
+def _run_pro_mode(task: str, model_name: str = None, provider: str = None, auto_mode: bool = False):
     model_name = model_name or config.DEFAULT_MODEL
     provider = provider or config.DEFAULT_PROVIDER
     console.print(f"\n[bold magenta]🚀 起動: Pro Agent (Deep Thinking Mode)[/bold magenta]")
     console.print(f"[dim]Task: {task}[/dim]\n")
-    
-    editor_messages = [get_editor_prompt(), {"role": "user", "content": task}]
-    reviewer_messages = [get_reviewer_prompt()]
-    
+
+    # 設計フェーズ: ファイル一覧とファイル間のインターフェースだけを短く出力させる
+    planner_messages = [get_planner_prompt(), {"role": "user", "content": task}]
+    plan = _stream_json(
+        planner_messages, model_name, provider,
+        title="[bold cyan]💭 Pro Planner[/bold cyan]",
+        border_style="cyan",
+        call_type=CALL_PLANNING,
+        response_schema=PRO_PLAN,
+        label="Planner",
+        retry_message="Your previous response was not valid JSON. Please output ONLY a valid JSON object with 'thought' and 'files' keys. Do not include any text outside the JSON.",
+    )
+    if "error" in plan:
+        print_error(f"Plannerがエラーを起こしました: {plan.get('error')}")
+        return []
+    planned = list(dict.fromkeys(f.get("filepath") for f in plan.get("files", []) if f.get("filepath")))
+    if not planned:
+        print_error("Plannerが生成するファイルを1つも挙げませんでした。")
+        return []
+    console.print(f"[dim]📐 Planner: {len(planned)}個のファイルを設計しました（最大{config.PRO_PARALLEL_FILES}件ずつ並列に生成します）[/dim]")
+
     max_attempts = 3
-    final_files = [] 
-    
+    candidate_count = _candidate_count(provider)
+    contents: dict[str, str] = {}
+    # 直前のレビュー時点のスナップショット（次のレビューには最新版とこの差分だけを渡す）
+    reviewed: dict[str, str] | None = None
+    feedback = ""
+    targets = planned
+    feedback_by_file: dict[str, str] = {}
+
     for attempt in range(1, max_attempts + 1):
-        # Editor フェーズ（JSONパースエラー時は最大2回リトライ）
-        editor_res = None
-        for json_retry in range(3):
-            editor_res = _stream_with_thought(
-                editor_messages, model_name, provider,
-                title=f"[bold cyan]💭 Pro Editor (Attempt {attempt}/{max_attempts})[/bold cyan]",
-                border_style="cyan",
+        start = time.perf_counter()
+        # 候補の順位付けで判定まで済んだ場合は、このラウンドのレビューを省く
+        reviewer_res: dict = {}
+        if attempt == 1 and candidate_count > 1:
+            # 同じ設計から複数の候補を並列に作り、ローカル検査と Reviewer の1回の順位付けで1つに絞る
+            candidates = _generate_candidates(
+                task, plan, planned, candidate_count, model_name, provider,
+                title=f"[bold cyan]✍️ Pro Editor ({candidate_count} candidates)[/bold cyan]",
             )
-            
-            if "error" not in editor_res:
-                break  # 正常にパース成功
-            
-            if editor_res.get("error") == "JSON_PARSE_ERROR":
-                console.print(f"[bold yellow]⚠️ EditorのJSON出力が不正です。リトライ中... ({json_retry + 1}/3)[/bold yellow]")
-                raw = editor_res.get("raw_response", "")
-                editor_messages.append({"role": "assistant", "content": raw})
-                editor_messages.append({"role": "user", "content": "Your previous response was not valid JSON. Please output ONLY a valid JSON object with 'thought' and 'files' keys. Do not include any text outside the JSON."})
-            else:
-                # 接続エラー等 → リトライしても無意味
+            if not candidates:
+                print_error("Editorがエラーを起こしました: 全ての候補の生成に失敗しました。")
                 break
-        
-        if "error" in editor_res:
-            print_error(f"Editorがエラーを起こしました: {editor_res.get('error')}")
-            break
-            
-        files = editor_res.get("files", [])
-        final_files = files 
-        console.print(f"[dim]✍️  Editor (Attempt {attempt}): {len(files)}個のファイルからなるプロジェクト原案を作成しました。[/dim]")
-        
-        code_for_review = ""
-        for f in files:
-            code_for_review += f"\n--- {f.get('filepath')} ---\n```python\n{f.get('content')}\n```\n"
-        
-        review_prompt = f"Original Task: {task}\n\nProject Code to review:\n{code_for_review}"
-        reviewer_messages.append({"role": "user", "content": review_prompt})
-        
-        # Reviewer フェーズ（JSONパースエラー時は最大2回リトライ）
-        reviewer_res = None
-        for json_retry in range(3):
-            reviewer_res = _stream_with_thought(
+            console.print(f"[dim]✍️  Editor: {len(candidates)}個の候補を {time.perf_counter() - start:.1f}s で生成しました。[/dim]")
+            generated, reviewer_res = _select_candidate(task, planned, candidates, model_name, provider)
+        else:
+            # Editor フェーズ: 各ファイルを別リクエストで並列に生成する（差し戻し後は指摘されたファイルだけ）
+            generated = _generate_files(
+                task, plan, targets, model_name, provider,
+                title=f"[bold cyan]✍️ Pro Editor (Attempt {attempt}/{max_attempts})[/bold cyan]",
+                call_type=CALL_PLANNING,
+                current=contents,
+                feedback=feedback_by_file,
+            )
+            failed = [filepath for filepath, content in generated.items() if content is None]
+            if failed:
+                print_error(f"Editorがエラーを起こしました: {', '.join(failed)}")
+                break
+            console.print(f"[dim]✍️  Editor (Attempt {attempt}): {len(generated)}個のファイルを {time.perf_counter() - start:.1f}s で生成しました。[/dim]")
+        contents.update(generated)
+
+        if not reviewer_res:
+            code_for_review = ""
+            for filepath in planned:
+                code_for_review += f"\n--- {filepath} ---\n```python\n{contents[filepath]}\n```\n"
+
+            if reviewed is None:
+                review_prompt = f"Original Task: {task}\n\nProject Code to review:\n{code_for_review}"
+            else:
+                # 過去のコード全文は積み上げず、最新のスナップショットと前回からの差分だけを渡す
+                review_prompt = (
+                    f"Original Task: {task}\n\n"
+                    f"Your previous review rejected the project with this feedback:\n{feedback}\n\n"
+                    f"Changes made since your previous review:\n```diff\n{_snapshot_diff(reviewed, contents) or '(no changes)'}\n```\n\n"
+                    f"Check that the feedback was addressed and review the latest Project Code:\n{code_for_review}"
+                )
+            reviewer_messages = [get_reviewer_prompt(), {"role": "user", "content": review_prompt}]
+
+            # Reviewer フェーズ（JSONパースエラー時は最大2回リトライ）
+            reviewer_res = _stream_json(
                 reviewer_messages, model_name, provider,
                 title=f"[bold yellow]💭 Pro Reviewer (Attempt {attempt}/{max_attempts})[/bold yellow]",
                 border_style="yellow",
+                call_type=CALL_REVIEW,
+                response_schema=REVIEWER_DECISION,
+                label="Reviewer",
+                retry_message="Your previous response was not valid JSON. Please output ONLY a valid JSON object with 'thought', 'decision', and 'feedback' keys.",
             )
-            
-            if "error" not in reviewer_res:
-                break
-            
-            if reviewer_res.get("error") == "JSON_PARSE_ERROR":
-                console.print(f"[bold yellow]⚠️ ReviewerのJSON出力が不正です。リトライ中... ({json_retry + 1}/3)[/bold yellow]")
-                raw = reviewer_res.get("raw_response", "")
-                reviewer_messages.append({"role": "assistant", "content": raw})
-                reviewer_messages.append({"role": "user", "content": "Your previous response was not valid JSON. Please output ONLY a valid JSON object with 'thought', 'decision', and 'feedback' keys."})
-            else:
-                break
-        
+        reviewed = dict(contents)
+
         if "error" in reviewer_res:
             print_error(f"Reviewerがエラーを起こしました: {reviewer_res.get('error')}")
             break
-            
+
         decision = reviewer_res.get("decision", "reject")
         feedback = reviewer_res.get("feedback", "")
-        reviewer_messages.append({"role": "assistant", "content": json.dumps(reviewer_res, ensure_ascii=False)})
-        
+
         if decision == "approve":
             console.print(f"[bold green]✅ Reviewer Approved! 完璧なプロジェクト構成です。 (Attempt {attempt})[/bold green]")
             break
         else:
             console.print(f"[bold red]❌ Reviewer Rejected (差し戻し)[/bold red]\n[dim]Feedback: {feedback}[/dim]\n")
             if attempt < max_attempts:
-                editor_messages.append({"role": "assistant", "content": json.dumps(editor_res, ensure_ascii=False)})
-                editor_messages.append({"role": "user", "content": f"Reviewer feedback: {feedback}\nPlease fix the project according to this feedback."})
+                # フィードバックで名前が挙がったファイルだけにパッチを当てる（挙がっていなければ全ファイル）
+                targets = _files_in_feedback(feedback, planned) or planned
+                feedback_by_file = {filepath: f"Reviewer feedback on the project:\n{feedback}" for filepath in targets}
+                console.print(f"[dim]🩹 {len(targets)}個のファイルを修正します: {', '.join(targets)}[/dim]")
             else:
                 console.print("[bold yellow]⚠️ 最大試行回数に到達しました。現在の最新コードを出力します。[/bold yellow]")
 
+    final_files = [{"filepath": filepath, "content": contents[filepath]} for filepath in planned if filepath in contents]
+
+    schema_summary = structured_output.summary()
+    if schema_summary:
+        console.print(f"[dim]📐 Structured output: {schema_summary}[/dim]")
+
     # 最終結果の表示と保存
     if final_files:
         console.print("\n[bold magenta]✨ Pro Mode Final Project ✨[/bold magenta]")
@@ -184,7 +552,7 @@ def run_pro_mode(task: str, model_name: str = None, provider: str = None, auto_m
             save_ans = 'y'
             console.print("\n[bold yellow]🤖 Auto Mode: 全ファイルを自動生成します...[/bold yellow]")
         else:
-            save_ans = console.input(f"\nこれら {len(final_files)} 個のファイルを提案されたパスに自動生成しますか？ [y/N]: ").strip().lower()
+            save_ans = ask_input(f"\nこれら {len(final_files)} 個のファイルを提案されたパスに自動生成しますか？ [y/N]: ").strip().lower()
             
         if save_ans == 'y':
             for f in final_files:
@@ -200,41 +568,37 @@ def run_pro_mode(task: str, model_name: str = None, provider: str = None, auto_m
             
             if lint_errors:
                 console.print(f"[bold yellow]⚠️ Lint警告が検出されました:[/bold yellow]")
-                console.print(f"[dim]{lint_errors}[/dim]")
+                console.print("[dim]" + "\n".join(lint_errors.values()) + "[/dim]")
                 console.print(f"\n[bold cyan]🔧 自動修正を試みます...[/bold cyan]")
                 
-                # Editorにlintエラーを渡して修正させる
-                fix_prompt = (
-                    f"The following lint errors were found in the generated code:\n\n{lint_errors}\n\n"
-                    f"Please fix ALL these errors (especially missing imports) and return the corrected files. "
-                    f"Return the COMPLETE corrected files, not just the changes."
-                )
-                editor_messages.append({"role": "user", "content": fix_prompt})
-                
-                fix_res = _stream_with_thought(
-                    editor_messages, model_name, provider,
-                    title="[bold cyan]💭 Pro Editor (Lint Fix)[/bold cyan]",
-                    border_style="cyan",
+                # エラーのあったファイルだけを、それぞれのlintエラーを渡して並列に修正させる
+                fix_res = _generate_files(
+                    task, plan, list(lint_errors), model_name, provider,
+                    title="[bold cyan]🔧 Pro Editor (Lint Fix)[/bold cyan]",
+                    call_type=CALL_REPAIR,
+                    current=contents,
+                    feedback={
+                        filepath: f"The following lint errors were found in {filepath} (fix ALL of them, especially missing imports):\n{errors}"
+                        for filepath, errors in lint_errors.items()
+                    },
                 )
+                fixed = {filepath: content for filepath, content in fix_res.items() if content is not None}
                 
-                if "error" not in fix_res:
-                    fixed_files = fix_res.get("files", [])
-                    if fixed_files:
-                        for f in fixed_files:
-                            filepath = f.get("filepath", "unknown.py")
-                            content = f.get("content", "")
-                            os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
-                            write_file(filepath, content)
-                            console.print(f"[bold green]✔ Fixed: {filepath}[/bold green]")
-                        
-                        # 修正後に再度lint
-                        remaining_errors = _lint_files(fixed_files)
-                        if remaining_errors:
-                            console.print(f"[bold yellow]⚠️ まだ一部の警告が残っています:[/bold yellow]")
-                            console.print(f"[dim]{remaining_errors}[/dim]")
-                        else:
-                            console.print(f"[bold green]✅ 全てのLintエラーが修正されました！[/bold green]")
-                        final_files = fixed_files
+                if fixed:
+                    for filepath, content in fixed.items():
+                        os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+                        write_file(filepath, content)
+                        console.print(f"[bold green]✔ Fixed: {filepath}[/bold green]")
+                    
+                    # 全ファイルで再検証する（内容が変わっていないファイルはキャッシュ済み）
+                    contents.update(fixed)
+                    final_files = [{"filepath": f["filepath"], "content": contents[f["filepath"]]} for f in final_files]
+                    remaining_errors = _lint_files(final_files)
+                    if remaining_errors:
+                        console.print(f"[bold yellow]⚠️ まだ一部の警告が残っています:[/bold yellow]")
+                        console.print("[dim]" + "\n".join(remaining_errors.values()) + "[/dim]")
+                    else:
+                        console.print(f"[bold green]✅ 全てのLintエラーが修正されました！[/bold green]")
                 else:
                     console.print("[dim]自動修正に失敗しました。手動で修正してください。[/dim]")
             else:
@@ -7,19 +7,22 @@ from loca.tools.plugin_loader import load_plugins
 
 def get_agent_system_prompt() -> dict:
     """
-    Function Calling モード用のシステムプロンプト。
-    ツール一覧は function calling スキーマ側で管理するため、ここでは不要。
+    全モード共通のシステムプロンプト（会話履歴の先頭 messages[0] に置く）。
+
+    Ollama の KV キャッシュやプロバイダーのプロンプトキャッシュを再利用できるよう、
+    セッション中にバイト単位で変化しない内容だけを含める。
+    カレントディレクトリやモード別の出力形式など変化する情報は get_runtime_context() で末尾に付ける。
+    Loca.md が更新された場合のみ内容が変わる。
     """
     current_os = platform.system()
-    current_dir = os.getcwd()
     custom_rules = _get_project_rules()
 
     prompt_text = textwrap.dedent(f"""
         You are an autonomous coding assistant.
 
-        # Current Environment
+        # Environment
         * OS: {current_os}
-        * Current Directory: {current_dir}
+        * The current directory and the response mode are given in the <runtime_context> at the end of the conversation.
         {custom_rules}
 
         # Strict Rules
@@ -61,13 +64,22 @@ def _get_project_rules() -> str:
             pass
     return ""
 
-def get_system_prompt(is_ask_mode: bool = False) -> dict:
-    current_os = platform.system()
+# 実行時コンテキストのモード
+MODE_AGENT = "agent"   # Function Calling でツールを呼ぶ
+MODE_JSON = "json"     # Function Calling 非対応モデル向けの JSON テキスト方式
+MODE_ASK = "ask"       # /ask の会話モード
+
+
+def get_runtime_context(mode: str = MODE_AGENT) -> dict:
+    """
+    リクエストの末尾に一時的に付ける実行時コンテキスト（会話履歴には保存しない）。
+    カレントディレクトリ・モード別の出力形式など、変化しうる情報はすべてここに置き、
+    messages[0] 以降の履歴（プレフィックス）をバイト単位で安定させる。
+    """
     current_dir = os.getcwd()
-    custom_rules = _get_project_rules()
 
-    if is_ask_mode:
-        prompt_text = textwrap.dedent(f"""
+    if mode == MODE_ASK:
+        protocol = textwrap.dedent("""
             # Mode: Conversation (Ask Mode)
             You are currently in conversation mode. 
             
@@ -75,22 +87,16 @@ def get_system_prompt(is_ask_mode: bool = False) -> dict:
             If you already know the answer, you MUST answer the user's question directly using standard Markdown text. DO NOT output JSON.
             HOWEVER, if you need to search the web for up-to-date information to answer the question, you MUST output ONLY this exact JSON format and nothing else:
             ```json
-            {{"action": "search_web", "query": "your search query here"}}
+            {"action": "search_web", "query": "your search query here"}
             ```
             
             # Priority Instructions
             1. Your core identity is a professional, helpful AI assistant.
-            2. You must adapt your formatting, technology choices, and tone according to the <project_guidelines> provided above.
+            2. You must adapt your formatting, technology choices, and tone according to the <project_guidelines> provided in the system prompt.
         """).strip()
-    else:
-        prompt_text = textwrap.dedent(f"""
-            You are an autonomous coding assistant.
-            
-            # Current Environment
-            * OS: {current_os}
-            * Current Directory: {current_dir}
-            {custom_rules}
-            
+    elif mode == MODE_JSON:
+        protocol = textwrap.dedent(f"""
+            # Mode: JSON Actions
             # Available Actions
             You have 7 built-in tools plus any custom plugins. Choose ONLY ONE action per response based on the user's request.
 
@@ -110,23 +116,13 @@ def get_system_prompt(is_ask_mode: bool = False) -> dict:
                 args format: {{}}
             {_get_plugin_section()}
 
-            # Strict Rules
+            # Output Rules
             1. NO conversational text outside the JSON block.
             2. You MUST output ONLY a valid JSON object.
-            3. For 'run_command', DO NOT chain commands using `&&` or `;`. Execute ONE command at a time. This means multi-step setups (e.g., makemigrations then migrate) require multiple sequential actions.
-            4. NEVER use single quotes (') to enclose JSON string values. You MUST use double quotes (") and escape inner double quotes (e.g., "content": "print(\\"Hello\\")").
-            5. When installing Python packages, ALWAYS use `uv pip install` instead of standard `pip`.
-            6. For multi-line text in JSON (like file content), use explicit `\\n` characters for newlines. DO NOT use actual physical line breaks inside the JSON string.
-            7. If you are unsure about the current content of a file, ALWAYS use `read_file` to check before editing or overwriting it. Do not rely on memory from earlier in the conversation.
-            8. DO NOT use `read_directory` unless asked. If the user asks for code without a filename, IMMEDIATELY invent a relevant filename (e.g., 'mikan_loop.py') and use `write_file` to implement the EXACT logic requested by the user. NEVER use generic placeholders like "Hello World" when specific instructions are given.
-            9. FRAMEWORK POST-SETUP: When creating a project that uses a framework, you MUST complete ALL setup steps required to make it runnable. Examples:
-               - Django: After writing models, run `python manage.py makemigrations` then `python manage.py migrate`.
-               - Node.js: After creating package.json, run `npm install`.
-               - Flask/FastAPI: Ensure database init scripts are executed if using an ORM.
-               Do NOT consider the task complete until the project can actually run without errors.
-            10. VERIFICATION BEFORE COMPLETION: Before using action "none" to finish a task, you SHOULD verify the result works by running the application or relevant command (e.g., start the dev server for web apps, run `python main.py` for scripts). If errors occur, fix them before finishing.
-            11. RULE COMPLIANCE CHECK: Before using action "none", re-read the <project_guidelines> above. If there is a checklist section, verify EVERY item is satisfied. If any item is not done, complete it before finishing. Do NOT skip this step.
-            
+            3. NEVER use single quotes (') to enclose JSON string values. You MUST use double quotes (") and escape inner double quotes (e.g., "content": "print(\\"Hello\\")").
+            4. For multi-line text in JSON (like file content), use explicit `\\n` characters for newlines. DO NOT use actual physical line breaks inside the JSON string.
+            5. If the user asks for code without a filename, IMMEDIATELY invent a relevant filename (e.g., 'mikan_loop.py') and use `write_file` to implement the EXACT logic requested by the user. NEVER use generic placeholders like "Hello World" when specific instructions are given.
+
             # Output Format
             {{
                  "thought": "Your thinking process in English. Briefly explain why you chose the action.",
@@ -134,66 +130,127 @@ def get_system_prompt(is_ask_mode: bool = False) -> dict:
                  "args": {{ ... }}
             }}
         """).strip()
+    else:
+        protocol = textwrap.dedent("""
+            # Mode: Agent
+            Call the provided tools. Independent read-only calls (read_file, read_directory, web_search) may be issued together in one turn and will run in parallel.
+            Calls that change files or run commands are executed in order. Call `none` alone, only when the task is fully complete.
+        """).strip()
 
-    return {"role": "system", "content": prompt_text}
+    prompt_text = f"<runtime_context>\n* Current Directory: {current_dir}\n\n{protocol}\n</runtime_context>"
+    return {"role": "user", "content": prompt_text, "_loca_volatile": True}
 
 
-def get_editor_prompt() -> dict:
-    custom_rules = _get_project_rules()
+# /pro の設計・ファイル生成で共通のミス防止ルール
+_EDITOR_RULES = """
+# IMPORTANT Priority
+You must absolutely obey all constraints and technology choices specified in the <project_guidelines> above.
+If the <project_guidelines> contain a checklist, you MUST ensure every single item is satisfied in your output. Do not skip any file or requirement listed there.
 
-    prompt_text = textwrap.dedent(f"""
-        You are an expert software architect and Python developer.
-        Your job is to design and write high-quality, fully functional code based on the user's task.
-        If the task requires multiple files (e.g., a game with main.py, config.py, utils.py), you must generate all necessary files.
-        If the reviewer provides feedback, you MUST fix the code according to the feedback.
+# Critical Anti-Mistake Rules (MANDATORY - check before finalizing every file)
 
-        {custom_rules}
+1. IMPORT COMPLETENESS: Every file must have ALL required imports at the very top.
+   Before writing each file, trace every symbol you use and verify its import is present.
+   Examples of common mistakes to AVOID:
+   - Using `uuid.uuid4()` without `import uuid`
+   - Using `pd.DataFrame` without `import pandas as pd`
+   - Using `go.Figure()` without `import plotly.graph_objects as go`
+   - Using `date.today()` without `from datetime import date`
+   If <project_guidelines> specifies a required import list, follow it exactly.
 
-        # IMPORTANT Priority
-        You must absolutely obey all constraints and technology choices specified in the <project_guidelines> above.
-        If the <project_guidelines> contain a checklist, you MUST ensure every single item is satisfied in your output. Do not skip any file or requirement listed there.
+2. CROSS-FILE IMPORTS: When file A calls a function defined in file B (same directory):
+   - Use `from B import function_name` syntax (e.g., `from data_manager import load_expenses`)
+   - The function MUST actually be defined in file B with the exact same name.
+   - Never import a function that does not exist in the target file.
 
-        # Critical Anti-Mistake Rules (MANDATORY - check before finalizing every file)
+3. BANNED APIs (never use these, they cause runtime errors):
+   - `st.experimental_rerun()` → use `st.rerun()` instead
+   - `DataFrame.append()` → use `pd.concat([df1, df2], ignore_index=True)` instead
+   - `plt.show()` → use `st.plotly_chart(fig, use_container_width=True)` instead
 
-        1. IMPORT COMPLETENESS: Every file must have ALL required imports at the very top.
-           Before writing each file, trace every symbol you use and verify its import is present.
-           Examples of common mistakes to AVOID:
-           - Using `uuid.uuid4()` without `import uuid`
-           - Using `pd.DataFrame` without `import pandas as pd`
-           - Using `go.Figure()` without `import plotly.graph_objects as go`
-           - Using `date.today()` without `from datetime import date`
-           If <project_guidelines> specifies a required import list, follow it exactly.
+4. CHECKLIST COMPLIANCE: If <project_guidelines> contains a checklist section,
+   go through EVERY item one by one and implement each one before finishing.
+""".strip()
 
-        2. CROSS-FILE IMPORTS: When file A calls a function defined in file B (same directory):
-           - Use `from B import function_name` syntax (e.g., `from data_manager import load_expenses`)
-           - The function MUST actually be defined in file B with the exact same name.
-           - Never import a function that does not exist in the target file.
 
-        3. BANNED APIs (never use these, they cause runtime errors):
-           - `st.experimental_rerun()` → use `st.rerun()` instead
-           - `DataFrame.append()` → use `pd.concat([df1, df2], ignore_index=True)` instead
-           - `plt.show()` → use `st.plotly_chart(fig, use_container_width=True)` instead
+def get_planner_prompt() -> dict:
+    """
+    /pro の設計フェーズ: ファイル一覧とファイル間のインターフェースだけを短く出力させる。
+    各ファイルの中身はこの設計をもとに get_file_editor_prompt で1ファイルずつ並列に生成する。
+    """
+    custom_rules = _get_project_rules()
 
-        4. CHECKLIST COMPLIANCE: If <project_guidelines> contains a checklist section,
-           go through EVERY item one by one and implement each one before finishing.
+    prompt_text = textwrap.dedent(f"""
+        You are an expert software architect and Python developer.
+        Your job is to design the project for the user's task. Do NOT write the implementation yet.
+        Each file will later be written independently by a different developer who sees only your plan,
+        so the interfaces between files must be complete and exact.
+        If the task requires multiple files (e.g., a game with main.py, config.py, utils.py), list all necessary files.
 
+        {custom_rules}
+    """).strip() + "\n\n" + _EDITOR_RULES + "\n\n" + textwrap.dedent("""
         # Output Format
-        You MUST output ONLY a valid JSON object. Do not include any markdown code blocks outside or inside the JSON string values.
-        {{
-            "thought": "Your architecture design and thinking process. List which files you will generate and what each does.",
+        You MUST output ONLY a valid JSON object. Keep it short: no implementation code.
+        {
+            "thought": "Your architecture design: data flow, shared data structures and conventions all files must follow.",
             "files": [
-                {{
+                {
                     "filepath": "The path where the file should be saved (e.g., 'tetris/main.py' or just 'main.py')",
-                    "content": "The complete, runnable code for this file."
-                }}
+                    "purpose": "What this file is responsible for.",
+                    "interface": "Every name other files may import from this file, with exact signatures (e.g. 'def load_expenses(path: str) -> list[dict]', 'class Board: def __init__(self, width: int, height: int)', 'MAX_SPEED: int'), and what this file imports from the other files. 'none' if nothing."
+                }
             ]
-        }}
+        }
     """).strip()
 
     return {"role": "system", "content": prompt_text}
 
 
-def get_reviewer_prompt() -> dict:
+# /pro の修正フェーズで使うパッチ形式（pro_agent._apply_patch で適用する）
+_PATCH_FORMAT = """
+# Output Format
+You are revising the existing file shown in the request. Output ONLY SEARCH/REPLACE blocks that change its current content:
+<<<<<<< SEARCH
+(exact lines copied from the current file, including indentation)
+=======
+(the lines that replace them)
+>>>>>>> REPLACE
+Each SEARCH section must match the current file exactly and occur only once; include enough surrounding lines to make it unique.
+Use as many blocks as needed, in file order. Output nothing else: no JSON, no markdown code fences, no explanations.
+""".strip()
+
+_FULL_FILE_FORMAT = """
+# Output Format
+Output ONLY the complete, runnable content of the requested file.
+No JSON, no markdown code fences, no explanations before or after the code.
+""".strip()
+
+
+def get_file_editor_prompt(patch: bool = False) -> dict:
+    """
+    /pro の生成フェーズ: 設計で固定したインターフェースに従って1ファイルだけを書かせる。
+    patch=True（差し戻し・lint修正）の場合はファイル全体ではなく SEARCH/REPLACE ブロックで変更点だけを出力させる。
+    """
+    custom_rules = _get_project_rules()
+
+    prompt_text = textwrap.dedent(f"""
+        You are an expert Python developer working on one file of a larger project.
+        You are given the task, the project plan and the file you must write.
+        The interfaces in the plan are FIXED: implement the names this file exports with exactly the planned signatures,
+        and use names from other files exactly as the plan defines them. Other files are written in parallel by other developers.
+        If the reviewer or a linter provides feedback, you MUST fix this file according to the feedback.
+
+        {custom_rules}
+    """).strip() + "\n\n" + _EDITOR_RULES + "\n\n" + (_PATCH_FORMAT if patch else _FULL_FILE_FORMAT)
+
+    return {"role": "system", "content": prompt_text}
+
+
+def get_reviewer_prompt(rank_candidates: bool = False) -> dict:
+    """
+    /pro の Reviewer。rank_candidates=True の場合は同じ設計から生成された複数の候補を1回で審査し、
+    良い順に並べたうえで最良の候補について判定させる。
+    """
     custom_rules = _get_project_rules()
 
     prompt_text = textwrap.dedent(f"""
@@ -237,13 +294,51 @@ def get_reviewer_prompt() -> dict:
         - "approve" if: the code is functional, imports are complete, no banned APIs, AND follows all critical rules from <project_guidelines>.
         - Do NOT reject for: imperfect docstrings, minor naming preferences, or missing README.
 
-        # Output Format
-        You MUST output ONLY a valid JSON object.
-        {{
-            "thought": "Step-by-step review result. For imports, list each file and what was checked. For the checklist, write OK/MISSING for each item.",
-            "decision": "approve" | "reject",
-            "feedback": "If rejecting: list the EXACT file name and line where each problem is. If approving: brief summary."
-        }}
     """).strip()
 
-    return {"role": "system", "content": prompt_text}
\ No newline at end of file
+    if rank_candidates:
+        output_format = textwrap.dedent("""
+            # Candidates
+            You are given several candidate implementations of the same project plan, numbered from 1.
+            Apply the Review Process to each candidate, then rank them from best to worst.
+            The local check results (lint / compile / import) are provided for each candidate; prefer candidates without errors.
+
+            # Output Format
+            You MUST output ONLY a valid JSON object.
+            {
+                "thought": "Step-by-step review of each candidate and why the best one is better than the others.",
+                "ranking": [2, 1, 3],
+                "decision": "approve" | "reject",
+                "feedback": "About the BEST candidate only. If rejecting: list the EXACT file name and line where each problem is. If approving: brief summary."
+            }
+        """).strip()
+    else:
+        output_format = textwrap.dedent("""
+            # Output Format
+            You MUST output ONLY a valid JSON object.
+            {
+                "thought": "Step-by-step review result. For imports, list each file and what was checked. For the checklist, write OK/MISSING for each item.",
+                "decision": "approve" | "reject",
+                "feedback": "If rejecting: list the EXACT file name and line where each problem is. If approving: brief summary."
+            }
+        """).strip()
+
+    return {"role": "system", "content": prompt_text + "\n\n" + output_format}
+
+def get_summary_prompt() -> dict:
+    """コンテキスト圧縮用: 古いやり取りをローリング要約にまとめるためのプロンプト。"""
+    prompt_text = textwrap.dedent("""
+        You compress the history of an autonomous coding session so it can continue within a limited context window.
+        Summarize the conversation excerpt below. If it contains a previous <conversation_summary>, merge it into the new summary.
+
+        Keep:
+        - The user's goals and any constraints or preferences they stated.
+        - Files created, read or modified (exact paths) and what changed.
+        - Commands run and their important results or errors.
+        - Decisions made and what remains to be done.
+
+        Drop greetings, repeated tool output and anything that can be re-read from files.
+        Output plain text bullet points only, at most 30 lines. Do not output JSON.
+    """).strip()
+
+    return {"role": "system", "content": prompt_text}
@@ -1,8 +1,15 @@
 from dataclasses import dataclass
-from loca.core.prompts import get_system_prompt
+from rich.table import Table
+from loca.core.prompts import get_agent_system_prompt
 from loca.core.memory import MemoryManager
 from loca.core.pro_agent import run_pro_mode
 from loca.core.executor import backup_manager
+from loca.core.llm_cache import llm_cache
+from loca.core.model_routes import model_router
+from loca.core.scheduler import request_scheduler, PRIORITY_NAMES
+from loca.core.endpoint_pool import endpoint_pool
+from loca.core.schemas import structured_output
+from loca.core.tracing import tracer, percentile, histogram_counts, HISTOGRAM_BUCKETS
 from loca.tools.git_ops import auto_commit
 from loca.ui.display import console
 
@@ -59,7 +66,7 @@ def route_command(
     # --- /clear ---
     if lower == "/clear":
         messages.clear()
-        messages.append(get_system_prompt())
+        messages.append(get_agent_system_prompt())
         exchange_count = 0
         console.print("\n[bold cyan]🔄 会話をリセットしました。新しいタスクを入力してください。[/bold cyan]\n")
         result.handled = True
@@ -79,14 +86,40 @@ def route_command(
         result.handled = True
         return result, auto_mode, exchange_count
     
-    # --- /ask ---
-    # /ask 後にプロンプトが戻らないバグ防止: 毎回通常モードに復元する
-    messages[0] = get_system_prompt()
+    # --- /cache ---
+    if lower in ("/cache", "/cache clear"):
+        if lower == "/cache clear":
+            removed = llm_cache.clear()
+            console.print(f"\n[bold cyan]🧹 LLMキャッシュを削除しました ({removed}件)[/bold cyan]\n")
+        else:
+            stats = llm_cache.stats()
+            status = "ON" if stats["enabled"] else "OFF (--cache で有効化)"
+            console.print(
+                f"\n[bold cyan]🗄️ LLM Cache: {status}[/bold cyan]\n"
+                f"[dim]hits: {stats['hits']} / misses: {stats['misses']} "
+                f"(hit rate {stats['hit_rate']:.0%}) / evictions: {stats['evictions']}\n"
+                f"dir: {stats['cache_dir']}[/dim]\n"
+            )
+        result.handled = True
+        return result, auto_mode, exchange_count
+    
+    # --- /routes ---
+    if lower == "/routes":
+        _show_routes(model_name, provider)
+        result.handled = True
+        return result, auto_mode, exchange_count
+    
+    # --- /perf ---
+    if lower == "/perf":
+        _show_perf()
+        result.handled = True
+        return result, auto_mode, exchange_count
     
+    # --- /ask ---
+    # ask モード用の指示はリクエスト末尾の実行時コンテキストで渡す（messages[0] は書き換えない）
     if sanitized.startswith("/ask"):
         result.is_ask_mode = True
         question = sanitized[4:].strip()
-        messages[0] = get_system_prompt(is_ask_mode=True)
         enforced_question = f"{question}\n\n(※必ずシステムプロンプト内の <project_guidelines> に指定された掟やトーンを厳格に守って回答してください)"
         messages.append({"role": "user", "content": enforced_question})
         return result, auto_mode, exchange_count
@@ -96,7 +129,7 @@ def route_command(
         rule = sanitized[len("/remember "):].strip()
         if rule:
             memory.remember(rule)
-            messages[0] = get_system_prompt()
+            messages[0] = get_agent_system_prompt()
         result.handled = True
         return result, auto_mode, exchange_count
     
@@ -111,7 +144,7 @@ def route_command(
         target = sanitized[len("/forget "):].strip()
         if target:
             memory.forget(target)
-            messages[0] = get_system_prompt()
+            messages[0] = get_agent_system_prompt()
         result.handled = True
         return result, auto_mode, exchange_count
     
@@ -138,3 +171,109 @@ def route_command(
     messages.append({"role": "user", "content": sanitized})
     return result, auto_mode, exchange_count
 
+
+def _show_routes(model_name: str, provider: str) -> None:
+    """呼び出し種別ごとのモデルと、所要時間・節約できた推定時間を表示する。"""
+    table = Table(title="🔀 Model Routes", border_style="cyan")
+    table.add_column("Call type", style="bold")
+    table.add_column("Model")
+    table.add_column("Calls", justify="right")
+    table.add_column("Avg latency", justify="right")
+    table.add_column("Escalations", justify="right")
+    table.add_column("Saved", justify="right")
+    for call_type, label, stats, saved in model_router.report_rows(model_name, provider):
+        table.add_row(
+            call_type,
+            label,
+            str(stats.calls),
+            f"{stats.average_latency:.1f}s" if stats.calls else "-",
+            str(stats.escalations),
+            f"{saved:+.1f}s" if saved is not None else "-",
+        )
+    console.print(table)
+    for endpoint, stats in request_scheduler.stats().items():
+        waits = ", ".join(
+            f"{PRIORITY_NAMES[p]} {total / count:.1f}s" for p, (total, count) in sorted(stats.wait_by_priority.items())
+        )
+        console.print(
+            f"[dim]🚦 {endpoint}: active {stats.active}/{stats.limit}, queued {stats.queued} "
+            f"(max {stats.max_queue_depth}), avg wait {stats.average_wait:.1f}s / max {stats.max_wait:.1f}s"
+            f"{f' [{waits}]' if waits else ''}, cancelled {stats.cancelled}[/dim]"
+        )
+    pool = endpoint_pool.snapshot()
+    if len(pool) > 1:
+        for endpoint in pool:
+            state = "healthy" if endpoint.healthy else f"down (failures {endpoint.failures})"
+            console.print(
+                f"[dim]🖥️ {endpoint.url}: {state}, outstanding {endpoint.outstanding}, requests {endpoint.requests}[/dim]"
+            )
+    console.print("[dim]※ルートは `loca --small-model` または LOCA_ROUTE_<種別> で設定できます。[/dim]\n")
+
+
+def _histogram_bar(counts: list[int]) -> str:
+    """区間ごとの件数をブロック文字の棒（1区間1文字）で表す。"""
+    levels = "▁▂▃▄▅▆▇█"
+    peak = max(counts) or 1
+    return "".join(levels[max(0, round(c / peak * len(levels)) - 1)] if c else "·" for c in counts)
+
+
+def _show_perf() -> None:
+    """このセッションのスパンの所要時間分布と、遅かったステップの内訳を表示する。"""
+    durations = tracer.histograms()
+    if not durations:
+        console.print("\n[dim]まだ計測データがありません。[/dim]\n")
+        return
+
+    bounds = [f"{b * 1000:.0f}ms" if b < 1 else f"{b:.0f}s" for b in HISTOGRAM_BUCKETS]
+    table = Table(title="⏱️ Performance (this session)", border_style="cyan")
+    table.add_column("Span", style="bold")
+    table.add_column("Count", justify="right")
+    table.add_column("Total", justify="right")
+    table.add_column("p50", justify="right")
+    table.add_column("p95", justify="right")
+    table.add_column("Max", justify="right")
+    table.add_column(f"<{bounds[0]} … ≥{bounds[-1]}")
+    for name, values in sorted(durations.items(), key=lambda item: sum(item[1]), reverse=True):
+        table.add_row(
+            name,
+            str(len(values)),
+            f"{sum(values):.1f}s",
+            f"{percentile(values, 0.5):.2f}s",
+            f"{percentile(values, 0.95):.2f}s",
+            f"{max(values):.2f}s",
+            _histogram_bar(histogram_counts(values)),
+        )
+    console.print(table)
+
+    llm_spans = [s for s in tracer.spans if s.name == "llm.call"]
+    if llm_spans:
+        queue_wait = sum(s.attributes.get("queue_wait_seconds", 0.0) for s in llm_spans)
+        ttfts = [s.attributes["ttft_seconds"] for s in llm_spans if "ttft_seconds" in s.attributes]
+        generated = sum(s.attributes.get("completion_tokens", 0) for s in llm_spans)
+        generation = sum(s.attributes.get("generation_seconds", 0.0) for s in llm_spans)
+        console.print(
+            f"[dim]🧠 LLM: {len(llm_spans)} calls, queue wait {queue_wait:.1f}s"
+            f"{f', TTFT p50 {percentile(ttfts, 0.5):.2f}s' if ttfts else ''}"
+            f", {generated} tokens generated"
+            f"{f' ({generated / generation:.1f} tok/s)' if generation else ''}[/dim]"
+        )
+
+    slowest = tracer.slowest("agent.step")
+    if slowest:
+        console.print("[bold]🐢 Slowest steps[/bold]")
+        for span, breakdown in slowest:
+            parts = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in sorted(breakdown.items(), key=lambda i: -i[1]))
+            other = span.duration - sum(breakdown.values())
+            console.print(
+                f"[dim]  #{span.attributes.get('exchange', '?')} ({span.attributes.get('mode', '')}) "
+                f"{span.duration:.1f}s — {parts or 'no child spans'}"
+                f"{f', other {other:.1f}s' if parts and other > 0.05 else ''}"
+                f"{' [cancelled]' if span.error else ''}[/dim]"
+            )
+
+    schema_summary = structured_output.summary()
+    if schema_summary:
+        console.print(f"[dim]📐 Structured output: {schema_summary}[/dim]")
+    if tracer.enabled:
+        console.print(f"[dim]📝 Trace: {tracer.path}（OTLP/JSON 形式の1行1スパン。LOCA_TRACE=0 で無効化）[/dim]")
+    console.print()
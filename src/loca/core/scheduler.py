@@ -0,0 +1,222 @@
+"""
+RequestScheduler: すべてのLLM呼び出しを通す中央のリクエストスケジューラ。
+
+1台のローカルGPUに対して、対話中のエージェントステップとバックグラウンドの処理
+（コミットメッセージ生成・要約・/pro の呼び出し）が無秩序に同時リクエストすると、
+Ollama 側でキューイングやモデルの追い出しが起きて全体が遅くなる。
+エンドポイントごとに同時実行数を制限し（Ollama は OLLAMA_NUM_PARALLEL に従う）、
+空きを待つリクエストは優先度順（対話 > 通常 > バックグラウンド）に実行する。
+待機中のリクエストはキャンセルでき、キューの深さと待ち時間を計測する。
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+
+import loca.config as config
+from loca.core.endpoint_pool import endpoint_pool
+
+# 優先度（小さいほど先に実行）
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_NORMAL: "normal", PRIORITY_BACKGROUND: "background"}
+
+# 呼び出し種別 → 優先度（未指定の種別・/ask はユーザーが待っているので対話扱い）
+CALL_TYPE_PRIORITIES = {
+    "tool_step": PRIORITY_INTERACTIVE,
+    "planning": PRIORITY_NORMAL,
+    "review": PRIORITY_NORMAL,
+    "repair": PRIORITY_NORMAL,
+    "commit_message": PRIORITY_BACKGROUND,
+    "summarization": PRIORITY_BACKGROUND,
+}
+
+
+class RequestCancelled(Exception):
+    """スロット待ちの間にキャンセルされた"""
+
+
+@dataclass(order=True)
+class Ticket:
+    """1リクエスト分の実行権。優先度 → 到着順で並ぶ。"""
+    priority: int
+    seq: int
+    endpoint: str = field(compare=False)
+    enqueued_at: float = field(compare=False, default_factory=time.perf_counter)
+    granted_at: float | None = field(compare=False, default=None)
+    cancelled: bool = field(compare=False, default=False)
+    released: bool = field(compare=False, default=False)
+    event: threading.Event = field(compare=False, default_factory=threading.Event)
+
+    @property
+    def wait_time(self) -> float:
+        return (self.granted_at or time.perf_counter()) - self.enqueued_at
+
+
+@dataclass
+class EndpointStats:
+    """エンドポイントごとのキュー計測"""
+    limit: int
+    active: int = 0
+    queued: int = 0
+    max_queue_depth: int = 0
+    granted: int = 0
+    cancelled: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+    wait_by_priority: dict = field(default_factory=dict)   # 優先度 → (合計待ち秒, 件数)
+
+    @property
+    def average_wait(self) -> float:
+        return self.total_wait / self.granted if self.granted else 0.0
+
+
+def endpoint_for(provider: str) -> str:
+    """同時実行数を共有する単位（プロバイダー。Ollama はエンドポイントプール全体）を返す。"""
+    return provider
+
+
+def endpoint_limit(endpoint: str) -> int:
+    """
+    同時実行数の上限。Ollama はサーバーと同じ OLLAMA_NUM_PARALLEL × プールのサーバー数に合わせる
+    （どのサーバーに送るかは endpoint_pool が実行中リクエストの少ない順に決める）。
+    """
+    if endpoint == "ollama":
+        try:
+            per_server = max(1, int(os.environ.get("OLLAMA_NUM_PARALLEL", "1")))
+        except ValueError:
+            per_server = 1
+        return per_server * endpoint_pool.total_size()
+    return config.CLOUD_MAX_CONCURRENCY
+
+
+class RequestScheduler:
+    """エンドポイントごとの同時実行数制限と優先度付きキューを管理するクラス"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues: dict[str, list[Ticket]] = {}
+        self._stats: dict[str, EndpointStats] = {}
+        self._seq = itertools.count()
+
+    def _endpoint_stats(self, endpoint: str) -> EndpointStats:
+        stats = self._stats.get(endpoint)
+        if stats is None:
+            stats = self._stats[endpoint] = EndpointStats(limit=endpoint_limit(endpoint))
+        return stats
+
+    # ------------------------------------------------------------------
+    # 実行権の取得・返却
+    # ------------------------------------------------------------------
+
+    def submit(self, provider: str, priority: int = PRIORITY_NORMAL) -> Ticket:
+        """実行権を要求する。空きがあれば即座に、なければ順番が来たときに ticket.event がセットされる。"""
+        endpoint = endpoint_for(provider)
+        ticket = Ticket(priority=priority, seq=next(self._seq), endpoint=endpoint)
+        with self._lock:
+            stats = self._endpoint_stats(endpoint)
+            queue = self._queues.setdefault(endpoint, [])
+            heapq.heappush(queue, ticket)
+            stats.queued += 1
+            stats.max_queue_depth = max(stats.max_queue_depth, stats.queued)
+            self._dispatch(endpoint)
+        return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        """実行を終えた実行権を返し、次の待機リクエストに渡す。"""
+        with self._lock:
+            if ticket.released or ticket.granted_at is None:
+                return
+            ticket.released = True
+            self._endpoint_stats(ticket.endpoint).active -= 1
+            self._dispatch(ticket.endpoint)
+
+    def cancel(self, ticket: Ticket) -> bool:
+        """
+        待機中ならキューから外し、実行中なら実行権を返す（返却済みなら何もしない）。
+        既に実行権が割り当てられていた場合は True を返す。
+        """
+        with self._lock:
+            if ticket.granted_at is None and not ticket.cancelled:
+                ticket.cancelled = True
+                stats = self._endpoint_stats(ticket.endpoint)
+                stats.queued -= 1
+                stats.cancelled += 1
+                ticket.event.set()
+                return False
+        self.release(ticket)
+        return ticket.granted_at is not None
+
+    def _dispatch(self, endpoint: str) -> None:
+        """空きスロットに優先度順で実行権を割り当てる（ロック保持中に呼ぶ）。"""
+        stats = self._endpoint_stats(endpoint)
+        queue = self._queues.get(endpoint, [])
+        while queue and stats.active < stats.limit:
+            ticket = heapq.heappop(queue)
+            if ticket.cancelled:
+                continue
+            ticket.granted_at = time.perf_counter()
+            stats.active += 1
+            stats.queued -= 1
+            stats.granted += 1
+            wait = ticket.wait_time
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+            total, count = stats.wait_by_priority.get(ticket.priority, (0.0, 0))
+            stats.wait_by_priority[ticket.priority] = (total + wait, count + 1)
+            ticket.event.set()
+
+    # ------------------------------------------------------------------
+    # コンテキストマネージャー
+    # ------------------------------------------------------------------
+
+    @contextmanager
+    def slot(self, provider: str, call_type: str | None = None, cancel_event: threading.Event | None = None):
+        """
+        実行権を得るまで待ってから本体を実行する（同期版）。
+        cancel_event がセットされたら待機をやめて RequestCancelled を送出する。
+        """
+        ticket = self.submit(provider, CALL_TYPE_PRIORITIES.get(call_type, PRIORITY_INTERACTIVE))
+        try:
+            while not ticket.event.wait(0.1 if cancel_event is not None else None):
+                if cancel_event.is_set():
+                    # タイムアウト直後に割り当てられていても（cancel が実行権を返しても）、実行せずに抜ける
+                    self.cancel(ticket)
+                    raise RequestCancelled()
+            if ticket.cancelled or (cancel_event is not None and cancel_event.is_set()):
+                raise RequestCancelled()
+            yield ticket
+        finally:
+            # 待機中なら取り消し、実行中なら返却する
+            self.cancel(ticket)
+
+    @asynccontextmanager
+    async def aslot(self, provider: str, call_type: str | None = None):
+        """slot の asyncio 版。待機中にタスクがキャンセルされたらキューから外す。"""
+        ticket = self.submit(provider, CALL_TYPE_PRIORITIES.get(call_type, PRIORITY_INTERACTIVE))
+        try:
+            if not ticket.event.is_set():
+                await asyncio.to_thread(ticket.event.wait)
+            if ticket.cancelled:
+                raise RequestCancelled()
+            yield ticket
+        finally:
+            # CancelledError で抜けた場合も、待機中なら取り消し・実行中なら返却する
+            self.cancel(ticket)
+
+    # ------------------------------------------------------------------
+    # 計測
+    # ------------------------------------------------------------------
+
+    def stats(self) -> dict[str, EndpointStats]:
+        with self._lock:
+            return dict(self._stats)
+
+
+# グローバルなインスタンス（llm_client から使用）
+request_scheduler = RequestScheduler()
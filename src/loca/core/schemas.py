@@ -0,0 +1,184 @@
+"""
+構造化出力（JSON Schema による制約付きデコード）の定義と集計。
+
+JSON テキスト方式の呼び出し（FC非対応モデルのアクション、/pro の設計・Reviewer）は、
+extract_json_from_text とリトライで不正な出力を拾っていた。リトライのたびに全体を
+生成し直すことになるため、対応プロバイダーにはスキーマを渡して最初から正しいJSONを出力させる。
+litellm の response_format（json_schema）として渡し、Ollama では format、OpenAI / Gemini では
+各社の構造化出力に変換される。
+"""
+import re
+import threading
+from dataclasses import dataclass
+
+# response_format を渡すプロバイダー（Anthropic は未対応として扱い、従来のJSONパースのみ）
+STRUCTURED_OUTPUT_PROVIDERS = ("ollama", "openai", "gemini")
+# response_format が拒否されたことを示すエラー本文（パラメータ名として現れるもののみ）
+_UNSUPPORTED_FORMAT = re.compile(r"response_format|json[_ ]schema|['\"`]format['\"`]", re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class SchemaSpec:
+    """構造化出力のスキーマ定義"""
+    name: str
+    schema: dict
+
+    def response_format(self) -> dict:
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": self.name, "schema": self.schema, "strict": False},
+        }
+
+
+def agent_action_spec(tool_names: list[str]) -> SchemaSpec:
+    """JSON方式のエージェントアクション（thought / action / args）のスキーマ"""
+    return SchemaSpec("agent_action", {
+        "type": "object",
+        "properties": {
+            "thought": {"type": "string"},
+            "action": {"type": "string", "enum": list(tool_names)},
+            "args": {"type": "object"},
+        },
+        "required": ["thought", "action", "args"],
+    })
+
+
+PRO_PLAN = SchemaSpec("pro_plan", {
+    "type": "object",
+    "properties": {
+        "thought": {"type": "string"},
+        "files": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "filepath": {"type": "string"},
+                    "purpose": {"type": "string"},
+                    "interface": {"type": "string"},
+                },
+                "required": ["filepath", "purpose", "interface"],
+            },
+        },
+    },
+    "required": ["thought", "files"],
+})
+
+REVIEWER_DECISION = SchemaSpec("reviewer_decision", {
+    "type": "object",
+    "properties": {
+        "thought": {"type": "string"},
+        "decision": {"type": "string", "enum": ["approve", "reject"]},
+        "feedback": {"type": "string"},
+    },
+    "required": ["thought", "decision", "feedback"],
+})
+
+REVIEWER_RANKING = SchemaSpec("reviewer_ranking", {
+    "type": "object",
+    "properties": {
+        "thought": {"type": "string"},
+        "ranking": {"type": "array", "items": {"type": "integer"}},
+        "decision": {"type": "string", "enum": ["approve", "reject"]},
+        "feedback": {"type": "string"},
+    },
+    "required": ["thought", "ranking", "decision", "feedback"],
+})
+
+
+@dataclass
+class SchemaStats:
+    """スキーマごとの呼び出し回数とパース失敗（=リトライ）回数"""
+    constrained: int = 0
+    unconstrained: int = 0
+    constrained_failures: int = 0
+    unconstrained_failures: int = 0
+
+    @property
+    def calls(self) -> int:
+        return self.constrained + self.unconstrained
+
+    @property
+    def retry_rate(self) -> float:
+        failures = self.constrained_failures + self.unconstrained_failures
+        return failures / self.calls if self.calls else 0.0
+
+    @property
+    def generations_saved(self) -> float | None:
+        """制約なしの失敗率を基準に、制約付きで避けられた再生成回数を推定する。基準が無ければ None。"""
+        if not self.unconstrained or not self.constrained:
+            return None
+        baseline = self.unconstrained_failures / self.unconstrained
+        return self.constrained * baseline - self.constrained_failures
+
+
+class StructuredOutput:
+    """プロバイダー/モデルごとの構造化出力の可否と、スキーマごとのパース統計を管理するクラス"""
+
+    def __init__(self):
+        self.stats: dict[str, SchemaStats] = {}
+        self._unsupported: set[str] = set()
+        # スキーマ名 → 直近の呼び出しが制約付きだったか（パース失敗の集計先に使う）
+        self._last_constrained: dict[str, bool] = {}
+        self._lock = threading.Lock()
+
+    def supports(self, provider: str, model_name: str) -> bool:
+        return provider in STRUCTURED_OUTPUT_PROVIDERS and f"{provider}/{model_name}" not in self._unsupported
+
+    def mark_unsupported(self, provider: str, model_name: str) -> None:
+        """response_format がエラーになったモデルを記録し、以降は制約なしで呼び出す。"""
+        with self._lock:
+            self._unsupported.add(f"{provider}/{model_name}")
+
+    @staticmethod
+    def is_unsupported_error(e: Exception) -> bool:
+        """
+        400 エラーの本文が response_format（json_schema / Ollama の format）の拒否を示しているか。
+        format 文字列やツールのスキーマ検証など、無関係なエラーには反応しない。
+        """
+        return _UNSUPPORTED_FORMAT.search(str(e)) is not None
+
+    def request_kwargs(self, spec: SchemaSpec | None, provider: str, model_name: str) -> dict:
+        """litellm に渡す response_format を返し、呼び出しを記録する。"""
+        if spec is None:
+            return {}
+        constrained = self.supports(provider, model_name)
+        self.record_request(spec.name, constrained)
+        return {"response_format": spec.response_format()} if constrained else {}
+
+    def record_request(self, name: str, constrained: bool) -> None:
+        with self._lock:
+            stats = self.stats.setdefault(name, SchemaStats())
+            if constrained:
+                stats.constrained += 1
+            else:
+                stats.unconstrained += 1
+            self._last_constrained[name] = constrained
+
+    def record_fallback(self, name: str) -> None:
+        """制約付きで送ったが未対応エラーになり、制約なしで送り直した呼び出しを付け替える。"""
+        with self._lock:
+            stats = self.stats.setdefault(name, SchemaStats())
+            stats.constrained -= 1
+            stats.unconstrained += 1
+            self._last_constrained[name] = False
+
+    def record_parse_failure(self, name: str) -> None:
+        """JSONとして読めずリトライが必要になった応答を記録する。"""
+        with self._lock:
+            stats = self.stats.setdefault(name, SchemaStats())
+            if self._last_constrained.get(name):
+                stats.constrained_failures += 1
+            else:
+                stats.unconstrained_failures += 1
+
+    def summary(self) -> str:
+        parts = []
+        for name, stats in self.stats.items():
+            saved = stats.generations_saved
+            saved_text = f", saved ~{saved:.1f}" if saved is not None else ""
+            parts.append(f"{name}: {stats.calls} calls ({stats.constrained} constrained), retry {stats.retry_rate:.0%}{saved_text}")
+        return " / ".join(parts)
+
+
+# グローバルなインスタンス（llm_client / AgentSession / pro_agent から使用）
+structured_output = StructuredOutput()
@@ -0,0 +1,179 @@
+"""
+TokenCounter: トークン数の計測・推定・集計を一元管理する。
+
+- 実トークナイザーが使えるモデル（OpenAI / Anthropic / Gemini 等）は litellm.token_counter で数える
+- 使えないモデル（Ollama のローカルモデル等）は日英ヒューリスティックで推定し、
+  LLMが返す実際の usage.prompt_tokens との比率で補正していく
+- メッセージ単位で結果をキャッシュし、毎ステップ新しく増えたメッセージだけを数える
+- litellm が返した usage（prompt / completion）をセッション累計として記録する
+"""
+import json
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+_CJK_PATTERN = re.compile(r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FFF]')
+
+# 実トークナイザーを試すプロバイダー（litellm が各社のトークナイザーを同梱している）
+TOKENIZER_PROVIDERS = ("openai", "anthropic", "gemini")
+# チャット形式のメッセージ1件あたりのオーバーヘッド（role 等の制御トークン）
+MESSAGE_OVERHEAD_TOKENS = 4
+# メッセージ単位キャッシュの最大件数
+MESSAGE_CACHE_SIZE = 4096
+# 補正係数の指数移動平均の重み、および極端な値を防ぐ範囲
+CALIBRATION_ALPHA = 0.3
+CALIBRATION_RANGE = (0.3, 3.0)
+# Ollama は KV キャッシュで再利用した分を prompt_tokens (prompt_eval_count) に含めない。
+# 推定値に対する実測値がこの比率を下回ったらキャッシュ再利用とみなし、補正には使わない
+KV_REUSE_RATIO = 0.8
+
+
+def heuristic_tokens(text: str) -> int:
+    """日本語は1文字≈1.5トークン、英語は4文字≈1トークンの簡易推定。"""
+    if not text:
+        return 0
+    ja_chars = len(_CJK_PATTERN.findall(text))
+    en_chars = len(text) - ja_chars
+    return int(ja_chars * 1.5) + int(en_chars / 4)
+
+
+def _message_text(message: dict) -> str:
+    """トークン計測対象となるメッセージ本文（tool_calls の引数も含む）を返す。"""
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        # Anthropic のキャッシュ指定などで content がブロック配列の場合
+        content = "".join(block.get("text", "") for block in content if isinstance(block, dict))
+    tool_calls = message.get("tool_calls")
+    if tool_calls:
+        content += json.dumps(tool_calls, ensure_ascii=False, default=str)
+    return content
+
+
+@dataclass
+class UsageTotals:
+    """LLMが返した実際の usage の累計"""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_prompt_tokens: int = 0
+    # キャッシュから再利用された分も含めたプロンプト全体のトークン数（再利用率の分母）
+    total_prompt_tokens: int = 0
+    calls: int = 0
+    last_prompt_tokens: int = 0
+    last_cached_tokens: int = 0
+    last_total_prompt_tokens: int = 0
+
+    @property
+    def last_cache_hit_ratio(self) -> float:
+        """直近リクエストのプロンプトのうちキャッシュから再利用された割合"""
+        total = self.last_total_prompt_tokens
+        return self.last_cached_tokens / total if total else 0.0
+
+    @property
+    def cache_hit_ratio(self) -> float:
+        """セッション累計のプロンプトキャッシュ再利用率"""
+        total = self.total_prompt_tokens
+        return self.cached_prompt_tokens / total if total else 0.0
+
+
+class TokenCounter:
+    """トークン数の計測・キャッシュ・usage 集計を行うクラス"""
+
+    def __init__(self):
+        self.totals = UsageTotals()
+        self._lock = threading.Lock()
+        self._message_cache: OrderedDict = OrderedDict()
+        # provider/model → 実トークナイザーが使えるか
+        self._has_tokenizer: dict[str, bool] = {}
+        # provider/model → ヒューリスティック推定の補正係数
+        self._calibration: dict[str, float] = {}
+
+    # ------------------------------------------------------------------
+    # 計測
+    # ------------------------------------------------------------------
+
+    def count_text(self, text: str, model_name: str, provider: str) -> int:
+        """テキストのトークン数を返す。実トークナイザーが無ければヒューリスティックで推定する。"""
+        key = f"{provider}/{model_name}"
+        if self._has_tokenizer.get(key, provider in TOKENIZER_PROVIDERS):
+            try:
+                import litellm
+                model = model_name if provider == "openai" else key
+                return litellm.token_counter(model=model, text=text)
+            except Exception:
+                self._has_tokenizer[key] = False
+        return heuristic_tokens(text)
+
+    def count_message(self, message: dict, model_name: str, provider: str) -> int:
+        """メッセージ1件のトークン数（補正前）を返す。同じ内容は2回目以降キャッシュから返す。"""
+        text = _message_text(message)
+        cache_key = (provider, model_name, message.get("role"), text)
+        with self._lock:
+            cached = self._message_cache.get(cache_key)
+            if cached is not None:
+                self._message_cache.move_to_end(cache_key)
+                return cached
+        count = self.count_text(text, model_name, provider) + MESSAGE_OVERHEAD_TOKENS
+        with self._lock:
+            self._message_cache[cache_key] = count
+            if len(self._message_cache) > MESSAGE_CACHE_SIZE:
+                self._message_cache.popitem(last=False)
+        return count
+
+    def count_messages(self, messages: list, model_name: str, provider: str) -> int:
+        """メッセージリスト全体のトークン数を返す（ヒューリスティックの場合は実測で補正済み）。"""
+        raw = sum(self.count_message(m, model_name, provider) for m in messages)
+        return int(raw * self._calibration.get(f"{provider}/{model_name}", 1.0))
+
+    # ------------------------------------------------------------------
+    # usage の記録
+    # ------------------------------------------------------------------
+
+    def record_usage(self, usage, messages: list, model_name: str, provider: str) -> None:
+        """
+        litellm の usage を累計に加え、推定値との比率からヒューリスティックの補正係数を更新する。
+        プロンプトキャッシュの再利用量（OpenAI/Anthropic は usage から、Ollama は推定値との差から）も記録する。
+        usage が None（プロバイダーが返さない場合）は何もしない。
+        """
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = (
+            (getattr(details, "cached_tokens", 0) if details else 0)
+            or getattr(usage, "cache_read_input_tokens", 0)
+            or 0
+        )
+
+        # OpenAI / Anthropic の cached_tokens は prompt_tokens の内数
+        total_prompt_tokens = max(prompt_tokens, cached_tokens)
+
+        key = f"{provider}/{model_name}"
+        calibrate = bool(prompt_tokens) and not self._has_tokenizer.get(key, provider in TOKENIZER_PROVIDERS)
+        if calibrate:
+            raw = sum(self.count_message(m, model_name, provider) for m in messages)
+            previous = self._calibration.get(key)
+            expected = raw * (previous or 1.0)
+            if provider == "ollama" and previous is not None and prompt_tokens < expected * KV_REUSE_RATIO:
+                # KV キャッシュ再利用で評価トークンが減った → 再利用量として記録し、補正はしない
+                cached_tokens = int(expected) - prompt_tokens
+                # 推定した再利用分は評価されたトークン（prompt_tokens）に含まれないので足して分母にする
+                total_prompt_tokens = prompt_tokens + cached_tokens
+            elif raw > 0:
+                ratio = min(max(prompt_tokens / raw, CALIBRATION_RANGE[0]), CALIBRATION_RANGE[1])
+                self._calibration[key] = ratio if previous is None else previous + CALIBRATION_ALPHA * (ratio - previous)
+
+        with self._lock:
+            self.totals.prompt_tokens += prompt_tokens
+            self.totals.completion_tokens += completion_tokens
+            self.totals.cached_prompt_tokens += cached_tokens
+            self.totals.total_prompt_tokens += total_prompt_tokens
+            self.totals.calls += 1
+            self.totals.last_prompt_tokens = prompt_tokens
+            self.totals.last_cached_tokens = cached_tokens
+            self.totals.last_total_prompt_tokens = total_prompt_tokens
+
+
+# グローバルなインスタンス（llm_client / AgentSession から使用）
+token_counter = TokenCounter()
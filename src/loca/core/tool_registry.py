@@ -1,6 +1,11 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from typing import Callable
 
+import loca.config as config
+from loca.core.tracing import tracer
+
 
 @dataclass
 class Tool:
@@ -14,6 +19,8 @@ class Tool:
     required_args: list[str] = field(default_factory=list)
     # (args: dict, auto_mode: bool) -> (result_output: str, should_kill: bool)
     handler: Callable = None
+    # True のツールは副作用が無く、同じターンの他の読み取り専用ツールと並列に実行できる
+    read_only: bool = False
 
     def to_openai_schema(self) -> dict:
         """OpenAI Function Calling 形式のスキーマを返す。thought は自動追加。"""
@@ -62,4 +69,42 @@ class ToolRegistry:
         tool = self.get(name)
         if tool is None:
             return f"Error: 未知のアクション '{name}'", False
-        return tool.handler(args, auto_mode)
+        with tracer.span("tool.execute", tool=name, read_only=tool.read_only) as span:
+            output, should_kill = tool.handler(args, auto_mode)
+            span.set(output_chars=len(output or ""), killed=should_kill)
+            return output, should_kill
+
+    def is_read_only(self, name: str) -> bool:
+        tool = self.get(name)
+        return tool is not None and tool.read_only
+
+    def execute_batch(self, calls: list[dict], auto_mode: bool) -> list[tuple[str, bool]]:
+        """
+        複数のツール呼び出し（{"name", "args"} のリスト）を実行し、呼び出し順に結果を返す。
+        連続する読み取り専用ツールはスレッドプールで並列に、それ以外は1つずつ順番に実行する。
+        should_kill が返ったらそれ以降は実行しない（戻り値はそこまでの分だけになる）。
+        """
+        results: list[tuple[str, bool]] = []
+        i = 0
+        while i < len(calls):
+            j = i
+            while j < len(calls) and self.is_read_only(calls[j]["name"]):
+                j += 1
+            if j - i > 1:
+                group = calls[i:j]
+                with ThreadPoolExecutor(max_workers=min(len(group), config.TOOL_MAX_WORKERS)) as pool:
+                    # スパンの親子関係が途切れないよう、呼び出しごとに現在のコンテキストを引き継ぐ
+                    futures = [
+                        pool.submit(contextvars.copy_context().run, self.execute, c["name"], c["args"], auto_mode)
+                        for c in group
+                    ]
+                    results.extend(f.result() for f in futures)
+                i = j
+                continue
+
+            output, should_kill = self.execute(calls[i]["name"], calls[i]["args"], auto_mode)
+            results.append((output, should_kill))
+            if should_kill:
+                break
+            i += 1
+        return results
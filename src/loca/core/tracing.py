@@ -0,0 +1,239 @@
+"""
+Tracer: ステップ単位のスパン計測と JSONL トレースファイルへの書き出し。
+
+エージェントステップ・ルーター・LLM呼び出し（キュー待ち・TTFT・生成時間・トークン数）・
+ツール・lint・バックアップ・プラグインの処理をスパンとして記録する。
+スパンは OpenTelemetry（OTLP/JSON）の Span と同じ形で1行ずつ書き出すため、
+そのまま jq で集計したり、OTel のツールに取り込んだりできる。
+親子関係は contextvars で引き継ぐ（asyncio のタスク・asyncio.to_thread にも伝わる）。
+/perf はメモリ上に残した直近のスパンからヒストグラムと遅いステップを表示する。
+"""
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import loca.config as config
+
+# /perf のヒストグラムの区切り（秒）
+HISTOGRAM_BUCKETS = (0.01, 0.1, 1.0, 10.0, 60.0)
+
+_current_span: contextvars.ContextVar["Span | None"] = contextvars.ContextVar("loca_span", default=None)
+
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+
+def _otlp_value(value) -> dict:
+    """属性値を OTLP/JSON の AnyValue 形式にする。"""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+@dataclass
+class Span:
+    """1区間の計測結果"""
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    start_ns: int
+    end_ns: int | None = None
+    attributes: dict = field(default_factory=dict)
+    error: str | None = None
+
+    @property
+    def duration(self) -> float:
+        """所要時間（秒）。終了前は現在までの経過時間"""
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def set(self, **attributes) -> None:
+        """属性を追加する（None の値は記録しない）。"""
+        self.attributes.update({k: v for k, v in attributes.items() if v is not None})
+
+    def to_otlp(self) -> dict:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "kind": "SPAN_KIND_INTERNAL",
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in self.attributes.items()],
+            "status": {"code": "STATUS_CODE_ERROR", "message": self.error} if self.error else {"code": "STATUS_CODE_OK"},
+        }
+
+
+class Tracer:
+    """スパンを作ってファイルに書き出し、/perf 用に直近のスパンを保持するクラス"""
+
+    def __init__(self, trace_dir: Path, enabled: bool = True, max_spans: int = 5000,
+                 max_files: int = config.TRACE_MAX_FILES, max_age_seconds: float = config.TRACE_MAX_AGE_SECONDS):
+        self.trace_dir = Path(trace_dir)
+        self.enabled = enabled
+        self.max_files = max_files
+        self.max_age_seconds = max_age_seconds
+        self.trace_id = _new_id(16)
+        self.session_id: str | None = None
+        self.spans: deque[Span] = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+        self._file = None
+
+    @property
+    def path(self) -> Path:
+        return self.trace_dir / f"{time.strftime('%Y%m%d')}-{self.session_id or self.trace_id[:8]}.jsonl"
+
+    def start_session(self, session_id: str) -> None:
+        """セッションごとに trace_id とトレースファイルを分ける。"""
+        with self._lock:
+            self.session_id = session_id
+            self.trace_id = _new_id(16)
+            self.spans.clear()
+            self._close_file()
+
+    def close(self) -> None:
+        """トレースファイルを閉じる（終了時に atexit から呼ばれる）。"""
+        with self._lock:
+            self._close_file()
+
+    def _close_file(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # ------------------------------------------------------------------
+    # 計測
+    # ------------------------------------------------------------------
+
+    @contextmanager
+    def span(self, name: str, activate: bool = True, **attributes):
+        """
+        ブロックの区間をスパンとして記録する。
+        activate=False のスパンは子スパンの親にならない（ストリーミングのジェネレータ内など、
+        yield をまたいでコンテキストを書き換えたくない場合に使う）。
+        """
+        parent = _current_span.get()
+        span = Span(
+            name=name,
+            trace_id=parent.trace_id if parent else self.trace_id,
+            span_id=_new_id(8),
+            parent_id=parent.span_id if parent else None,
+            start_ns=time.time_ns(),
+        )
+        span.set(**attributes)
+        token = _current_span.set(span) if activate else None
+        try:
+            yield span
+        except GeneratorExit:
+            # ストリームを呼び出し側が途中で打ち切った（エラーではない）
+            span.set(closed_early=True)
+            raise
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            if token is not None:
+                _current_span.reset(token)
+            self.finish(span)
+
+    @asynccontextmanager
+    async def aspan(self, name: str, activate: bool = True, **attributes):
+        """span の async with 版（他の非同期コンテキストマネージャーと並べて書くため）"""
+        with self.span(name, activate, **attributes) as span:
+            yield span
+
+    def finish(self, span: Span) -> None:
+        span.end_ns = span.end_ns or time.time_ns()
+        with self._lock:
+            self.spans.append(span)
+            if self.enabled:
+                self._write(span)
+
+    def _write(self, span: Span) -> None:
+        try:
+            if self._file is None:
+                self.trace_dir.mkdir(parents=True, exist_ok=True)
+                self._prune()
+                # セッション中は開いたままにし、start_session / close（終了時は atexit）で閉じる
+                self._file = open(self.path, "a", encoding="utf-8", buffering=1)  # noqa: SIM115
+            self._file.write(json.dumps(span.to_otlp(), ensure_ascii=False) + "\n")
+        except OSError:
+            # 書き込めない環境ではファイル出力だけ止める（/perf は使える）
+            self.enabled = False
+
+    def _prune(self) -> None:
+        """期限切れのトレースファイルを削除し、件数上限を超えていれば mtime の古い順に削除する。"""
+        entries = []
+        now = time.time()
+        for path in self.trace_dir.glob("*.jsonl"):
+            try:
+                mtime = path.stat().st_mtime
+            except OSError:
+                continue
+            if now - mtime > self.max_age_seconds:
+                path.unlink(missing_ok=True)
+                continue
+            entries.append((mtime, path))
+        # これから開くファイルの分を空けておく
+        excess = len(entries) - (self.max_files - 1)
+        for _, path in sorted(entries)[:max(excess, 0)]:
+            path.unlink(missing_ok=True)
+
+    # ------------------------------------------------------------------
+    # 集計（/perf）
+    # ------------------------------------------------------------------
+
+    def histograms(self) -> dict[str, list[float]]:
+        """スパン名 → 所要時間（秒）のリスト"""
+        durations: dict[str, list[float]] = {}
+        with self._lock:
+            for span in self.spans:
+                durations.setdefault(span.name, []).append(span.duration)
+        return durations
+
+    def slowest(self, name: str, limit: int = 5) -> list[tuple[Span, dict[str, float]]]:
+        """
+        名前が name のスパンを遅い順に返す。各スパンには直下の子スパンの名前ごとの合計時間を添える
+        （例: agent.step → {"llm.call": 12.3, "tool.execute": 0.4}）。
+        """
+        with self._lock:
+            spans = list(self.spans)
+        children: dict[str, dict[str, float]] = {}
+        for span in spans:
+            if span.parent_id:
+                breakdown = children.setdefault(span.parent_id, {})
+                breakdown[span.name] = breakdown.get(span.name, 0.0) + span.duration
+        targets = sorted((s for s in spans if s.name == name), key=lambda s: s.duration, reverse=True)
+        return [(s, children.get(s.span_id, {})) for s in targets[:limit]]
+
+
+def percentile(values: list[float], ratio: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(ratio * len(ordered)))]
+
+
+def histogram_counts(values: list[float]) -> list[int]:
+    """HISTOGRAM_BUCKETS の区間ごとの件数（最後は上限超え）"""
+    counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+    for value in values:
+        index = next((i for i, bound in enumerate(HISTOGRAM_BUCKETS) if value < bound), len(HISTOGRAM_BUCKETS))
+        counts[index] += 1
+    return counts
+
+
+# グローバルなインスタンス（AgentSession / llm_client / ツールから使用）
+tracer = Tracer(config.get_cache_dir() / "traces", enabled=config.TRACE_ENABLED)
+atexit.register(tracer.close)
@@ -0,0 +1,134 @@
+"""
+ModelWarmup: 起動直後に Ollama のモデルをバックグラウンドでロードしておく。
+
+20GB 級のモデルはロードだけで数十秒かかり、その待ち時間が最初の質問にそのまま乗ってしまう。
+ヘッダー表示やユーザーの入力中に別スレッドでモデルをロードし（keep_alive 付き）、
+続けてシステムプロンプトだけを評価させて KV キャッシュにプレフィックスを載せておく。
+Ollama 以外のプロバイダーでは何もしない。標準ライブラリ（urllib）だけで通信するため、
+OLLAMA_API_BASE を偽のエンドポイントに向ければそのまま動作を確認できる。
+"""
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import loca.config as config
+from loca.core.endpoint_pool import endpoint_pool
+from loca.core.generation_profiles import profile_builder
+
+# 状態
+WARMUP_SKIPPED = "skipped"   # Ollama 以外 / 無効化されている
+WARMUP_LOADING = "loading"
+WARMUP_READY = "ready"
+WARMUP_FAILED = "failed"
+
+
+class ModelWarmup:
+    """Ollama のモデルロードとプロンプトプレフィックスの事前評価を行うクラス"""
+
+    def __init__(
+        self,
+        model_name: str,
+        provider: str,
+        api_base: str | None = None,
+        keep_alive: str = config.OLLAMA_KEEP_ALIVE,
+        timeout: float = config.WARMUP_TIMEOUT_SECONDS,
+        enabled: bool = config.WARMUP_ENABLED,
+    ):
+        self.model_name = model_name
+        self.provider = provider
+        # None の場合は start() 時点でセッションが固定されるエンドポイントを使う
+        self.api_base = api_base.rstrip("/") if api_base else None
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.state = WARMUP_LOADING if enabled and provider == "ollama" else WARMUP_SKIPPED
+        self.error: str | None = None
+        self.elapsed: float | None = None
+        self._done = threading.Event()
+        self._reported = False
+        if self.state == WARMUP_SKIPPED:
+            self._done.set()
+
+    # ------------------------------------------------------------------
+    # パブリック API
+    # ------------------------------------------------------------------
+
+    def start(self, prefix_messages: list | None = None) -> None:
+        """バックグラウンドスレッドでウォームアップを開始する。prefix_messages は事前評価するメッセージ。"""
+        if self.state == WARMUP_SKIPPED:
+            return
+        if self.api_base is None:
+            self.api_base = endpoint_pool.sticky_url(self.model_name).rstrip("/")
+        thread = threading.Thread(target=self._run, args=(prefix_messages or [],), daemon=True)
+        thread.start()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """ウォームアップの完了を待つ。完了していれば True。"""
+        return self._done.wait(timeout)
+
+    @property
+    def status_text(self) -> str:
+        """ヘッダー等に表示する1行の状態"""
+        if self.state == WARMUP_LOADING:
+            return f"🔥 Loading model in background (keep_alive={self.keep_alive})..."
+        if self.state == WARMUP_READY:
+            return f"✅ Model loaded in {self.elapsed:.1f}s (keep_alive={self.keep_alive})"
+        if self.state == WARMUP_FAILED:
+            return f"⚠️ Warm-up failed: {self.error}"
+        return ""
+
+    def take_report(self) -> str | None:
+        """ヘッダー表示後に完了した場合、その結果を一度だけ返す（以降は None）。"""
+        if self._reported or not self._done.is_set() or self.state == WARMUP_SKIPPED:
+            return None
+        self._reported = True
+        return self.status_text
+
+    # ------------------------------------------------------------------
+    # 内部処理
+    # ------------------------------------------------------------------
+
+    def _run(self, prefix_messages: list) -> None:
+        start = time.perf_counter()
+        # num_ctx が変わると Ollama はモデルを再ロードするため、最初のツールステップと同じ値でロードする
+        num_ctx = profile_builder.build("tool_step", prefix_messages, self.model_name, self.provider).num_ctx
+        options = {"num_ctx": num_ctx} if num_ctx else {}
+        try:
+            # 1. プロンプト無しの generate でモデルをロードする（keep_alive で常駐させる）
+            self._post("/api/generate", {"model": self.model_name, "keep_alive": self.keep_alive, "options": options})
+            # 2. システムプロンプトだけを評価させ、KV キャッシュにプレフィックスを載せる
+            if prefix_messages:
+                self._post("/api/chat", {
+                    "model": self.model_name,
+                    "messages": [
+                        {"role": m["role"], "content": m["content"]}
+                        for m in prefix_messages if isinstance(m.get("content"), str)
+                    ],
+                    "stream": False,
+                    "keep_alive": self.keep_alive,
+                    "options": {**options, "num_predict": 1},
+                })
+            self.state = WARMUP_READY
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            self.error = str(getattr(e, "reason", e))
+            self.state = WARMUP_FAILED
+        finally:
+            self.elapsed = time.perf_counter() - start
+            self._done.set()
+
+    def _post(self, path: str, payload: dict) -> dict:
+        request = urllib.request.Request(
+            self.api_base + path,
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            body = response.read().decode("utf-8")
+        # stream 指定の無い /api/generate は1行1JSONで返ることがあるため最後の行を読む
+        lines = [line for line in body.splitlines() if line.strip()]
+        result = json.loads(lines[-1]) if lines else {}
+        if isinstance(result, dict) and result.get("error"):
+            raise ValueError(result["error"])
+        return result
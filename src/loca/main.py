@@ -3,8 +3,8 @@ import argparse
 from loca.core.agent_session import AgentSession
 
 
-def main(model_name: str, provider: str) -> None:
-    session = AgentSession(model_name=model_name, provider=provider)
+def main(model_name: str, provider: str, tool_mode: str = "auto") -> None:
+    session = AgentSession(model_name=model_name, provider=provider, tool_mode=tool_mode)
     session.run()
 
 
@@ -20,9 +20,28 @@ def cli():
         "-m", "--model", type=str, default=config.DEFAULT_MODEL,
         help="使用するモデル名",
     )
+    parser.add_argument(
+        "--tool-mode", type=str, default="auto",
+        choices=["auto", "native", "partial", "json"],
+        help="ツール呼び出し方式（auto: モデルごとの計測結果に従う / json: Function Callingを使わない）",
+    )
+    parser.add_argument(
+        "--small-model", type=str, default=None,
+        help="コミットメッセージ・要約・修復・ツールステップに使う小型モデル（例: qwen2.5-coder:7b、ollama/qwen2.5-coder:7b）",
+    )
+    parser.add_argument(
+        "--cache", action="store_true",
+        help="LLMレスポンスのディスクキャッシュを有効化する（LOCA_LLM_CACHE=1 と同じ）",
+    )
 
     args = parser.parse_args()
-    main(model_name=args.model, provider=args.provider)
+    if args.cache:
+        from loca.core.llm_cache import llm_cache
+        llm_cache.enabled = True
+    if args.small_model:
+        from loca.core.model_routes import model_router
+        model_router.set_small_model(args.small_model)
+    main(model_name=args.model, provider=args.provider, tool_mode=args.tool_mode)
 
 
 if __name__ == "__main__":
@@ -1,56 +1,240 @@
+"""
+BackupManager: /undo 用のファイルバックアップ。
+
+変更前のファイル内容を <プロジェクト>/.loca/backups に保存する。
+    objects/<sha256 の先頭2文字>/<残り>   zlib 圧縮した内容（同じ内容は1つだけ保存される）
+    index.jsonl                         履歴（1行1件: パス・内容のハッシュ・サイズ・時刻）
+バイト列のまま扱うためバイナリファイルも取り消せる。履歴はメモリに持たず、操作のたびに
+ロックファイルで排他してから index.jsonl を読み直すため、同じプロジェクトで複数の Loca を
+動かしても互いの履歴を壊さない。プロセスを終了しても次のセッションで /undo できる。
+"""
+import json
 import os
-from loca.ui.display import console
+import time
+import zlib
+import hashlib
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import loca.config as config
+from loca.core.tracing import tracer
+
+
+@dataclass(slots=True)
+class BackupEntry:
+    """履歴1件（内容そのものはディスク上の blob にある）"""
+    path: str
+    # 変更前の内容のハッシュ。None → 新規作成されたファイル（undoで削除する）
+    digest: str | None
+    # index.jsonl 内でこの行が始まる位置（undo で切り詰めるのに使う）
+    offset: int
 
 
 class BackupManager:
     """ファイル変更のバックアップを管理し、/undo による取り消しを実現するクラス"""
 
-    def __init__(self):
-        # スタック: [(filepath, old_content_or_None), ...]
-        # old_content が None → 新規作成されたファイル（undoで削除する）
-        self._stack: list[tuple[str, str | None]] = []
+    def __init__(self, root: str | None = None, max_entries: int = config.BACKUP_MAX_ENTRIES):
+        self.root = os.path.abspath(root or os.getcwd())
+        self.store_dir = os.path.join(self.root, config.BACKUP_DIR)
+        self.max_entries = max_entries
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.store_dir, "index.jsonl")
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.store_dir, "objects", digest[:2], digest[2:])
+
+    # ------------------------------------------------------------------
+    # 履歴の読み込み・書き込み
+    # ------------------------------------------------------------------
+
+    @contextmanager
+    def _locked(self):
+        """他の Loca プロセスと排他して履歴を操作する（ストアが無ければ作る）。"""
+        self._ensure_store()
+        with open(os.path.join(self.store_dir, "lock"), "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _load(self) -> tuple[list[BackupEntry], Counter[str]]:
+        """index.jsonl から履歴と内容ごとの参照数を読み込む（ロック中に呼ぶ）。"""
+        entries: list[BackupEntry] = []
+        refs: Counter[str] = Counter()
+        try:
+            with open(self.index_path, "rb") as f:
+                offset = 0
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        entry = BackupEntry(record["path"], record.get("blob"), offset)
+                    except (ValueError, KeyError):
+                        # 書き込み途中で終了した行などは読み飛ばす
+                        entry = None
+                    if entry is not None:
+                        entries.append(entry)
+                        if entry.digest:
+                            refs[entry.digest] += 1
+                    offset += len(line)
+        except OSError:
+            pass
+        return entries, refs
+
+    def _write_blob(self, data: bytes) -> str:
+        """内容を圧縮して保存し、ハッシュを返す（同じ内容が保存済みなら書き込まない）。"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(zlib.compress(data))
+            os.replace(tmp_path, path)
+        return digest
+
+    def _read_blob(self, digest: str) -> bytes:
+        with open(self._blob_path(digest), "rb") as f:
+            return zlib.decompress(f.read())
+
+    def _release(self, refs: Counter[str], digest: str | None) -> None:
+        """履歴から外れた内容の参照を減らし、どこからも参照されなくなった blob を削除する。"""
+        if not digest:
+            return
+        refs[digest] -= 1
+        if refs[digest] <= 0:
+            del refs[digest]
+            try:
+                os.remove(self._blob_path(digest))
+            except OSError:
+                pass
+
+    def _ensure_store(self) -> None:
+        os.makedirs(self.store_dir, exist_ok=True)
+        # バックアップをプロジェクトのコミット（auto_commit の git add -A）に含めない
+        gitignore = os.path.join(self.store_dir, ".gitignore")
+        if not os.path.exists(gitignore):
+            with open(gitignore, "w", encoding="utf-8") as f:
+                f.write("*\n")
+
+    def _display_path(self, path: str) -> str:
+        return path if os.path.isabs(path) else os.path.join(self.root, path)
+
+    # ------------------------------------------------------------------
+    # 公開API
+    # ------------------------------------------------------------------
 
     def save(self, filepath: str):
         """ファイル変更前の状態を保存する"""
+        with tracer.span("backup.save", filepath=filepath) as span:
+            size = self._save(filepath)
+            span.set(bytes=size)
+
+    def _save(self, filepath: str) -> int:
         abs_path = os.path.abspath(filepath)
+        # プロジェクト内のファイルは相対パスで記録する（ディレクトリを移動しても履歴が使える）
+        relpath = os.path.relpath(abs_path, self.root)
+        path = abs_path if relpath.startswith("..") else relpath
+
+        data = None
         if os.path.exists(abs_path):
             try:
-                with open(abs_path, "r", encoding="utf-8") as f:
-                    content = f.read()
-                self._stack.append((abs_path, content))
-            except Exception:
-                # バイナリファイル等で読めない場合はスキップ
-                pass
-        else:
-            # 新規作成されるファイル → undo時に削除
-            self._stack.append((abs_path, None))
+                with open(abs_path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                # 読めないファイル（権限等）は取り消し対象にできない
+                return 0
+
+        with self._locked():
+            # 新規作成されるファイルは digest=None で記録し、undo時に削除する
+            digest = self._write_blob(data) if data is not None else None
+            size = len(data) if data is not None else 0
+            record = {"path": path, "blob": digest, "size": size, "time": round(time.time(), 3)}
+            line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+            with open(self.index_path, "a+b") as f:
+                # 書き込み途中で終了した行があれば、そこに続けて書かないよう改行で区切る
+                if f.seek(0, os.SEEK_END) > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        line = b"\n" + line
+                f.write(line)
+
+            entries, refs = self._load()
+            if len(entries) > self.max_entries:
+                self._evict(entries, refs)
+        return size
+
+    def _evict(self, entries: list[BackupEntry], refs: Counter[str]) -> None:
+        """古い履歴を max_entries 件まで削り、index.jsonl を書き直す（ロック中に呼ぶ）。"""
+        evicted, kept = entries[:-self.max_entries], entries[-self.max_entries:]
+        with open(self.index_path, "rb") as f:
+            f.seek(kept[0].offset)
+            remaining = f.read()
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(remaining)
+        os.replace(tmp_path, self.index_path)
+        for entry in evicted:
+            self._release(refs, entry.digest)
 
     def undo(self) -> tuple[str, bool]:
         """直前の変更を元に戻す。(メッセージ, 成功したか) を返す"""
-        if not self._stack:
-            return "取り消せる変更がありません。", False
+        with self._locked():
+            entries, refs = self._load()
+            if not entries:
+                return "取り消せる変更がありません。", False
 
-        filepath, old_content = self._stack.pop()
+            entry = entries[-1]
+            filepath = self._display_path(entry.path)
+            try:
+                # 履歴から外す（index.jsonl をこの行の手前で切り詰める）
+                with open(self.index_path, "r+b") as f:
+                    f.truncate(entry.offset)
+            except OSError:
+                pass
 
-        try:
-            if old_content is None:
-                # 新規作成されたファイルを削除
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                    return f"🗑️ 新規作成されたファイルを削除しました: {filepath}", True
+            try:
+                if entry.digest is None:
+                    # 新規作成されたファイルを削除
+                    if os.path.exists(filepath):
+                        os.remove(filepath)
+                        return f"🗑️ 新規作成されたファイルを削除しました: {filepath}", True
+                    else:
+                        return f"ファイルは既に存在しません: {filepath}", False
                 else:
-                    return f"ファイルは既に存在しません: {filepath}", False
-            else:
-                # 元の内容に復元
-                with open(filepath, "w", encoding="utf-8") as f:
-                    f.write(old_content)
-                return f"⏪ ファイルを元に戻しました: {filepath}", True
-        except Exception as e:
-            return f"Undo に失敗しました: {e}", False
+                    # 元の内容に復元（バイナリもそのまま書き戻す）
+                    data = self._read_blob(entry.digest)
+                    with open(filepath, "wb") as f:
+                        f.write(data)
+                    return f"⏪ ファイルを元に戻しました: {filepath}", True
+            except Exception as e:
+                return f"Undo に失敗しました: {e}", False
+            finally:
+                self._release(refs, entry.digest)
 
     def has_backups(self) -> bool:
-        return len(self._stack) > 0
+        return self.count > 0
 
     @property
     def count(self) -> int:
-        return len(self._stack)
+        if not os.path.exists(self.index_path):
+            return 0
+        with self._locked():
+            return len(self._load()[0])
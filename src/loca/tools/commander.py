@@ -1,7 +1,7 @@
 import subprocess
 import os
 from pathlib import Path
-from loca.ui.display import console
+from loca.ui.display import console, ask_input
 
 def execute_command(command: str, auto_mode: bool = False) -> str:
     """
@@ -15,13 +15,13 @@ def execute_command(command: str, auto_mode: bool = False) -> str:
         console.print("[dim]🤖 [Auto Mode] コマンドを自動実行します...[/dim]")
     else:
         while True:
-            choice = console.input("[bold]Execute? [y/N/e (edit)]: [/bold]").strip().lower()
+            choice = ask_input("[bold]Execute? [y/N/e (edit)]: [/bold]").strip().lower()
             
             if choice == 'y':
                 break
             elif choice == 'e':
                 # ユーザーがコマンドを手動で修正できるようにする
-                command = console.input("[bold]Edit command: [/bold]").strip()
+                command = ask_input("[bold]Edit command: [/bold]").strip()
                 if not command:
                     return "キャンセルされました。"
                 break
@@ -1,6 +1,7 @@
 import subprocess
-from loca.ui.display import console
+from loca.ui.display import console, ask_input
 from loca.core.llm_client import chat_with_llm
+from loca.core.model_routes import model_router, CALL_COMMIT_MESSAGE
 import loca.config as config
 
 def auto_commit(model_name: str = None, provider: str = None):
@@ -26,7 +27,7 @@ def auto_commit(model_name: str = None, provider: str = None):
     console.print(f"\n[bold]📋 変更されたファイル:[/bold]")
     console.print(f"[dim]{status}[/dim]\n")
     
-    stage_choice = console.input("[bold]これらのファイルを全てステージングしますか？ [Y/n]: [/bold]").strip().lower()
+    stage_choice = ask_input("[bold]これらのファイルを全てステージングしますか？ [Y/n]: [/bold]").strip().lower()
     if stage_choice == 'n':
         console.print("[dim]コミットをキャンセルしました。[/dim]\n")
         return
@@ -45,14 +46,17 @@ def auto_commit(model_name: str = None, provider: str = None):
     ]
     
     # 抽象化されたchat_with_llmを使用
-    res = chat_with_llm(messages, model_name=model_name, provider=provider, is_ask_mode=True)
+    res = chat_with_llm(messages, model_name=model_name, provider=provider, is_ask_mode=True, call_type=CALL_COMMIT_MESSAGE)
+    if "error" in res and model_router.escalate(CALL_COMMIT_MESSAGE):
+        # 小型モデルで失敗した場合はメインモデルで生成し直す
+        res = chat_with_llm(messages, model_name=model_name, provider=provider, is_ask_mode=True, call_type=CALL_COMMIT_MESSAGE)
     commit_msg = res.get("raw_response", "Update files").strip()
     
     console.print(f"\n[bold green]✨ 提案されたメッセージ:[/bold green] {commit_msg}")
-    choice = console.input("[bold]このメッセージでコミットしますか？ [Y/n/e (編集)]: [/bold]").strip().lower()
+    choice = ask_input("[bold]このメッセージでコミットしますか？ [Y/n/e (編集)]: [/bold]").strip().lower()
     
     if choice == 'e':
-        commit_msg = console.input("[bold]新しいコミットメッセージを入力: [/bold]").strip()
+        commit_msg = ask_input("[bold]新しいコミットメッセージを入力: [/bold]").strip()
     elif choice == 'n':
         console.print("[dim]コミットをキャンセルしました。(git addは維持されています)[/dim]\n")
         return
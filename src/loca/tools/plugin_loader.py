@@ -16,6 +16,7 @@ def load_plugins() -> list[dict]:
         TOOL_NAME        (str): アクション名（英小文字・アンダースコア推奨）
         TOOL_DESCRIPTION (str): LLMに伝えるツールの説明
         ARGS_FORMAT      (str): args の JSON フォーマット例（省略可、省略時は "{}"）
+        READ_ONLY        (bool): 副作用が無く並列実行してよいツールなら True（省略可、省略時は False）
         run(args: dict) -> str: 実行関数
     """
     global _plugins
@@ -52,6 +53,7 @@ def load_plugins() -> list[dict]:
                 "description": description,
                 "args_format": args_format,
                 "run": run_fn,
+                "read_only": bool(getattr(mod, "READ_ONLY", False)),
                 "filepath": str(py_file),
             })
             console.print(f"[dim]🔌 Plugin loaded: [bold]{name}[/bold] ({py_file.name})[/dim]")
@@ -1,15 +1,28 @@
 # src/ui/display.py
+import asyncio
+import threading
+
 from rich.console import Console
 from rich.panel import Panel
 from rich.theme import Theme
 from rich.syntax import Syntax
+from rich.console import Group
+from rich.spinner import Spinner
+from rich.text import Text
 # src/ui/display.py の上の方に追加
 from prompt_toolkit import PromptSession
 from prompt_toolkit.styles import Style
 from prompt_toolkit.key_binding import KeyBindings
+from prompt_toolkit.formatted_text import ANSI
+
+from loca.core.cancellation import GenerationCancelled, current_cancel_token
 
 # グローバルにセッションを持たせる（これで上矢印キーで過去の入力履歴を呼び出せます！）
 prompt_session = PromptSession()
+# 確認プロンプト用（y/N などをメイン入力の履歴に混ぜない）
+_confirm_session = PromptSession()
+# メイン入力を受け付けているイベントループ（ワーカースレッドの確認プロンプトをここで受け付ける）
+_input_loop: asyncio.AbstractEventLoop | None = None
 
 # カスタムテーマの定義（お好みの色に変更できます）
 custom_theme = Theme({
@@ -36,6 +49,26 @@ def print_thought(thought: str):
     )
     console.print(panel)
 
+def build_generation_panel(action: str, thought: str, body: str, status: str = "") -> Panel:
+    """ストリーミング生成中のツール呼び出し（thought と生成途中の本文）を表示するパネルを作る"""
+    parts = []
+    if thought:
+        parts.append(Text(thought, style="italic dim"))
+    if body:
+        # 長いファイルは末尾だけ描画して再描画コストを抑える
+        tail = "\n".join(body.splitlines()[-30:])
+        parts.append(Syntax(tail, "python", theme="monokai", line_numbers=False))
+    if not parts:
+        parts.append(Spinner("dots", text=Text("AI is thinking...", style="bold cyan")))
+    title = f"[ai_thought]AI Thought[/ai_thought] → [ai_command]{action}[/ai_command]" if action else "[ai_thought]AI Thought[/ai_thought]"
+    return Panel(
+        Group(*parts),
+        title=title,
+        subtitle=f"[dim]{status}[/dim]" if status else None,
+        border_style="magenta",
+        padding=(0, 1)
+    )
+
 def print_command(command: str):
     """提案されたコマンドをシンタックスハイライトして表示する"""
     if not command or command.lower() == "null":
@@ -59,10 +92,8 @@ def print_success(msg: str):
     """成功メッセージの表示"""
     console.print(f"[success]✔ Success:[/success] {msg}")
 
-def get_user_input():
-    """
-    ユーザーからの入力を受け取る（Enter送信、Alt+Enter改行）
-    """
+def _input_bindings() -> tuple[KeyBindings, Style]:
+    """入力プロンプト用のキーバインドとスタイルを作成する（Enter送信、Alt+Enter改行）"""
     bindings = KeyBindings()
 
     # ① 通常の「Enter」は送信（確定）にする
@@ -78,10 +109,58 @@ def get_user_input():
     style = Style.from_dict({
         'prompt': 'ansicyan bold',
     })
-    
+    return bindings, style
+
+async def get_user_input_async():
+    """
+    ユーザーからの入力を受け取る（Enter送信、Alt+Enter改行）。
+    入力待ちの間もイベントループ上の他の処理を進められる。
+    """
+    global _input_loop
+    _input_loop = asyncio.get_running_loop()
+    bindings, style = _input_bindings()
+
     console.print("\n[dim]💡 [Enter] 送信 / [Alt+Enter] または [Esc]→[Enter] で改行[/dim]")
-    
-    # multiline=Trueにしつつ、自作のキーバインドを適用
-    text = prompt_session.prompt('> ', multiline=True, key_bindings=bindings, style=style)
-    
-    return text.strip()
\ No newline at end of file
+
+    text = await prompt_session.prompt_async('> ', multiline=True, key_bindings=bindings, style=style)
+
+    return text.strip()
+
+
+async def _confirm_async(message: str) -> str | None:
+    """確認プロンプトをイベントループ上で受け付ける（Ctrl-C / Ctrl-D なら None）。"""
+    with console.capture() as capture:
+        console.print(message, end="")
+    try:
+        return await _confirm_session.prompt_async(ANSI(capture.get()))
+    except (KeyboardInterrupt, EOFError):
+        return None
+
+
+def ask_input(message: str) -> str:
+    """
+    確認プロンプト（y/N など）の入力を受け取る。
+    ワーカースレッド（asyncio.to_thread で動くコマンドやツール）から呼ばれた場合は、入力を
+    メインスレッドのイベントループ上で受け付ける。Ctrl-C はその場の中断として GenerationCancelled を送出する。
+    """
+    loop = _input_loop
+    if loop is None or not loop.is_running() or threading.current_thread() is threading.main_thread():
+        return console.input(message)
+
+    token = current_cancel_token.get()
+    future = asyncio.run_coroutine_threadsafe(_confirm_async(message), loop)
+    while True:
+        try:
+            answer = future.result(timeout=0.1)
+            break
+        except TimeoutError:
+            # プロンプト表示中にシグナルで中断された場合も待ち続けない
+            if token is not None and token.cancelled:
+                future.cancel()
+                answer = None
+                break
+    if answer is None:
+        if token is not None:
+            token.cancel()
+        raise GenerationCancelled()
+    return answer
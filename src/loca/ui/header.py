@@ -14,12 +14,15 @@ ASCII_ART = r"""
    LOCAL AI  ·  FREE  ·  YOURS
 """
 
-def print_header(model_name="unknown"):
+def print_header(model_name="unknown", status=""):
     # アスキーアート部分（シアン色で発光）
     title = Text(ASCII_ART, style="bold cyan")
     
     subtitle = Text.from_markup(f"\nSystems Online. Connected to local brain: [bold green]{model_name}[/]")
     subtitle.stylize("dim white") 
+    if status:
+        # モデルのウォームアップ状況など
+        subtitle.append(f"\n{status}", style="dim cyan")
     
     header_content = Text.assemble(title, subtitle)
 